@@ -0,0 +1,80 @@
+"""
+Compare records/sec of :class:`<tfrecorder.encoder.ExampleEncoder>` against the protobuf path
+(`Converter.build_example` + `SerializeToString`), and of the columnar path (`Converter.convert_block`).
+
+Usage: python -m benchmarks.bench_encoder [NUM_ROWS]
+"""
+import random
+import sys
+import time
+
+from tfrecorder.config import Config
+from tfrecorder.convert import Converter
+from tfrecorder.datatype import Column, FeatureType
+from tfrecorder.encoder import ExampleEncoder
+from tfrecorder.utils import ErrorCounter, batch
+
+COLUMNS = [
+    Column("message_type", FeatureType.STRING),
+    Column("timestamp", FeatureType.STRING),
+    Column("concat_count", FeatureType.INT),
+    Column("score", FeatureType.FLOAT),
+    Column("is_bot", FeatureType.BOOL),
+    Column("utterance", FeatureType.STRING),
+]
+
+
+def generate_rows(num_rows: int, seed: int = 0):
+    rng = random.Random(seed)
+    words = ["hello", "nice", "to", "meet", "you", "good", "see", "안녕하세요", ":)"]
+    return [
+        [
+            rng.choice(["SEND", "RECV"]),
+            str(20200427030101 + idx),
+            str(rng.randint(1, 10)),
+            str(rng.random()),
+            rng.choice(["true", "false"]),
+            " ".join(rng.choice(words) for _ in range(rng.randint(3, 30))),
+        ]
+        for idx in range(num_rows)
+    ]
+
+
+def measure(name: str, encode, rows) -> float:
+    started = time.perf_counter()
+    for row in rows:
+        encode(row)
+    elapsed = time.perf_counter() - started
+    print(f"{name:>10}: {len(rows) / elapsed:12,.0f} records/sec")
+    return elapsed
+
+
+def main(num_rows: int = 100000):
+    rows = generate_rows(num_rows)
+    converter = Converter(Config(**{**dict.fromkeys(Config._fields), "columns": COLUMNS, "max_error": -1}))
+    encoder = ExampleEncoder(COLUMNS)
+
+    def build_and_serialize(row):
+        return converter.build_example(row).SerializeToString(deterministic=True)
+
+    for row in rows[:1000]:
+        assert build_and_serialize(row) == encoder.encode(row)
+
+    protobuf = measure("protobuf", build_and_serialize, rows)
+    compiled = measure("encoder", encoder.encode, rows)
+    print(f"{'speedup':>10}: {protobuf / compiled:12.2f}x")
+
+    blocks = list(batch(rows, 1024))
+    assert [record for block in blocks[:1] for record in converter.convert_block(block, ErrorCounter())] == [
+        encoder.encode(row) for row in blocks[0]
+    ]
+    started = time.perf_counter()
+    for block in blocks:
+        converter.convert_block(block, ErrorCounter())
+    columnar = time.perf_counter() - started
+    print(f"{'columnar':>10}: {len(rows) / columnar:12,.0f} records/sec")
+    print(f"{'speedup':>10}: {protobuf / columnar:12.2f}x")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,104 @@
+"""
+Compare the scheduling of the conversion tasks on a synthetic dataset of skewed file sizes:
+groups of `--chunk-size` files in glob order, against groups of `--task-bytes` of input, largest first,
+and against the same with files larger than `--task-bytes` split into byte ranges.
+
+Utilization is the time the pool workers spent converting, over the wall time of the whole pool.
+Stragglers left with the largest files at the end show up as a low utilization and a long wall time.
+Imbalance is measured without running anything as well: groups are assigned to the worker which gets idle first,
+costing their bytes, and the largest load of a worker is divided by the average load. 1.0 is a perfect balance.
+It does not depend on the number of cores of the machine, unlike the wall time.
+
+Usage: python -m benchmarks.bench_scheduling [--rows N] [--files N] [--columns SPEC] [--width N] [--file-type TYPE]
+                                             [--skew S] [--pool-size N] [--chunk-size N] [--task-bytes N]
+"""
+import argparse
+import asyncio
+import heapq
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Any, Dict
+
+from tfrecorder.config import Config
+from tfrecorder.fileio import get_filenames
+from tfrecorder.schedule import plan_task_groups, task_size
+from tfrecorder.worker import Worker
+
+from .bench_suite import load_config
+from .synthetic import add_dataset_arguments, parse_columns, write_dataset
+
+#: Stages which a pool worker spends its time in while converting
+BUSY_STAGES = ("read", "encode", "write")
+
+
+def simulate_imbalance(config: Config) -> float:
+    """Largest load of a pool worker over the average load, when each worker pulls the next group once idle."""
+    tasks = Worker(config, log=False)._split_tasks(list(enumerate(sorted(get_filenames(config.from_path)))))
+    groups = plan_task_groups(tasks, config.task_bytes, config.chunk_size)
+    loads = [0] * config.max_pool_size
+    for group in groups:
+        heapq.heappush(loads, heapq.heappop(loads) + sum(task_size(task) for task in group))
+    return max(loads) / (sum(loads) / len(loads))
+
+
+def run_convert(name: str, config: Config) -> Dict[str, Any]:
+    worker = Worker(config, log=False)
+    started = time.perf_counter()
+    shards = asyncio.run(worker.convert())
+    elapsed = time.perf_counter() - started
+    busy = sum(worker.metrics.timers[stage] for stage in BUSY_STAGES)
+    result = {
+        "schedule": name,
+        "seconds": elapsed,
+        "records_per_sec": sum(shard.num_records for shard in shards) / elapsed,
+        "utilization": busy / (elapsed * config.max_pool_size),
+        "imbalance": simulate_imbalance(config),
+    }
+    print(
+        f"{name:>12}: {elapsed:8.2f}s, {result['records_per_sec']:12,.0f} records/sec, "
+        + f"{result['utilization']:6.1%} utilization, {result['imbalance']:.2f}x imbalance"
+    )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the scheduling of the conversion on skewed file sizes.")
+    add_dataset_arguments(parser)
+    parser.set_defaults(files=40, rows=5000, skew=1.5)
+    parser.add_argument("--pool-size", dest="pool_size", type=int, default=4)
+    parser.add_argument("--chunk-size", dest="chunk_size", type=int, default=10)
+    parser.add_argument("--task-bytes", dest="task_bytes", type=int, default=4 * 2**20)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as directory:
+        metadata_path = write_dataset(
+            directory,
+            parse_columns(args.columns),
+            args.files,
+            args.rows,
+            args.width,
+            args.file_type,
+            args.seed,
+            args.skew,
+        )
+        config = load_config(metadata_path, max_pool_size=args.pool_size, chunk_size=args.chunk_size, batch_size=0)
+        sizes = sorted((os.path.getsize(path) for path in get_filenames(config.from_path)), reverse=True)
+        print(f"{len(sizes)} files, largest {sizes[0] / 2**20:.1f} MiB, smallest {sizes[-1] / 2**20:.2f} MiB")
+
+        results = [
+            run_convert("chunks", config._replace(task_bytes=0, full_convert=True)),
+            run_convert("task-bytes", config._replace(task_bytes=args.task_bytes, full_convert=True)),
+            run_convert(
+                "+split",
+                config._replace(task_bytes=args.task_bytes, split_bytes=args.task_bytes, full_convert=True),
+            ),
+        ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Measure the overhead of collecting the statistics of every column while converting, with `--stats`,
+against converting the same synthetic dataset without them. Each setting is converted `--repeat` times,
+and the fastest run is reported, as the others only add the noise of the machine.
+With `--columnar`, the statistics reuse the values the converter parsed, so they cost less than on the row path.
+
+Usage: python -m benchmarks.bench_stats [--rows N] [--files N] [--columns SPEC] [--width N] [--file-type TYPE]
+                                        [--pool-size N] [--repeat N] [--columnar]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import tempfile
+import time
+from typing import Any, Dict
+
+from tfrecorder.config import Config
+from tfrecorder.worker import Worker
+
+from .bench_suite import load_config
+from .synthetic import add_dataset_arguments, parse_columns, write_dataset
+
+
+def run_convert(name: str, config: Config, repeat: int) -> Dict[str, Any]:
+    elapsed, stats_seconds = float("inf"), 0.0
+    for _ in range(repeat):
+        worker = Worker(config, log=False)
+        started = time.perf_counter()
+        shards = asyncio.run(worker.convert())
+        if time.perf_counter() - started < elapsed:
+            elapsed = time.perf_counter() - started
+            stats_seconds = worker.metrics.timers.get("stats", 0.0)
+    result = {
+        "setting": name,
+        "seconds": elapsed,
+        "records_per_sec": sum(shard.num_records for shard in shards) / elapsed,
+        "stats_seconds": stats_seconds,
+    }
+    print(
+        f"{name:>8}: {elapsed:8.2f}s, {result['records_per_sec']:12,.0f} records/sec, "
+        + f"{stats_seconds:6.2f}s collecting statistics in the pool workers"
+    )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the overhead of collecting the statistics of the columns.")
+    add_dataset_arguments(parser)
+    parser.set_defaults(files=8, rows=50000)
+    parser.add_argument("--pool-size", dest="pool_size", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--columnar", action="store_true")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as directory:
+        metadata_path = write_dataset(
+            directory, parse_columns(args.columns), args.files, args.rows, args.width, args.file_type, args.seed
+        )
+        config = load_config(
+            metadata_path, max_pool_size=args.pool_size, batch_size=0, full_convert=True, columnar=args.columnar
+        )
+        results = [
+            run_convert("baseline", config, args.repeat),
+            run_convert("stats", config._replace(stats=True), args.repeat),
+        ]
+    overhead = results[1]["seconds"] / results[0]["seconds"] - 1
+    print(f"Overhead of the statistics: {overhead:+.1%}")
+    print(json.dumps({"results": results, "overhead": overhead}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+Time each stage of the conversion on a synthetic dataset, and the whole `Worker.convert` across pool sizes
+and chunk sizes. Every case runs in its own process, so its peak RSS is not affected by the other cases.
+
+Results are printed, and written as JSON with `--output`. With `--baseline`, the results are compared against
+a previous output, and the exit code is 1 if records/sec of any case dropped by more than `--tolerance`.
+
+Usage: python -m benchmarks.bench_suite [--rows N] [--files N] [--columns SPEC] [--width N] [--file-type TYPE]
+                                        [--skew S] [--pool-sizes 1,2,4] [--chunk-sizes 1,10] [--output PATH]
+                                        [--baseline PATH] [--tolerance 0.1]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+from tfrecorder.config import Config
+from tfrecorder.convert import Converter
+from tfrecorder.datatype import parse_metadata
+from tfrecorder.encoder import ExampleEncoder
+from tfrecorder.entrypoint import parser as cli_parser
+from tfrecorder.fileio import get_filenames, read_file, save_tfrecord_file
+from tfrecorder.worker import Worker
+
+from .synthetic import add_dataset_arguments, parse_columns, write_dataset
+
+
+def load_config(metadata_path: str, **kwargs) -> Config:
+    """Config with the defaults of the command line, to convert the dataset only."""
+    args = vars(cli_parser.parse_args([metadata_path, "--only-convert"]))
+    args.update(parse_metadata(metadata_path))
+    return Config(**{**args, **kwargs})
+
+
+def load_rows(config: Config) -> List[List[str]]:
+    return [
+        row
+        for path in sorted(get_filenames(config.from_path))
+        for row in read_file(path, config.file_type, skip_header=config.skip_header)
+    ]
+
+
+def peak_rss_mib() -> float:
+    """Peak RSS of this process and its children. `ru_maxrss` is in KiB on Linux, and in bytes on macOS."""
+    unit = 1 if platform.system() == "Darwin" else 1024
+    usage = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    )
+    return usage * unit / 2**20
+
+
+def bench_read_file(config: Config) -> int:
+    return len(load_rows(config))
+
+
+def bench_featurize(config: Config) -> Callable[[], int]:
+    converter = Converter(config)
+    rows = load_rows(config)
+
+    def run() -> int:
+        for row in rows:
+            for value, column in zip(row, config.columns):
+                converter.featurize(value, column.feature_type)
+        return len(rows)
+
+    return run
+
+
+def bench_build_example(config: Config) -> Callable[[], int]:
+    converter = Converter(config)
+    rows = load_rows(config)
+
+    def run() -> int:
+        for row in rows:
+            converter.build_example(row).SerializeToString()
+        return len(rows)
+
+    return run
+
+
+def bench_encoder(config: Config) -> Callable[[], int]:
+    encoder = ExampleEncoder(config.columns)
+    rows = load_rows(config)
+
+    def run() -> int:
+        for row in rows:
+            encoder.encode(row)
+        return len(rows)
+
+    return run
+
+
+def bench_save_tfrecord_file(config: Config) -> Callable[[], int]:
+    converter = Converter(config)
+    examples = [converter.build_example(row) for row in load_rows(config)]
+    path = os.path.join(config.tfrecord_path, "bench.tfrecord")
+
+    def run() -> int:
+        save_tfrecord_file(examples, path, compression_type=config.compression_type, backend=config.writer_backend)
+        return len(examples)
+
+    return run
+
+
+def bench_convert(config: Config) -> int:
+    shards = asyncio.run(Worker(config, log=False).convert())
+    return sum(shard.num_records for shard in shards)
+
+
+#: Benchmarks of each stage. Functions which return a function are timed without their setup.
+STAGES: Dict[str, Callable] = {
+    "read_file": bench_read_file,
+    "featurize": bench_featurize,
+    "build_example": bench_build_example,
+    "encoder": bench_encoder,
+    "save_tfrecord_file": bench_save_tfrecord_file,
+}
+
+
+def _run_case(connection, bench: Callable, config: Config):
+    logging.getLogger().setLevel(logging.WARNING)
+    os.makedirs(config.tfrecord_path, exist_ok=True)
+    started = time.perf_counter()
+    result = bench(config)
+    if callable(result):
+        started = time.perf_counter()
+        result = result()
+    elapsed = time.perf_counter() - started
+    connection.send({"records": result, "seconds": elapsed, "peak_rss_mib": peak_rss_mib()})
+    connection.close()
+
+
+def run_case(name: str, bench: Callable, config: Config, **params) -> Dict[str, Any]:
+    """Run the benchmark in a new process, and return its result."""
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_run_case, args=(sender, bench, config))
+    process.start()
+    measured = receiver.recv()
+    process.join()
+    shutil.rmtree(config.tfrecord_path, ignore_errors=True)
+
+    result = {"benchmark": name, "params": params, **measured}
+    result["records_per_sec"] = measured["records"] / max(measured["seconds"], 1e-9)
+    print(
+        f"{name:>20} {json.dumps(params):>36}: {result['records_per_sec']:12,.0f} records/sec, "
+        + f"{result['peak_rss_mib']:8.1f} MiB peak RSS",
+        file=sys.stderr,
+    )
+    return result
+
+
+def compare(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float) -> List[str]:
+    """Find cases which got slower than the baseline by more than `tolerance`, as a ratio."""
+    baseline_by_case = {(case["benchmark"], json.dumps(case["params"], sort_keys=True)): case for case in baseline}
+    regressions = []
+    for case in results:
+        base = baseline_by_case.get((case["benchmark"], json.dumps(case["params"], sort_keys=True)))
+        if base is not None and case["records_per_sec"] < base["records_per_sec"] * (1 - tolerance):
+            regressions.append(
+                f"{case['benchmark']} {case['params']}: "
+                + f"{base['records_per_sec']:,.0f} -> {case['records_per_sec']:,.0f} records/sec"
+            )
+    return regressions
+
+
+def parse_ints(value: str) -> List[int]:
+    return [int(item) for item in value.split(",")]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark each stage of the conversion on a synthetic dataset.")
+    add_dataset_arguments(parser)
+    parser.add_argument("--pool-sizes", dest="pool_sizes", type=parse_ints, default=[1, multiprocessing.cpu_count()])
+    parser.add_argument("--chunk-sizes", dest="chunk_sizes", type=parse_ints, default=[1, 10])
+    parser.add_argument("--output", type=str, default=None, help="Path to write the results as JSON.")
+    parser.add_argument("--baseline", type=str, default=None, help="Path of previous results to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed drop of records/sec. 0.1 by default.")
+    args = parser.parse_args()
+
+    dataset = {
+        "files": args.files,
+        "rows": args.rows,
+        "columns": args.columns,
+        "width": args.width,
+        "file_type": args.file_type,
+        "skew": args.skew,
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        metadata_path = write_dataset(
+            directory,
+            parse_columns(args.columns),
+            args.files,
+            args.rows,
+            args.width,
+            args.file_type,
+            args.seed,
+            args.skew,
+        )
+        config = load_config(metadata_path)
+
+        results = [run_case(name, bench, config) for name, bench in STAGES.items()]
+        for pool_size in sorted(set(args.pool_sizes)):
+            for chunk_size in sorted(set(args.chunk_sizes)):
+                case_config = config._replace(
+                    max_pool_size=pool_size, chunk_size=chunk_size, task_bytes=0, full_convert=True
+                )
+                results.append(
+                    run_case("convert", bench_convert, case_config, pool_size=pool_size, chunk_size=chunk_size)
+                )
+
+    output = {"dataset": dataset, "python": platform.python_version(), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+    else:
+        print(json.dumps(output, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        if baseline["dataset"] != dataset:
+            print("Baseline was measured on a different dataset, cannot compare", file=sys.stderr)
+            return 1
+        regressions = compare(results, baseline["results"], args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""
+Generate synthetic CSV or TSV datasets for the benchmarks, with the metadata file `tfr` reads.
+
+Usage: python -m benchmarks.synthetic OUTPUT_DIR [--files N] [--rows N] [--columns SPEC] [--width N] [--file-type TYPE]
+                                                [--skew S]
+
+Columns are given as comma separated feature types with optional counts, e.g. `str:2,float:3,int,bool`.
+With `--skew`, the `idx`-th file gets rows in proportion to `(idx + 1) ** -skew`, keeping the total.
+"""
+import argparse
+import csv
+import json
+import os
+import random
+from typing import Iterator, List
+
+from tfrecorder.datatype import Column, FeatureType
+
+DEFAULT_COLUMNS = "str,float,int,bool"
+WORDS = ["hello", "nice", "to", "meet", "you", "good", "see", "안녕하세요", ":)", "well,", '"quoted"']
+
+
+def parse_columns(spec: str) -> List[Column]:
+    """Build columns from the spec like `str:2,float:3,int,bool`."""
+    columns = []
+    for item in spec.split(","):
+        feature_type, _, count = item.strip().partition(":")
+        for _ in range(int(count) if count else 1):
+            columns.append(Column(f"{feature_type}_{len(columns)}", FeatureType(feature_type)))
+    return columns
+
+
+def generate_value(rng: random.Random, feature_type: FeatureType, width: int) -> str:
+    """Generate one value of the type. STRING, BYTES and TOKENIZED values have about `width` words."""
+    if feature_type in (FeatureType.STRING, FeatureType.BYTES, FeatureType.TOKENIZED):
+        return " ".join(rng.choice(WORDS) for _ in range(rng.randint(max(1, width // 2), max(1, width * 3 // 2))))
+    if feature_type == FeatureType.FLOAT:
+        return repr(rng.uniform(-1e6, 1e6))
+    if feature_type == FeatureType.INT:
+        return str(rng.randint(-(2**40), 2**40))
+    if feature_type == FeatureType.BOOL:
+        return rng.choice(["true", "false", "1", "0"])
+    if feature_type == FeatureType.CATEGORICAL:
+        return rng.choice(WORDS)
+    raise ValueError(f"Got unexpected feature type: {feature_type}")
+
+
+def file_rows(num_files: int, rows: int, skew: float = 0.0) -> List[int]:
+    """Number of rows of each file, `rows` on average, the first files being the largest if `skew` is positive."""
+    weights = [(idx + 1) ** -skew for idx in range(num_files)]
+    return [max(1, round(rows * num_files * weight / sum(weights))) for weight in weights]
+
+
+def generate_rows(columns: List[Column], num_rows: int, width: int = 8, seed: int = 0) -> Iterator[List[str]]:
+    rng = random.Random(seed)
+    for _ in range(num_rows):
+        yield [generate_value(rng, column.feature_type, width) for column in columns]
+
+
+def write_dataset(
+    directory: str,
+    columns: List[Column],
+    num_files: int,
+    rows_per_file: int,
+    width: int = 8,
+    file_type: str = "tsv",
+    seed: int = 0,
+    skew: float = 0.0,
+) -> str:
+    """
+    Write the dataset of `num_files` files with a header row, and its metadata file.
+    Every file has `rows_per_file` rows, unless `skew` is set, see :func:`file_rows`.
+
+    :return: Path of the metadata file
+    """
+    os.makedirs(directory, exist_ok=True)
+    for idx, num_rows in enumerate(file_rows(num_files, rows_per_file, skew)):
+        rows = generate_rows(columns, num_rows, width, seed=seed + idx)
+        with open(os.path.join(directory, f"part-{idx:05d}.{file_type}"), "w", newline="") as f:
+            if file_type == "csv":
+                writer = csv.writer(f)
+                writer.writerow([column.name for column in columns])
+                writer.writerows(rows)
+                continue
+            # TSV values never contain tabs or newlines, and are not quoted
+            f.write("\t".join(column.name for column in columns) + "\n")
+            f.writelines("\t".join(row) + "\n" for row in rows)
+
+    metadata = {
+        "name": "synthetic",
+        "convert": {
+            "from_path": os.path.join(directory, f"*.{file_type}"),
+            "file_type": file_type,
+            "skip_header": True,
+            "to_path": os.path.join(directory, "tfrecords", ""),
+        },
+        "columns": [{"name": column.name, "feature_type": column.feature_type.value} for column in columns],
+    }
+    metadata_path = os.path.join(directory, "metadata.json")
+    with open(metadata_path, "w") as f:
+        json.dump(metadata, f, indent=2)
+    return metadata_path
+
+
+def add_dataset_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--files", type=int, default=4, help="Number of files. Use 4 by default.")
+    parser.add_argument("--rows", type=int, default=25000, help="Number of rows in each file. Use 25000 by default.")
+    parser.add_argument(
+        "--columns",
+        type=str,
+        default=DEFAULT_COLUMNS,
+        help=f"Feature types of the columns. Use {DEFAULT_COLUMNS} by default.",
+    )
+    parser.add_argument("--width", type=int, default=8, help="Average words of STRING values. Use 8 by default.")
+    parser.add_argument("--file-type", dest="file_type", choices=("csv", "tsv"), default="tsv")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--skew", type=float, default=0.0, help="Skew of the file sizes, e.g. 1.5. Same size (0) by default."
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic CSV or TSV dataset.")
+    parser.add_argument("output_dir", metavar="OUTPUT_DIR", type=str)
+    add_dataset_arguments(parser)
+    args = parser.parse_args()
+    metadata_path = write_dataset(
+        args.output_dir,
+        parse_columns(args.columns),
+        args.files,
+        args.rows,
+        args.width,
+        args.file_type,
+        args.seed,
+        args.skew,
+    )
+    print(metadata_path)
+
+
+if __name__ == "__main__":
+    main()
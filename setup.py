@@ -4,7 +4,8 @@ setup(
     name="tfrecorder",
     version="0.0.1",
     description="Covert CSV, TSV files to TFRecord and upload to Google Cloud Storage automatically",
-    install_requires=["tensorflow==2.1.0", "tqdm"],
+    install_requires=["numpy", "tensorflow==2.1.0", "tqdm", "google-cloud-storage", "google-crc32c"],
+    extras_require={"zstd": ["zstandard"]},
     entry_points={"console_scripts": ["tfr=tfrecorder.entrypoint:main"]},
     url="https://github.com/harrydrippin/tfrecorder.git",
     author="Seunghwan Hong",
@@ -7,17 +7,47 @@ from tfrecorder.datatype import Column, FeatureType
 def config():
     return {
         "metadata_path": "./tests/data.tfrecord",
+        "command": None,
         # Argument Configuration
         "only_convert": False,
         "only_upload": False,
         "delete_after_upload": True,
+        "yes": True,
         "batch_size": 1000,
+        "target_shard_bytes": 0,
+        "num_shards": 0,
+        "shuffle_buckets": 0,
+        "seed": 0,
+        "num_partitions": 1,
+        "partition_index": 0,
         "max_pool_size": 8,
         "chunk_size": 10,
+        "task_bytes": 64 * 2**20,
+        "upload_queue_size": 16,
+        "diskless": False,
+        "diskless_buffer_bytes": 16 * 2**20,
+        "full_convert": False,
         "compression_type": "GZIP",
+        "compression_level": -1,
+        "compression_threads": 1,
+        "record_index": False,
+        "writer_backend": "native",
+        "split_bytes": 0,
         "max_error": -1,
+        "stats": False,
+        "columnar": False,
+        "block_size": 1024,
         "gcp_project_id": "PROJECT_ID",
         "bucket_location": "us-central1",
+        "upload_concurrency": 4,
+        "upload_chunk_size": 8 * 2**20,
+        "upload_retries": 5,
+        "sync": False,
+        "delete_remote": False,
+        "local_bucket_dir": None,
+        "metrics_path": None,
+        "prometheus_path": None,
+        "profile": None,
         # Metadata Configuration
         "name": "sample_dataset",
         "from_path": "./tests/data/sample_metadata.json",
@@ -17,3 +17,19 @@ def test_get_exec_mode(only_convert, only_upload, expected, config):
     config["only_upload"] = only_upload
     config = Config(**config)
     assert expected == config.exec_mode
+
+
+def test_get_exec_mode_verify(config):
+    assert ExecutionMode.VERIFY == Config(**{**config, "command": "verify"}).exec_mode
+
+
+def test_get_exec_mode_merge_manifests(config):
+    assert ExecutionMode.MERGE_MANIFESTS == Config(**{**config, "command": "merge-manifests"}).exec_mode
+
+
+@pytest.mark.parametrize("num_partitions, partition_index, expected", [(1, 0, "dataset"), (3, 2, "dataset.p0002")])
+def test_shard_name(num_partitions, partition_index, expected, config):
+    config = Config(
+        **{**config, "name": "dataset", "num_partitions": num_partitions, "partition_index": partition_index}
+    )
+    assert expected == config.shard_name
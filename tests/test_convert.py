@@ -1,9 +1,12 @@
+import numpy as np
 import pytest
 import tensorflow as tf
 
 from tfrecorder.config import Config
 from tfrecorder.convert import Converter
 from tfrecorder.datatype import FeatureType
+from tfrecorder.stats import DatasetStats
+from tfrecorder.utils import ErrorCounter
 
 
 @pytest.fixture(scope="session")
@@ -12,7 +15,7 @@ def features():
         tf.train.Feature(bytes_list=tf.train.BytesList(value=["String".encode()])),
         tf.train.Feature(float_list=tf.train.FloatList(value=[4.5])),
         tf.train.Feature(int64_list=tf.train.Int64List(value=[1])),
-        tf.train.Feature(int64_list=tf.train.Int64List(value=[True])),
+        tf.train.Feature(int64_list=tf.train.Int64List(value=[1])),
     ]
 
 
@@ -32,7 +35,9 @@ def test_featurize(features, tensor, feature_type, expected_index, config):
 
 
 @pytest.mark.parametrize(
-    "data_list", [pytest.param(["String", "4.5", "1", "True"])], ids=["Base"],
+    "data_list",
+    [pytest.param(["String", "4.5", "1", "True"])],
+    ids=["Base"],
 )
 def test_build_example(data_list, features, config):
     example = tf.train.Example(
@@ -42,3 +47,59 @@ def test_build_example(data_list, features, config):
     )
     converter = Converter(Config(**config))
     assert example == converter.build_example(data_list)
+
+
+@pytest.fixture
+def rows():
+    return [
+        ["String", "4.5", "1", "True"],
+        ["", "1e40", "-9223372036854775808", " FALSE "],
+        ["Wrong", "length"],
+        ["안녕", "not a float", "1", "1"],
+        ["Int", "0.5", "9223372036854775808", "0"],
+        ["Last", "-0.0", "300", "true"],
+    ]
+
+
+def test_convert_block(rows, config):
+    converter = Converter(Config(**config))
+    expected = [converter.encoder.encode(row) for row in (rows[0], rows[1], rows[5])]
+    errors = ErrorCounter()
+    assert expected == converter.convert_block(rows, errors)
+    assert 3 == errors.count
+
+
+@pytest.mark.parametrize("columnar", [False, True], ids=["Row", "Columnar"])
+@pytest.mark.parametrize(
+    "max_error, expected_count", [pytest.param(-1, 3), pytest.param(3, 2)], ids=["No Limit", "Limit"]
+)
+def test_convert_one_file(columnar, max_error, expected_count, rows, config, tmp_path):
+    path = tmp_path / "sample.tsv"
+    path.write_text("".join("\t".join(row) + "\n" for row in rows))
+    converter = Converter(Config(**{**config, "columnar": columnar, "block_size": 2, "max_error": max_error}))
+
+    records = []
+    try:
+        for record in converter.convert_one_file(str(path)):
+            records.append(record)
+    except ValueError:
+        pass
+    assert [converter.encoder.encode(rows[idx]) for idx in (0, 1, 5)][:expected_count] == records
+
+
+def test_stats_of_both_paths(config, tmp_path):
+    path = tmp_path / "sample.tsv"
+    path.write_text(
+        "".join(f"row\t{value}\t{idx}\t1\n" for idx, value in enumerate(["0.1", "3.3333333", "1e39", "-2.7"]))
+    )
+    summaries = []
+    for columnar in (False, True):
+        converter = Converter(Config(**{**config, "columnar": columnar, "stats": True}))
+        stats = DatasetStats(converter.config.columns)
+        list(converter.convert_one_file(str(path), stats=stats))
+        summaries.append(stats.summary())
+
+    # Values are counted as float32, as they are stored
+    assert summaries[0] == summaries[1]
+    assert float(np.float32(3.3333333)) == summaries[0]["columns"]["second"]["max"]
+    assert 3 == summaries[0]["columns"]["second"]["finite"]
@@ -1,4 +1,6 @@
-from tfrecorder.datatype import Column, FeatureType, parse_metadata
+import pytest
+
+from tfrecorder.datatype import Column, FeatureType, parse_column, parse_metadata
 
 
 def test_parse_metadata():
@@ -16,3 +18,35 @@ def test_parse_metadata():
         ],
     }
     assert expected == parse_metadata("./tests/data/sample_metadata.json")
+
+
+def test_parse_column():
+    assert Column("label", FeatureType.CATEGORICAL, min_count=2, max_vocab_size=100) == parse_column(
+        {"name": "label", "feature_type": "categorical", "min_count": 2, "max_vocab_size": 100}
+    )
+    with pytest.raises(ValueError):
+        parse_column({"name": "label", "feature_type": "categorical", "min_cnt": 2})
+
+
+def test_parse_tokenized_column():
+    assert Column("text", FeatureType.TOKENIZED, tokenizer="regex", max_tokens=128, length_feature=True) == (
+        parse_column(
+            {
+                "name": "text",
+                "feature_type": "tokenized",
+                "tokenizer": "regex",
+                "max_tokens": 128,
+                "length_feature": True,
+            }
+        )
+    )
+
+
+@pytest.mark.parametrize(
+    "options",
+    [{"tokenizer": "bpe"}, {"tokenizer": "wordpiece"}, {"tokenizer": "regex", "pattern": "("}],
+    ids=["Unknown", "Without Vocab", "Invalid Pattern"],
+)
+def test_parse_invalid_tokenized_column(options):
+    with pytest.raises(ValueError):
+        parse_column({"name": "text", "feature_type": "tokenized", **options})
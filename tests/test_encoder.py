@@ -0,0 +1,101 @@
+import pytest
+
+from tfrecorder.config import Config
+from tfrecorder.convert import Converter
+from tfrecorder.datatype import Column, FeatureType
+from tfrecorder.encoder import ExampleEncoder, encode_varint
+from tfrecorder.utils import ErrorCounter
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [pytest.param(0, b"\x00"), pytest.param(127, b"\x7f"), pytest.param(300, b"\xac\x02")],
+    ids=["Zero", "One Byte", "Two Bytes"],
+)
+def test_encode_varint(value, expected):
+    assert expected == encode_varint(value)
+
+
+@pytest.mark.parametrize(
+    "data_list",
+    [
+        pytest.param(["String", "4.5", "1", "True"]),
+        pytest.param(["", "-0.0", "-1", "false"]),
+        pytest.param(["안녕하세요 :)" * 20, "1e40", "9223372036854775807", " 1 "]),
+        pytest.param(["x" * 200, "nan", "-9223372036854775808", "FALSE"]),
+        pytest.param(["\t", "3.4028235e38", "1234567890123", "yes"]),
+    ],
+    ids=["Base", "Empty & Negative", "Long & Overflow", "Long Key & Min", "Misc"],
+)
+def test_encode_is_identical_to_protobuf(data_list, config):
+    converter = Converter(Config(**config))
+    encoder = ExampleEncoder(config["columns"])
+    assert converter.build_example(data_list).SerializeToString(deterministic=True) == encoder.encode(data_list)
+
+
+def test_encode_column_order(config):
+    columns = [Column("c" * 300, FeatureType.INT), Column("b", FeatureType.STRING), Column("가", FeatureType.FLOAT)]
+    converter = Converter(Config(**{**config, "columns": columns}))
+    expected = converter.build_example(["7", "value", "0.5"])
+    assert expected.SerializeToString(deterministic=True) == ExampleEncoder(columns).encode(["7", "value", "0.5"])
+    assert expected == type(expected).FromString(ExampleEncoder(columns).encode(["7", "value", "0.5"]))
+
+
+@pytest.mark.parametrize(
+    "data_list",
+    [
+        pytest.param(["String", "4.5", "1"]),
+        pytest.param(["String", "four", "1", "True"]),
+        pytest.param(["String", "4.5", "9223372036854775808", "True"]),
+    ],
+    ids=["Length", "Float", "Int Range"],
+)
+def test_encode_invalid(data_list, config):
+    with pytest.raises(ValueError):
+        ExampleEncoder(config["columns"]).encode(data_list)
+
+
+@pytest.mark.parametrize("columnar", [False, True], ids=["Row", "Columnar"])
+def test_encode_categorical(columnar, config):
+    columns = [Column("label", FeatureType.CATEGORICAL), Column("count", FeatureType.INT)]
+    vocabularies = {"label": {"RECV": 0, "SEND": 1}}
+    converter = Converter(Config(**{**config, "columns": columns}), vocabularies)
+    rows = [["SEND", "3"], ["RECV", "4"], ["UNKNOWN", "5"]]
+
+    if columnar:
+        records = converter.convert_block(rows, ErrorCounter())
+    else:
+        records = [converter.encoder.encode(row) for row in rows]
+    # Values out of the vocabulary get the ID right after the last one
+    expected = ExampleEncoder([Column("label", FeatureType.INT), columns[1]])
+    assert [expected.encode(row) for row in [["1", "3"], ["0", "4"], ["2", "5"]]] == records
+    assert [converter.build_example(row).SerializeToString(deterministic=True) for row in rows] == records
+
+
+def test_encode_categorical_without_vocabulary():
+    with pytest.raises(ValueError):
+        ExampleEncoder([Column("label", FeatureType.CATEGORICAL)])
+
+
+@pytest.mark.parametrize("columnar", [False, True], ids=["Row", "Columnar"])
+def test_encode_tokenized(columnar, config):
+    columns = [
+        Column("text", FeatureType.TOKENIZED, length_feature=True),
+        Column("text_id", FeatureType.INT),
+        Column("title", FeatureType.TOKENIZED, tokenizer="regex", max_tokens=2),
+    ]
+    vocabularies = {"text": {"hello": 0, "world": 1}, "title": {"a": 300}}
+    converter = Converter(Config(**{**config, "columns": columns}), vocabularies)
+    rows = [["hello world", "1", "a, a"], ["", "2", ""], ["world unknown " * 100, "3", "b"]]
+
+    if columnar:
+        records = converter.convert_block(rows, ErrorCounter())
+    else:
+        records = [converter.encoder.encode(row) for row in rows]
+    examples = [converter.build_example(row) for row in rows]
+    # Only parsed, since upb sorts `text` after `text_id` and `text_length` unlike the byte order
+    assert examples == [type(example).FromString(record) for example, record in zip(examples, records)]
+    assert [0, 1] == examples[0].features.feature["text"].int64_list.value
+    assert [300, 1] == examples[0].features.feature["title"].int64_list.value
+    assert [] == examples[1].features.feature["text"].int64_list.value
+    assert [2, 0, 200] == [example.features.feature["text_length"].int64_list.value[0] for example in examples]
@@ -0,0 +1,56 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+from tfrecorder.config import ExecutionMode
+from tfrecorder.entrypoint import parse_arguments, parser
+
+IMPORT_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import tfrecorder.entrypoint
+elapsed = time.perf_counter() - started
+heavy = [name for name in ("tensorflow", "google.cloud.storage", "google.api_core") if name in sys.modules]
+print(json.dumps({"seconds": elapsed, "heavy": heavy}))
+"""
+
+
+def test_import_time():
+    output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], check=True, capture_output=True, text=True)
+    result = json.loads(output.stdout.strip().splitlines()[-1])
+
+    # TensorFlow and the Google Cloud client libraries are only imported in the code paths which need them
+    assert [] == result["heavy"]
+    # TensorFlow alone takes seconds to import
+    assert result["seconds"] < 1.5
+
+
+@pytest.mark.parametrize("argv, expected", [([], False), (["--yes"], True), (["-y"], True)])
+def test_yes(argv, expected):
+    assert expected == parser.parse_args(["metadata.json"] + argv).yes
+
+
+def test_parse_verify():
+    config = parse_arguments(["verify", "./tests/data/sample_metadata.json", "--max-pool-size", "2"])
+    assert ExecutionMode.VERIFY == config.exec_mode
+    assert 2 == config.max_pool_size
+
+
+def test_parse_merge_manifests():
+    config = parse_arguments(["merge-manifests", "./tests/data/sample_metadata.json", "--num-partitions", "3"])
+    assert ExecutionMode.MERGE_MANIFESTS == config.exec_mode
+    assert 3 == config.num_partitions
+
+
+@pytest.mark.parametrize("argv", [["--num-partitions", "0"], ["--num-partitions", "2", "--partition-index", "2"]])
+def test_parse_invalid_partition(argv):
+    with pytest.raises(ValueError):
+        parse_arguments(["verify", "./tests/data/sample_metadata.json"] + argv)
+
+
+@pytest.mark.parametrize("argv", [["--diskless"], ["--diskless-buffer-bytes", "1000"]])
+def test_parse_invalid_diskless(argv):
+    with pytest.raises(ValueError, match="--diskless"):
+        parse_arguments(["verify", "./tests/data/sample_metadata.json"] + argv)
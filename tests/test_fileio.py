@@ -1,6 +1,35 @@
+import bz2
+import gzip
+import hashlib
+import io
+import lzma
+import os
+
 import pytest
 
-from tfrecorder.fileio import get_filenames, read_file
+from tfrecorder.fileio import (
+    INDEX_SUFFIX,
+    BucketWriter,
+    IndexedTFRecordReader,
+    ShardInfo,
+    ShardSpan,
+    ShardWriter,
+    combine_digests,
+    file_digest,
+    get_filenames,
+    index_filename,
+    input_compression,
+    merge_shard_spans,
+    partition_of,
+    plan_fixed_shards,
+    read_file,
+    read_tfrecord_file,
+    split_file,
+    split_file_digest,
+    write_record_index,
+)
+from tfrecorder.tfrecord import TFRecordWriter
+from tfrecorder.utils import ErrorCounter
 
 
 @pytest.fixture
@@ -16,6 +45,12 @@ def test_get_filenames():
     assert expected == set(get_filenames("./tests/data/*.tsv"))
 
 
+def test_partition_of():
+    # Same on every run and every node, unlike hash() of str
+    assert [1, 2, 3, 0, 2, 0, 1, 0] == [partition_of(f"data/{idx}.tsv", 4) for idx in range(8)]
+    assert {0} == {partition_of(f"data/{idx}.tsv", 1) for idx in range(8)}
+
+
 @pytest.mark.parametrize(
     "path, mode, skip_header",
     [
@@ -27,4 +62,296 @@ def test_get_filenames():
     ids=["CSV", "CSV (Header)", "TSV", "TSV (Header)"],
 )
 def test_read_file(path, mode, skip_header, expected_file_output):
-    assert expected_file_output == read_file(path, mode, skip_header=skip_header)
+    assert expected_file_output == list(read_file(path, mode, skip_header=skip_header))
+
+
+def test_read_quoted_csv(tmp_path):
+    path = tmp_path / "sample.csv"
+    path.write_text('SEND,"Hello, world!"\r\nRECV,"Two\nlines with ""quotes"""\n\nSEND,"broken"quote\nRECV,last\n')
+
+    errors = ErrorCounter()
+    rows = list(read_file(str(path), "csv", errors=errors))
+    assert [["SEND", "Hello, world!"], ["RECV", 'Two\nlines with "quotes"'], ["RECV", "last"]] == rows
+    assert 1 == errors.count
+
+
+def test_read_tsv_keeps_quotes(tmp_path):
+    path = tmp_path / "sample.tsv"
+    path.write_text('SEND\t"Hello"\tworld\n')
+    assert [["SEND", '"Hello"', "world"]] == list(read_file(str(path), "tsv"))
+
+
+def test_file_digest_of_ranges(tmp_path):
+    path = tmp_path / "sample.tsv"
+    path.write_bytes(b"first\nsecond\nthird\n")
+    assert hashlib.sha256(b"second\n").hexdigest() == file_digest(str(path), chunk_size=4, start=6, stop=13)
+
+    # One range is the whole file, and ranges are combined in order
+    assert file_digest(str(path)) == split_file_digest(str(path), 0)
+    ranges = split_file(str(path), 7)
+    assert 1 < len(ranges)
+    assert combine_digests([file_digest(str(path), start=start, stop=stop) for start, stop in ranges]) == (
+        split_file_digest(str(path), 7)
+    )
+
+
+def test_read_tsv_keeps_carriage_returns(tmp_path):
+    path = tmp_path / "sample.tsv"
+    path.write_bytes(b"a\thello\rworld\nb\tcrlf\r\n")
+    # Only the CR of CRLF ends the line
+    assert [["a", "hello\rworld"], ["b", "crlf"]] == list(read_file(str(path), "tsv"))
+
+
+@pytest.mark.parametrize("file_type", ["csv", "tsv"])
+def test_read_long_fields(file_type, tmp_path):
+    path = tmp_path / f"sample.{file_type}"
+    long_value = "x" * 200000
+    delimiter = "," if file_type == "csv" else "\t"
+    path.write_text(f"a{delimiter}{long_value}\nb{delimiter}short\n")
+
+    errors = ErrorCounter()
+    assert [["a", long_value], ["b", "short"]] == list(read_file(str(path), file_type, errors=errors))
+    assert 0 == errors.count
+
+
+@pytest.mark.parametrize(
+    "filename, compress",
+    [
+        pytest.param("sample.tsv.gz", lambda data: gzip.compress(data[:30]) + gzip.compress(data[30:])),
+        pytest.param("sample.tsv.bz2", bz2.compress),
+        pytest.param("sample.tsv.xz", lzma.compress),
+        pytest.param("sample.dat", gzip.compress),
+    ],
+    ids=["GZIP (Multi-member)", "BZ2", "XZ", "GZIP (Magic bytes)"],
+)
+def test_read_compressed_file(filename, compress, expected_file_output, tmp_path):
+    with open("./tests/data/sample_tsv_with_header.tsv", "rb") as f:
+        data = f.read()
+    path = tmp_path / filename
+    path.write_bytes(compress(data))
+
+    assert input_compression(str(path)) is not None
+    assert [(0, path.stat().st_size)] == split_file(str(path), 1)
+    assert expected_file_output == list(read_file(str(path), "tsv", skip_header=True))
+
+
+def test_read_zstd_file(expected_file_output, tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    with open("./tests/data/sample_tsv.tsv", "rb") as f:
+        data = f.read()
+    path = tmp_path / "sample.tsv.zst"
+    compressor = zstandard.ZstdCompressor()
+    path.write_bytes(compressor.compress(data[:30]) + compressor.compress(data[30:]))
+    assert expected_file_output == list(read_file(str(path), "tsv"))
+
+
+def test_uncompressed_file_is_detected():
+    assert input_compression("./tests/data/sample_tsv.tsv") is None
+
+
+@pytest.mark.parametrize("split_bytes", [0, 1, 20, 30, 1000])
+@pytest.mark.parametrize("skip_header", [False, True])
+def test_read_file_in_ranges(split_bytes, skip_header, tmp_path):
+    path = tmp_path / "sample.csv"
+    path.write_bytes(b"a,b\r\n1,first\n22,second\n333,a much longer third line\n4,fourth")
+
+    ranges = split_file(str(path), split_bytes)
+    assert ranges[0][0] == 0 and ranges[-1][1] == path.stat().st_size
+    assert all(stop == start for (_, stop), (start, _) in zip(ranges, ranges[1:]))
+    rows = [row for start, stop in ranges for row in read_file(str(path), "csv", skip_header, start=start, stop=stop)]
+    expected = [["1", "first"], ["22", "second"], ["333", "a much longer third line"], ["4", "fourth"]]
+    assert ([] if skip_header else [["a", "b"]]) + expected == rows
+
+
+@pytest.mark.parametrize("backend", ["native", "tensorflow"])
+@pytest.mark.parametrize(
+    "num_records, batch_size, expected_counts",
+    [pytest.param(5, 2, [2, 2, 1]), pytest.param(4, 2, [2, 2]), pytest.param(0, 2, [])],
+    ids=["Remainder", "Exact", "Empty"],
+)
+def test_shard_writer(num_records, batch_size, expected_counts, backend, tmp_path):
+    with ShardWriter(str(tmp_path), "sample", 3, batch_size, compression_type="GZIP", backend=backend) as writer:
+        for idx in range(num_records):
+            writer.write(str(idx).encode())
+
+    assert expected_counts == [shard.num_records for shard in writer.shards]
+    assert sorted(os.listdir(tmp_path)) == [os.path.basename(shard.path) for shard in writer.shards]
+    records = [
+        record.decode() for shard in writer.shards for record in read_tfrecord_file(shard.path, compression_type="GZIP")
+    ]
+    assert [str(idx) for idx in range(num_records)] == records
+    assert all(shard.num_bytes == os.path.getsize(shard.path) for shard in writer.shards)
+
+
+@pytest.mark.parametrize("compression_type", ["GZIP", ""])
+def test_shard_writer_target_bytes(compression_type, tmp_path):
+    records = [os.urandom(100) for _ in range(2000)]
+    with ShardWriter(str(tmp_path), "sample", 0, 0, compression_type=compression_type, target_bytes=20000) as writer:
+        for record in records:
+            writer.write(record)
+
+    assert len(writer.shards) > 1
+    # Every shard but the last one reaches the target, overshooting by at most what the compressor holds back
+    assert all(20000 <= shard.num_bytes < 20000 + 2**16 for shard in writer.shards[:-1])
+    assert records == [
+        record
+        for shard in writer.shards
+        for record in read_tfrecord_file(shard.path, compression_type=compression_type)
+    ]
+
+
+@pytest.mark.parametrize(
+    "num_shards, expected",
+    [
+        pytest.param(2, [[("a", 0, 3)], [("a", 3, 4), ("b", 0, 2)]]),
+        pytest.param(3, [[("a", 0, 2)], [("a", 2, 4)], [("b", 0, 2)]]),
+        pytest.param(4, [[("a", 0, 1)], [("a", 1, 3)], [("a", 3, 4)], [("b", 0, 2)]]),
+        pytest.param(
+            8, [[], [("a", 0, 1)], [("a", 1, 2)], [("a", 2, 3)], [], [("a", 3, 4)], [("b", 0, 1)], [("b", 1, 2)]]
+        ),
+    ],
+    ids=["Two", "Three", "Four", "More than records"],
+)
+def test_plan_fixed_shards(num_shards, expected):
+    plans = plan_fixed_shards([ShardInfo("a", 4, 0), ShardInfo("b", 2, 0)], num_shards)
+    assert expected == [[tuple(span) for span in spans] for spans in plans]
+
+
+def test_merge_shard_spans(tmp_path):
+    first, second = str(tmp_path / "first.tfrecord"), str(tmp_path / "second.tfrecord")
+    for path, records in [(first, [b"0", b"1", b"2"]), (second, [b"3", b"4"])]:
+        with TFRecordWriter(path, compression_type="") as writer:
+            for record in records:
+                writer.write(record)
+        write_record_index(path, [len(record) for record in records])
+
+    shard = merge_shard_spans(
+        [ShardSpan(first, 1, 3), ShardSpan(second, 0, 1)], str(tmp_path / "merged.tfrecord"), compression_type="GZIP"
+    )
+    assert 3 == shard.num_records
+    assert [b"1", b"2", b"3"] == list(read_tfrecord_file(shard.path, compression_type="GZIP"))
+
+
+@pytest.mark.parametrize("buffer_bytes", [1, 1 << 20])
+def test_bucket_writer(buffer_bytes, tmp_path):
+    records = [str(idx).encode() for idx in range(100)]
+    with BucketWriter(str(tmp_path), 3, 4, seed=7, part=1, buffer_bytes=buffer_bytes) as writer:
+        for record in records:
+            writer.write(record)
+
+    assert all(os.path.basename(shard.path).endswith(".0003-0001.tfrecord") for shard in writer.shards)
+    assert 100 == sum(shard.num_records for shard in writer.shards)
+    scattered = [list(read_tfrecord_file(shard.path, compression_type="")) for shard in writer.shards]
+    assert all(len(bucket) == shard.num_records for bucket, shard in zip(scattered, writer.shards))
+    assert sorted(records) == sorted(record for bucket in scattered for record in bucket)
+
+    # Same seed and task scatter the records into the same buckets, however they are buffered
+    os.makedirs(tmp_path / "again")
+    with BucketWriter(str(tmp_path / "again"), 3, 4, seed=7, part=1) as again:
+        for record in records:
+            again.write(record)
+    assert scattered == [list(read_tfrecord_file(shard.path, compression_type="")) for shard in again.shards]
+
+
+@pytest.mark.parametrize("backend", ["native", "tensorflow"])
+def test_indexed_reader(backend, tmp_path):
+    records = [os.urandom(idx * 7 % 300) for idx in range(50)]
+    with ShardWriter(str(tmp_path), "sample", 0, 20, compression_type="", backend=backend, index=True) as writer:
+        for record in records:
+            writer.write(record)
+
+    assert [20, 20, 10] == [shard.num_records for shard in writer.shards]
+    assert all(os.path.getsize(index_filename(shard.path)) == shard.num_records * 16 for shard in writer.shards)
+    with IndexedTFRecordReader(writer.shards[1].path) as reader:
+        assert 20 == len(reader)
+        assert records[20] == reader[0]
+        assert records[39] == reader[-1]
+        assert records[25:32] == list(reader.read_range(5, 12))
+        # Read in chunks, or one by one if a record is larger than a chunk
+        assert records[25:32] == list(reader.read_range(5, 12, chunk_bytes=40))
+        assert records[25:32] == list(reader.read_range(5, 12, chunk_bytes=1))
+        assert [] == list(reader.read_range(12, 12))
+        assert records[20:40] == [record for idx in range(3) for record in reader.partition(idx, 3)]
+        with pytest.raises(ValueError):
+            list(reader.partition(3, 3))
+
+
+def test_indexed_reader_detects_corruption(tmp_path):
+    with ShardWriter(str(tmp_path), "sample", 0, 0, compression_type="", index=True) as writer:
+        for record in [b"first", b"second"]:
+            writer.write(record)
+    path = writer.shards[0].path
+    with open(path, "r+b") as f:
+        f.seek(-7, os.SEEK_END)
+        f.write(b"X")
+
+    with IndexedTFRecordReader(path) as reader:
+        assert b"first" == reader[0]
+        with pytest.raises(ValueError, match="Corrupted record"):
+            reader[1]
+    with IndexedTFRecordReader(path, verify=False) as reader:
+        assert b"secXnd" == reader[1]
+
+
+def test_merge_shard_spans_index(tmp_path):
+    source = str(tmp_path / "source.tfrecord")
+    with TFRecordWriter(source, compression_type="") as writer:
+        for record in [b"0", b"11", b"222"]:
+            writer.write(record)
+    write_record_index(source, [1, 2, 3])
+
+    shard = merge_shard_spans([ShardSpan(source, 1, 3)], str(tmp_path / "merged.tfrecord"), "", index=True)
+    with IndexedTFRecordReader(shard.path) as reader:
+        assert [b"11", b"222"] == [reader[0], reader[1]]
+
+
+def test_shard_writer_index_needs_uncompressed(tmp_path):
+    with pytest.raises(ValueError):
+        ShardWriter(str(tmp_path), "sample", 0, 0, compression_type="GZIP", index=True)
+
+
+class MemoryStream(io.BytesIO):
+    """Stream which keeps its content in `streams` once closed, like an upload into the bucket."""
+
+    def __init__(self, streams, name):
+        super().__init__()
+        self.streams, self.name = streams, name
+
+    def close(self):
+        self.streams[self.name] = self.getvalue()
+        super().close()
+
+    def terminate(self):
+        self.streams[self.name] = None
+        super().close()
+
+
+def test_shard_writer_open_stream(tmp_path):
+    streams = {}
+    with ShardWriter(
+        str(tmp_path), "sample", 0, 2, compression_type="", index=True, open_stream=lambda n: MemoryStream(streams, n)
+    ) as writer:
+        for idx in range(3):
+            writer.write(str(idx).encode())
+
+    # Nothing is written on disk
+    assert [] == os.listdir(tmp_path)
+    assert ["sample.0000-0000.tfrecord", "sample.0000-0001.tfrecord"] == [
+        os.path.basename(shard.path) for shard in writer.shards
+    ]
+    assert [len(streams[os.path.basename(shard.path)]) for shard in writer.shards] == [
+        shard.num_bytes for shard in writer.shards
+    ]
+    assert 2 * 16 == len(streams["sample.0000-0000.tfrecord" + INDEX_SUFFIX])
+
+
+def test_shard_writer_terminates_stream_on_error(tmp_path):
+    streams = {}
+    with pytest.raises(RuntimeError):
+        with ShardWriter(str(tmp_path), "sample", 0, 2, open_stream=lambda n: MemoryStream(streams, n)) as writer:
+            writer.write(b"record")
+            raise RuntimeError()
+
+    # The partial shard is never finished
+    assert {"sample.0000-0000.tfrecord": None} == streams
+    assert [] == writer.shards
@@ -0,0 +1,227 @@
+import asyncio
+import json
+import os
+import shutil
+
+import pytest
+
+from tfrecorder.config import Config
+from tfrecorder.datatype import FeatureType, parse_metadata
+from tfrecorder.fileio import file_digest, partition_of, split_file_digest
+from tfrecorder.manifest import Manifest, dataset_manifest_path, manifest_path, merge_manifests
+from tfrecorder.vocab import load_vocabulary
+from tfrecorder.worker import Worker
+
+
+@pytest.fixture
+def incremental_config(config, tmp_path):
+    inputs = tmp_path / "inputs"
+    inputs.mkdir()
+    for filename in ("sample_tsv.tsv", "sample_tsv_with_header.tsv"):
+        shutil.copy(os.path.join("./tests/data", filename), inputs / filename)
+    return Config(
+        **{
+            **config,
+            "from_path": str(inputs) + "/*.tsv",
+            "to_path": str(tmp_path / "outputs") + "/",
+            "batch_size": 1,
+            "max_pool_size": 2,
+            "columns": parse_metadata("./tests/data/sample_metadata.json")["columns"],
+        }
+    )
+
+
+def convert(config):
+    return sorted(os.path.basename(shard.path) for shard in asyncio.run(Worker(config).convert()))
+
+
+def outputs(config):
+    return sorted(filename for filename in os.listdir(config.tfrecord_path) if filename.endswith(".tfrecord"))
+
+
+def test_convert_only_new_or_changed_files(incremental_config):
+    config = incremental_config
+    first = convert(config)
+    # Header of sample_tsv_with_header.tsv is skipped as an error
+    assert 4 == len(first)
+    assert [] == convert(config)
+
+    # Touched without change
+    sample = os.path.join(os.path.dirname(config.from_path), "sample_tsv.tsv")
+    os.utime(sample, ns=(0, 0))
+    assert [] == convert(config)
+
+    # Changed
+    with open(sample, "a") as f:
+        # The sample does not end with a newline
+        f.write("\nSEND\t20200427030303\t2\tBye!\n")
+    assert [
+        "sample_dataset.0000-0000.tfrecord",
+        "sample_dataset.0000-0001.tfrecord",
+        "sample_dataset.0000-0002.tfrecord",
+    ] == convert(config)
+
+    # New file
+    shutil.copy(sample, sample + ".new.tsv")
+    assert [
+        "sample_dataset.0002-0000.tfrecord",
+        "sample_dataset.0002-0001.tfrecord",
+        "sample_dataset.0002-0002.tfrecord",
+    ] == convert(config)
+
+    # Removed file
+    os.remove(sample)
+    assert [] == convert(config)
+    assert [name for name in first if not name.startswith("sample_dataset.0000-")] + [
+        "sample_dataset.0002-0000.tfrecord",
+        "sample_dataset.0002-0001.tfrecord",
+        "sample_dataset.0002-0002.tfrecord",
+    ] == outputs(config)
+
+
+def test_split_files_are_hashed_by_range(incremental_config):
+    config = incremental_config._replace(split_bytes=40)
+    assert 4 == len(convert(config))
+    sample = os.path.join(os.path.dirname(config.from_path), "sample_tsv.tsv")
+    assert split_file_digest(sample, 40) == Manifest.load(config).inputs[sample].sha256
+    assert split_file_digest(sample, 40) != file_digest(sample)
+
+    # Touched without change
+    os.utime(sample, ns=(0, 0))
+    assert [] == convert(config)
+
+
+def test_convert_again_when_settings_changed(incremental_config):
+    config = incremental_config
+    assert 4 == len(convert(config))
+    config = config._replace(batch_size=2)
+    assert ["sample_dataset.0000-0000.tfrecord", "sample_dataset.0001-0000.tfrecord"] == convert(config)
+    assert convert(config._replace(full_convert=True)) == outputs(config)
+
+
+def test_resume_interrupted_conversion(incremental_config):
+    config = incremental_config
+    convert(config)
+    with open(manifest_path(config), "r") as f:
+        obj = json.load(f)
+    # Interrupted while converting the second file, after writing a shard which is not needed anymore
+    obj["inputs"][sorted(obj["inputs"])[1]].update({"sha256": None, "shards": []})
+    with open(manifest_path(config), "w") as f:
+        json.dump(obj, f)
+    open(os.path.join(config.tfrecord_path, "sample_dataset.0001-0009.tfrecord"), "w").close()
+
+    assert ["sample_dataset.0001-0000.tfrecord", "sample_dataset.0001-0001.tfrecord"] == convert(config)
+    assert 4 == len(outputs(config))
+    assert all(entry.complete for entry in Manifest.load(config).inputs.values())
+
+
+def test_convert_after_shuffled(incremental_config):
+    config = incremental_config
+    shuffled = convert(config._replace(shuffle_buckets=2))
+    assert all(name.startswith("sample_dataset.shuffled.") for name in shuffled)
+    # Shuffled shards are not read along with the shards of the files
+    assert convert(config) == outputs(config)
+    assert 4 == len(outputs(config))
+
+
+def test_convert_after_num_shards(incremental_config):
+    config = incremental_config
+    assert ["sample_dataset.0000-of-0002.tfrecord", "sample_dataset.0001-of-0002.tfrecord"] == convert(
+        config._replace(num_shards=2)
+    )
+    # Fixed shards are not read along with the shards of the files
+    assert convert(config) == outputs(config)
+    assert 4 == len(outputs(config))
+
+
+def test_failed_file_stays_pending(incremental_config):
+    config = incremental_config._replace(only_convert=True, only_upload=False, max_error=2)
+    sample = os.path.join(os.path.dirname(config.from_path), "sample_tsv.tsv")
+    with open(sample, "a") as f:
+        f.write("\nbroken\nbroken\n")
+    assert 1 == asyncio.run(Worker(config).run())
+    # Shards of the rows before the errors are removed, along with the file which failed
+    assert ["sample_dataset.0001-0000.tfrecord", "sample_dataset.0001-0001.tfrecord"] == outputs(config)
+    assert not Manifest.load(config).inputs[sample].complete
+
+    # Converted by the next run once it is fixed
+    shutil.copy("./tests/data/sample_tsv.tsv", sample)
+    assert ["sample_dataset.0000-0000.tfrecord", "sample_dataset.0000-0001.tfrecord"] == convert(config)
+    assert all(entry.complete for entry in Manifest.load(config).inputs.values())
+
+
+def test_vocabulary_keeps_ids(incremental_config):
+    columns = [
+        column._replace(feature_type=FeatureType.CATEGORICAL) if column.name == "message_type" else column
+        for column in incremental_config.columns
+    ]
+    config = incremental_config._replace(columns=columns)
+    inputs = os.path.dirname(config.from_path)
+    vocab = os.path.join(config.tfrecord_path, "sample_dataset.message_type.vocab")
+    assert 4 == len(convert(config))
+    # Header of sample_tsv_with_header.tsv is counted too
+    assert {"RECV": 0, "SEND": 1, "message_type": 2} == load_vocabulary(vocab)
+
+    # New values are appended, so only the new file is converted
+    with open(os.path.join(inputs, "new.tsv"), "w") as f:
+        f.write("ACK\t20200427030303\t1\tOk\n" * 2)
+    assert ["sample_dataset.0002-0000.tfrecord", "sample_dataset.0002-0001.tfrecord"] == convert(config)
+    assert {"RECV": 0, "SEND": 1, "message_type": 2, "ACK": 3} == load_vocabulary(vocab)
+
+    # Built again with other options
+    config = config._replace(columns=[column._replace(min_count=2) for column in columns])
+    assert 6 == len(convert(config))
+    assert {"ACK": 0, "RECV": 1, "SEND": 2} == load_vocabulary(vocab)
+
+    # The ID out of the vocabulary moves as new values are appended, so every file is converted again
+    with open(os.path.join(inputs, "other.tsv"), "w") as f:
+        f.write("NAK\t20200427030303\t1\tNo\n" * 2)
+    assert 8 == len(convert(config))
+    assert {"ACK": 0, "RECV": 1, "SEND": 2, "NAK": 3} == load_vocabulary(vocab)
+
+
+def test_convert_partitions_into_one_directory(incremental_config):
+    inputs = os.path.dirname(incremental_config.from_path)
+    for idx in range(8):
+        shutil.copy(os.path.join(inputs, "sample_tsv.tsv"), os.path.join(inputs, f"copy_{idx}.tsv"))
+    config = incremental_config._replace(num_partitions=3)
+
+    converted = [convert(config._replace(partition_index=index)) for index in range(3)]
+    # Every partition writes its own shards, which are never overwritten by the others
+    assert all(name.startswith(f"sample_dataset.p{index:04d}.") for index in range(3) for name in converted[index])
+    assert sorted(name for names in converted for name in names) == outputs(config)
+    assert [] == convert(config._replace(partition_index=1))
+
+    dataset = merge_manifests(config)
+    assert 10 == len(dataset["inputs"])
+    assert all(entry["partition"] == partition_of(path, 3) for path, entry in dataset["inputs"].items())
+    assert outputs(config) == [shard[0] for shard in dataset["shards"]]
+    assert 20 == dataset["num_records"]
+    with open(dataset_manifest_path(config), "r") as f:
+        assert dataset == json.load(f)
+
+
+def test_merge_incomplete_partitions(incremental_config):
+    config = incremental_config._replace(num_partitions=2)
+    convert(config)
+    with pytest.raises(ValueError, match="Manifest of partition 1 is not found"):
+        merge_manifests(config)
+
+    convert(config._replace(partition_index=1))
+    with pytest.raises(ValueError, match="not converted with the current settings"):
+        merge_manifests(config._replace(batch_size=2))
+
+
+def test_convert_again_to_collect_stats(incremental_config):
+    assert 4 == len(convert(incremental_config))
+    # Files converted without statistics are converted again once they are collected
+    config = incremental_config._replace(stats=True)
+    assert 4 == len(convert(config))
+    assert all(entry.stats is not None for entry in Manifest.load(config).inputs.values())
+    assert [] == convert(config)
+    assert 4 == Manifest.load(config).stats(config.columns).num_rows
+
+    config = config._replace(num_partitions=2)
+    for index in range(2):
+        convert(config._replace(partition_index=index))
+    assert 4 == merge_manifests(config)["stats"]["num_rows"]
@@ -0,0 +1,63 @@
+import json
+import os
+import pstats
+
+from tfrecorder.metrics import Metrics, merge_profiles, profiled
+
+
+def test_metrics():
+    metrics = Metrics()
+    assert [1, 2, 3] == list(metrics.timed([1, 2, 3], "read", counter="rows"))
+    metrics.count("rows", 2)
+    metrics.observe("depth", 3)
+    metrics.observe("depth", 1)
+
+    merged = Metrics()
+    merged.merge(metrics.summary())
+    merged.merge(metrics.summary())
+    summary = merged.summary()
+    assert {"rows": 10} == summary["counters"]
+    assert {"depth": 3} == summary["maxima"]
+    assert summary["timers"]["read"] >= 0
+
+
+def test_timed_stops_early():
+    metrics = Metrics()
+    iterator = metrics.timed(range(10), "read", counter="rows")
+    next(iterator)
+    iterator.close()
+    assert {"rows": 1} == metrics.summary()["counters"]
+
+
+def test_write_metrics(tmp_path):
+    metrics = Metrics()
+    metrics.count("rows_parsed", 3)
+    metrics.time("read", 1.5)
+    metrics.observe("upload_queue_depth_max", 2)
+
+    metrics.write_json(str(tmp_path / "metrics.json"))
+    with open(tmp_path / "metrics.json") as f:
+        assert metrics.summary() == json.load(f)
+
+    metrics.write_prometheus(str(tmp_path / "metrics.prom"))
+    assert [
+        "# TYPE tfrecorder_rows_parsed_total counter",
+        "tfrecorder_rows_parsed_total 3",
+        "# TYPE tfrecorder_stage_seconds_total counter",
+        'tfrecorder_stage_seconds_total{stage="read"} 1.5',
+        "# TYPE tfrecorder_upload_queue_depth_max gauge",
+        "tfrecorder_upload_queue_depth_max 2",
+    ] == (tmp_path / "metrics.prom").read_text().splitlines()
+
+
+def test_merge_profiles(tmp_path):
+    path = str(tmp_path / "run.prof")
+    for name in ["first", "second"]:
+        with profiled(path, name):
+            sorted(range(1000))
+
+    report = merge_profiles(path)
+    assert "sorted" in report
+    assert ["run.prof"] == os.listdir(tmp_path)
+    assert pstats.Stats(path).total_calls > 0
+    assert merge_profiles(str(tmp_path / "none.prof")) is None
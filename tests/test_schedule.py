@@ -0,0 +1,37 @@
+import pytest
+
+from tfrecorder.convert import ConvertTask
+from tfrecorder.schedule import plan_task_groups, run_group, task_size
+
+
+@pytest.fixture
+def tasks(tmp_path):
+    tasks = []
+    for task_id, size in enumerate([10, 80, 30, 50, 20]):
+        path = tmp_path / f"{task_id}.tsv"
+        path.write_bytes(b"x" * size)
+        tasks.append(ConvertTask(task_id, str(path)))
+    return tasks
+
+
+def test_task_size(tasks):
+    assert 80 == task_size(tasks[1])
+    assert 15 == task_size(tasks[1]._replace(part=0, start=5, stop=20))
+
+
+@pytest.mark.parametrize(
+    "task_bytes, chunk_size, expected",
+    [
+        pytest.param(0, 2, [[0, 1], [2, 3], [4]], id="Chunks"),
+        pytest.param(1, 2, [[1], [3], [2], [4], [0]], id="Largest First"),
+        pytest.param(60, 2, [[1], [3], [2, 4, 0]], id="Grouped"),
+        pytest.param(1000, 2, [[1, 3, 2, 4, 0]], id="All"),
+    ],
+)
+def test_plan_task_groups(task_bytes, chunk_size, expected, tasks):
+    groups = plan_task_groups(tasks, task_bytes, chunk_size)
+    assert expected == [[task.task_id for task in group] for group in groups]
+
+
+def test_run_group(tasks):
+    assert [0, 1] == run_group(tasks[:2], lambda task: task.task_id)
@@ -0,0 +1,95 @@
+import json
+
+import numpy as np
+import pytest
+
+from tfrecorder.datatype import Column, FeatureType
+from tfrecorder.stats import ColumnStats, DatasetStats, HyperLogLog, bit_length, hash_values
+
+COLUMNS = [
+    Column("name", FeatureType.STRING),
+    Column("score", FeatureType.FLOAT),
+    Column("flag", FeatureType.BOOL),
+]
+
+
+def test_bit_length():
+    values = [0, 1, 2, 3, 4, 255, 256, 2**40]
+    assert [value.bit_length() for value in values] == bit_length(np.array(values)).tolist()
+
+
+def test_hash_values():
+    # The same in every process, unlike `hash()`
+    assert hash_values([b"a", b"b"]).tolist() == hash_values([b"a", b"b"]).tolist()
+    assert np.all(hash_values([str(i).encode() for i in range(1000)]) < 2**32)
+
+
+@pytest.mark.parametrize("num_values", [10, 1000, 100000])
+def test_hyperloglog(num_values):
+    sketch = HyperLogLog()
+    values = [f"value-{i}".encode() for i in range(num_values)]
+    sketch.add(hash_values(values))
+    # Duplicates are not counted again
+    sketch.add(hash_values(values[: num_values // 2]))
+    assert num_values == pytest.approx(sketch.estimate(), rel=0.05)
+
+
+def test_hyperloglog_merge():
+    first, second, both = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    values = [f"value-{i}".encode() for i in range(20000)]
+    first.add(hash_values(values[:15000]))
+    second.add(hash_values(values[5000:]))
+    both.add(hash_values(values))
+    first.merge(second)
+    assert both.registers.tolist() == first.registers.tolist()
+    assert first.registers.tolist() == HyperLogLog.from_state(first.to_state()).registers.tolist()
+
+
+def test_column_stats():
+    stats = ColumnStats(FeatureType.INT)
+    stats.add(("3", "-1", "10"))
+    assert {"type": "int", "count": 3, "empty": 0, "min": -1, "max": 10, "mean": 4, "finite": 3} == stats.summary()
+
+    stats = ColumnStats(FeatureType.BOOL)
+    stats.add(("1", "false", "True", "0"))
+    assert 0.5 == stats.summary()["true_ratio"]
+
+    stats = ColumnStats(FeatureType.STRING)
+    stats.add(("", "a", "abc", "abcdef", "abc"))
+    assert {"0": 1, "1": 1, "2-3": 2, "4-7": 1} == stats.summary()["length_histogram"]
+    assert 1 == stats.summary()["empty"]
+    assert 4 == stats.summary()["distinct"]
+
+
+def test_dataset_stats_merge():
+    rows = [[f"name-{i % 7}", str(i / 2), str(i % 2)] for i in range(100)]
+    whole = DatasetStats(COLUMNS)
+    whole.add_rows(rows)
+
+    # Merged from parts, and restored from the state in the manifest
+    merged = DatasetStats(COLUMNS)
+    for start in range(0, 100, 30):
+        part = DatasetStats(COLUMNS)
+        part.add_rows(rows[start : start + 30])
+        merged.merge(DatasetStats.from_state(COLUMNS, json.loads(json.dumps(part.to_state()))))
+
+    assert whole.summary() == merged.summary()
+    assert 100 == merged.num_rows
+    assert 7 == merged.summary()["columns"]["name"]["distinct"]
+    assert {"min": 0, "max": 49.5, "mean": 24.75} == {
+        key: merged.summary()["columns"]["score"][key] for key in ("min", "max", "mean")
+    }
+
+
+def test_dataset_stats_save(tmp_path):
+    stats = DatasetStats(COLUMNS)
+    stats.add_rows([["a", "nan", "1"], ["b", "1.5", "0"]])
+    stats.save(str(tmp_path / "stats.json"))
+
+    with open(tmp_path / "stats.json") as f:
+        summary = json.load(f)
+    assert 2 == summary["num_rows"]
+    # Values which are not finite are only counted
+    assert {"count": 2, "finite": 1, "min": 1.5} == {
+        key: summary["columns"]["score"][key] for key in ("count", "finite", "min")
+    }
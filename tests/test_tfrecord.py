@@ -0,0 +1,86 @@
+import os
+import zlib
+
+import pytest
+import tensorflow as tf
+
+from tfrecorder import tfrecord
+
+
+@pytest.fixture
+def records():
+    return [b"", b"x", "안녕하세요".encode() * 10, bytes(range(256)) * 100]
+
+
+def test_crc32c():
+    # Check value of CRC-32C
+    assert 0xE3069283 == tfrecord.crc32c(b"123456789")
+    assert tfrecord._crc32c_python(b"123456789" * 10) == tfrecord.crc32c(b"123456789" * 10)
+
+
+@pytest.mark.parametrize("compression_type", ["GZIP", "ZLIB", ""], ids=["GZIP", "ZLIB", "None"])
+def test_written_file_is_readable_by_tensorflow(compression_type, records, tmp_path):
+    path = str(tmp_path / "native.tfrecord")
+    with tfrecord.TFRecordWriter(path, compression_type=compression_type) as writer:
+        for record in records:
+            writer.write(record)
+
+    assert records == list(tf.data.TFRecordDataset(path, compression_type=compression_type).as_numpy_iterator())
+    assert records == list(tfrecord.read_tfrecord(path, compression_type=compression_type))
+
+
+@pytest.mark.parametrize("compression_type", ["GZIP", "ZLIB"])
+def test_parallel_compression_is_readable_by_tensorflow(compression_type, records, tmp_path):
+    # Spans several blocks, and back references cross the block boundaries
+    records = records + [bytes(range(256)) * 5000] * 3 + [os.urandom(300000)]
+    path = str(tmp_path / "parallel.tfrecord")
+    with tfrecord.TFRecordWriter(
+        path, compression_type=compression_type, compression_level=9, compression_threads=4
+    ) as writer:
+        for record in records:
+            writer.write(record)
+
+    assert writer.num_bytes == os.path.getsize(path)
+    assert records == list(tf.data.TFRecordDataset(path, compression_type=compression_type).as_numpy_iterator())
+    assert records == list(tfrecord.read_tfrecord(path, compression_type=compression_type))
+
+
+@pytest.mark.parametrize("compression_type, wbits", [("GZIP", 31), ("ZLIB", 15)])
+@pytest.mark.parametrize("block_size", [100, 1 << 12, 1 << 16])
+def test_parallel_compressor(compression_type, wbits, block_size):
+    data = b"".join(str(idx).encode() for idx in range(20000))
+    compressor = tfrecord.ParallelCompressor(compression_type, threads=3, block_size=block_size)
+    compressed = b"".join(compressor.compress(data[start : start + 777]) for start in range(0, len(data), 777))
+    compressed += compressor.flush()
+    assert data == zlib.decompress(compressed, wbits)
+
+
+@pytest.mark.parametrize("compression_type", ["GZIP", "ZLIB", ""], ids=["GZIP", "ZLIB", "None"])
+def test_read_file_written_by_tensorflow(compression_type, records, tmp_path):
+    path = str(tmp_path / "tensorflow.tfrecord")
+    with tf.io.TFRecordWriter(path, tf.io.TFRecordOptions(compression_type=compression_type)) as writer:
+        for record in records:
+            writer.write(record)
+
+    assert records == list(tfrecord.read_tfrecord(path, compression_type=compression_type))
+
+
+@pytest.mark.parametrize(
+    "position, message",
+    [pytest.param(2, "length"), pytest.param(-1, "record"), pytest.param(None, "Truncated")],
+)
+def test_read_corrupted_file(position, message, records, tmp_path):
+    path = str(tmp_path / "corrupted.tfrecord")
+    with tfrecord.TFRecordWriter(path, compression_type="") as writer:
+        writer.write(records[2])
+    with open(path, "rb") as f:
+        data = bytearray(f.read())
+    if position is None:
+        data = data[:-1]
+    else:
+        data[position] ^= 0xFF
+    with open(path, "wb") as f:
+        f.write(data)
+
+    with pytest.raises(ValueError, match=message):
+        list(tfrecord.read_tfrecord(path, compression_type=""))
@@ -0,0 +1,56 @@
+import pytest
+
+from tfrecorder.datatype import Column, FeatureType
+from tfrecorder.tokenizer import Tokenizer, feature_columns
+
+VOCABULARY = {token: idx for idx, token in enumerate(["[UNK]", "un", "##aff", "##able", "hello", ",", "world", "!"])}
+
+
+@pytest.mark.parametrize(
+    "options, expected",
+    [
+        pytest.param({}, ["Hello,", "World!"], id="Whitespace"),
+        pytest.param({"tokenizer": "regex"}, ["Hello", ",", "World", "!"], id="Regex"),
+        pytest.param({"tokenizer": "regex", "pattern": r"[A-Z]\w*"}, ["Hello", "World"], id="Pattern"),
+        pytest.param({"lowercase": True}, ["hello,", "world!"], id="Lowercase"),
+    ],
+)
+def test_split(options, expected):
+    tokenizer = Tokenizer(Column("text", FeatureType.TOKENIZED, **options))
+    assert expected == tokenizer.split("  Hello, World!\n")
+
+
+def test_token_ids():
+    tokenizer = Tokenizer(Column("text", FeatureType.TOKENIZED, tokenizer="regex", lowercase=True), VOCABULARY)
+    # Tokens out of the vocabulary get the ID right after the last one
+    assert (4, 5, 6, 8) == tokenizer.token_ids("Hello, world?")
+    assert () == tokenizer.token_ids("")
+
+
+def test_wordpiece():
+    column = Column("text", FeatureType.TOKENIZED, tokenizer="wordpiece", vocab_file="vocab.txt", lowercase=True)
+    tokenizer = Tokenizer(column, VOCABULARY)
+    assert (1, 2, 3, 5, 0, 7) == tokenizer.token_ids("Unaffable, unknown!")
+    assert (1, 2, 3, 1, 2, 3) == tokenizer.token_ids("unaffable " * 2)
+    assert (0,) == tokenizer.token_ids("un" + "aff" * 40)
+
+
+def test_token_ids_are_cached():
+    tokenizer = Tokenizer(Column("text", FeatureType.TOKENIZED, max_tokens=2), VOCABULARY)
+    assert (4, 6) == tokenizer.token_ids("hello world hello")
+    assert (4, 6) == tokenizer.token_ids("hello world hello")
+    assert 1 == tokenizer.token_ids.cache_info().hits
+
+
+def test_feature_columns():
+    columns = [
+        Column("text", FeatureType.TOKENIZED, length_feature=True),
+        Column("title", FeatureType.TOKENIZED),
+        Column("count", FeatureType.INT),
+    ]
+    assert [
+        ("text", FeatureType.TOKENIZED),
+        ("text_length", FeatureType.INT),
+        ("title", FeatureType.TOKENIZED),
+        ("count", FeatureType.INT),
+    ] == [(column.name, column.feature_type) for column in feature_columns(columns)]
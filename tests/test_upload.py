@@ -0,0 +1,139 @@
+import os
+
+import pytest
+
+from tfrecorder import upload
+from tfrecorder.config import Config
+from tfrecorder.localgcs import LocalBlob, LocalClient
+from tfrecorder.upload import Uploader
+
+
+@pytest.fixture
+def upload_config(config, tmp_path):
+    return Config(**{**config, "local_bucket_dir": str(tmp_path / "gcs"), "upload_chunk_size": 256 * 2**10})
+
+
+@pytest.fixture
+def shards(tmp_path):
+    directory = tmp_path / "shards"
+    directory.mkdir()
+    paths = []
+    for idx, size in enumerate([0, 10, 300 * 2**10]):
+        path = directory / f"sample_dataset.{idx:04d}-0000.tfrecord"
+        path.write_bytes(os.urandom(size))
+        paths.append(str(path))
+    return paths
+
+
+def bucket_contents(config):
+    bucket = LocalClient(config.local_bucket_dir).lookup_bucket("sample_dataset.tfrecord")
+    return {blob.name: blob.download_as_bytes() for blob in bucket.list_blobs()}
+
+
+def read_all(paths):
+    contents = {}
+    for path in paths:
+        with open(path, "rb") as f:
+            contents[os.path.basename(path)] = f.read()
+    return contents
+
+
+@pytest.mark.parametrize("delete_after_success", [False, True], ids=["Keep", "Delete"])
+def test_upload_files(delete_after_success, upload_config, shards):
+    expected = read_all(shards)
+    uploader = Uploader(upload_config)
+    assert 3 == uploader.upload_files(shards, delete_after_success=delete_after_success)
+    assert expected == bucket_contents(upload_config)
+    assert all(os.path.exists(path) != delete_after_success for path in shards)
+
+
+def test_upload_into_existing_bucket(upload_config, shards):
+    Uploader(upload_config).upload_files(shards[:1])
+    assert 2 == Uploader(upload_config).upload_files(shards[1:])
+    assert read_all(shards) == bucket_contents(upload_config)
+
+
+def test_upload_retries_transient_errors(upload_config, shards, monkeypatch):
+    monkeypatch.setattr(upload, "RETRY_INITIAL_DELAY", 0.0)
+    failures = {path: 2 for path in shards}
+    upload_from_filename = LocalBlob.upload_from_filename
+
+    def flaky_upload_from_filename(blob, filename):
+        if failures[filename] > 0:
+            failures[filename] -= 1
+            raise ConnectionError("Connection reset by peer")
+        upload_from_filename(blob, filename)
+
+    monkeypatch.setattr(LocalBlob, "upload_from_filename", flaky_upload_from_filename)
+    assert 3 == Uploader(upload_config).upload_files(shards)
+    assert read_all(shards) == bucket_contents(upload_config)
+
+    # Give up after `upload_retries`
+    failures = {path: 6 for path in shards}
+    assert 0 == Uploader(upload_config).upload_files(shards)
+
+
+def test_sync(upload_config, shards, monkeypatch):
+    Uploader(upload_config).upload_files(shards)
+    bucket = LocalClient(upload_config.local_bucket_dir).lookup_bucket("sample_dataset.tfrecord")
+    bucket.blob("sample_dataset.9999-0000.tfrecord").upload_from_filename(shards[0])
+    # Same size, different content
+    with open(shards[1], "r+b") as f:
+        f.write(b"\x00" * 10)
+
+    uploaded = []
+    upload_from_filename = LocalBlob.upload_from_filename
+
+    def recording_upload_from_filename(blob, filename):
+        uploaded.append(os.path.basename(filename))
+        upload_from_filename(blob, filename)
+
+    monkeypatch.setattr(LocalBlob, "upload_from_filename", recording_upload_from_filename)
+    uploader = Uploader(upload_config._replace(sync=True))
+    assert 3 == uploader.upload_files(shards)
+    assert [os.path.basename(shards[1])] == uploaded
+    assert 1 == uploader.delete_stale_blobs(shards)
+    assert read_all(shards) == bucket_contents(upload_config)
+
+
+def test_delete_blobs(upload_config, shards):
+    uploader = Uploader(upload_config)
+    uploader.upload_files(shards)
+    # Files which are not in the bucket are skipped
+    assert 2 == uploader.delete_blobs(shards[1:] + [shards[1] + ".index"])
+    assert read_all(shards[:1]) == bucket_contents(upload_config)
+    assert [os.path.basename(shards[0])] == uploader.blob_names("sample_dataset.*.tfrecord")
+    assert [] == uploader.blob_names("other.*.tfrecord")
+
+
+@pytest.mark.parametrize("fast_crc32c", [True, False], ids=["CRC32C", "MD5"])
+def test_sync_checksum(fast_crc32c, upload_config, shards, monkeypatch):
+    monkeypatch.setattr(upload, "FAST_CRC32C", fast_crc32c)
+    Uploader(upload_config).upload_files(shards)
+    uploader = Uploader(upload_config._replace(sync=True))
+    assert all(uploader._is_synced(path, os.path.getsize(path)) for path in shards)
+
+
+def test_open_blob(upload_config):
+    config = upload_config._replace(diskless_buffer_bytes=256 * 2**10)
+    data = os.urandom(2**20 + 100)
+    with Uploader(config).open_blob("streamed.tfrecord") as stream:
+        for start in range(0, len(data), 10000):
+            stream.write(data[start : start + 10000])
+        # Only visible once the upload is finished
+        assert {} == bucket_contents(config)
+
+    # Sent in chunks as it grows, never holding more than a chunk and a write in memory
+    assert 5 == stream.num_chunks
+    assert stream.max_buffered < 256 * 2**10 + 10000
+    assert {"streamed.tfrecord": data} == bucket_contents(config)
+
+
+def test_open_blob_terminate(upload_config):
+    with pytest.raises(RuntimeError):
+        with Uploader(upload_config).open_blob("streamed.tfrecord") as stream:
+            stream.write(b"partial")
+            raise RuntimeError()
+
+    assert {} == bucket_contents(upload_config)
+    assert [] == os.listdir(os.path.join(upload_config.local_bucket_dir, "sample_dataset.tfrecord"))
@@ -1,5 +1,9 @@
-from tfrecorder.utils import batch
+from tfrecorder.utils import batch, batch_iter
 
 
 def test_batch():
     assert [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]] == list(batch(list(range(0, 10)), 3))
+
+
+def test_batch_iter():
+    assert [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]] == list(batch_iter(iter(range(0, 10)), 3))
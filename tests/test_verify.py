@@ -0,0 +1,119 @@
+import math
+
+import pytest
+import tensorflow as tf
+
+from tfrecorder.config import Config
+from tfrecorder.datatype import Column, FeatureType
+from tfrecorder.encoder import ExampleEncoder
+from tfrecorder.fileio import ShardWriter
+from tfrecorder.verify import ColumnSummary, check_example, decode_example, verify_shard
+
+COLUMNS = [
+    Column("name", FeatureType.STRING),
+    Column("score", FeatureType.FLOAT),
+    Column("count", FeatureType.INT),
+    Column("flag", FeatureType.BOOL),
+]
+
+
+def test_decode_example():
+    record = ExampleEncoder(COLUMNS).encode(["안녕", "1.5", "-300", "true"])
+    assert {
+        "name": ("bytes_list", ["안녕".encode()]),
+        "score": ("float_list", [1.5]),
+        "count": ("int64_list", [-300]),
+        "flag": ("int64_list", [1]),
+    } == decode_example(record)
+
+
+def test_decode_example_of_tensorflow():
+    example = tf.train.Example(
+        features=tf.train.Features(
+            feature={
+                "floats": tf.train.Feature(float_list=tf.train.FloatList(value=[0.5, -2.0])),
+                "ints": tf.train.Feature(int64_list=tf.train.Int64List(value=[1, -(2**63), 2**63 - 1])),
+                "bytes": tf.train.Feature(bytes_list=tf.train.BytesList(value=[b"a", b""])),
+                "empty": tf.train.Feature(),
+            }
+        )
+    )
+    assert {
+        "floats": ("float_list", [0.5, -2.0]),
+        "ints": ("int64_list", [1, -(2**63), 2**63 - 1]),
+        "bytes": ("bytes_list", [b"a", b""]),
+        "empty": (None, []),
+    } == decode_example(example.SerializeToString())
+
+
+def test_decode_example_rejects_garbage():
+    with pytest.raises(ValueError):
+        decode_example(b"\x0a\xff\xff")
+
+
+@pytest.mark.parametrize(
+    "features, expected",
+    [
+        pytest.param({"name": ("bytes_list", [b"a"])}, "Expected features", id="Missing"),
+        pytest.param(
+            {
+                "name": ("bytes_list", [b"a"]),
+                "score": ("int64_list", [1]),
+                "count": ("int64_list", [1]),
+                "flag": ("int64_list", [1]),
+            },
+            "Expected one value in float_list of `score`",
+            id="Wrong kind",
+        ),
+        pytest.param(
+            {
+                "name": ("bytes_list", [b"a"]),
+                "score": ("float_list", [1.0]),
+                "count": ("int64_list", [1]),
+                "flag": ("int64_list", [2]),
+            },
+            "Expected 0 or 1 for `flag`",
+            id="Invalid bool",
+        ),
+    ],
+)
+def test_check_example(features, expected):
+    assert check_example(features, COLUMNS).startswith(expected)
+
+
+def test_column_summary():
+    summary = ColumnSummary().add([1, 5]).merge(ColumnSummary().add([3])).merge(ColumnSummary())
+    assert (3, 1, 5, 9) == tuple(summary)
+    assert 3 == summary.mean
+    assert math.isnan(ColumnSummary().mean)
+
+
+@pytest.mark.parametrize("compression_type", ["GZIP", ""])
+def test_verify_shard(compression_type, config, tmp_path):
+    config = Config(**{**config, "columns": COLUMNS, "compression_type": compression_type})
+    encoder = ExampleEncoder(COLUMNS)
+    with ShardWriter(str(tmp_path), "sample", 0, 0, compression_type=compression_type) as writer:
+        writer.write(encoder.encode(["ab", "1.0", "3", "0"]))
+        writer.write(encoder.encode(["abcd", "2.0", "5", "1"]))
+        writer.write(ExampleEncoder(COLUMNS[:2]).encode(["abc", "3.0"]))
+
+    report = verify_shard(writer.shards[0].path, config)
+    assert 3 == report.num_records
+    assert 1 == report.num_errors
+    assert report.errors[0].startswith("Record 2: Expected features")
+    assert (2, 2, 4, 6) == tuple(report.columns["name"])
+    assert (2, 3, 5, 8) == tuple(report.columns["count"])
+    assert 0.5 == report.columns["flag"].mean
+
+
+def test_verify_truncated_shard(config, tmp_path):
+    config = Config(**{**config, "columns": COLUMNS, "compression_type": ""})
+    with ShardWriter(str(tmp_path), "sample", 0, 0, compression_type="") as writer:
+        writer.write(ExampleEncoder(COLUMNS).encode(["ab", "1.0", "3", "0"]))
+    path = writer.shards[0].path
+    with open(path, "ab") as f:
+        f.write(b"\x00" * 5)
+
+    report = verify_shard(path, config)
+    assert 1 == report.num_records
+    assert ["Truncated record at the end of " + path] == report.errors
@@ -0,0 +1,76 @@
+import collections
+
+import pytest
+
+from tfrecorder.config import Config
+from tfrecorder.convert import ConvertTask
+from tfrecorder.datatype import Column, FeatureType
+from tfrecorder.vocab import build_vocabulary, count_values, load_vocabulary, save_vocabulary
+
+
+@pytest.mark.parametrize(
+    "min_count, max_size, expected",
+    [
+        pytest.param(1, 0, ["b", "a", "c", "d"], id="All"),
+        pytest.param(2, 0, ["b", "a", "c"], id="Min Count"),
+        pytest.param(1, 2, ["b", "a"], id="Max Size"),
+    ],
+)
+def test_build_vocabulary(min_count, max_size, expected):
+    counts = collections.Counter({"a": 2, "b": 3, "c": 2, "d": 1, "line\nbreak": 5})
+    assert expected == build_vocabulary(counts, min_count, max_size)
+
+
+def test_build_vocabulary_appends():
+    counts = collections.Counter({"a": 2, "b": 3, "c": 2, "x": 9})
+    assert ["x", "c", "b", "a"] == build_vocabulary(counts, existing=["x", "c"])
+    assert ["x", "c", "b"] == build_vocabulary(counts, max_size=3, existing=["x", "c"])
+
+
+def test_save_and_load_vocabulary(tmp_path):
+    path = str(tmp_path / "column.vocab")
+    save_vocabulary(path, ["RECV", "", "안녕 하세요"])
+    assert {"RECV": 0, "": 1, "안녕 하세요": 2} == load_vocabulary(path)
+
+
+@pytest.mark.parametrize("content", [b"RECV\nSEND", b"RECV\r\nSEND\r\n"], ids=["No Trailing Line Break", "CRLF"])
+def test_load_vocabulary(content, tmp_path):
+    path = tmp_path / "given.vocab"
+    path.write_bytes(content)
+    assert {"RECV": 0, "SEND": 1} == load_vocabulary(str(path))
+
+
+def test_count_values(config, tmp_path):
+    path = tmp_path / "sample.tsv"
+    path.write_text("a\t1\tx\nb\t2\ty\na\t3\tx\nwrong\tlength\n")
+    columns = [
+        Column("first", FeatureType.CATEGORICAL),
+        Column("second", FeatureType.INT),
+        Column("third", FeatureType.CATEGORICAL),
+    ]
+    config = Config(**{**config, "columns": columns, "skip_header": False})
+
+    counts = count_values(ConvertTask(0, str(path)), config)
+    assert {"first": {"a": 2, "b": 1}, "third": {"x": 2, "y": 1}} == counts
+
+
+def test_count_tokens(config, tmp_path):
+    path = tmp_path / "sample.tsv"
+    path.write_text("a b a\tx\nb c\ty\n")
+    columns = [
+        Column("text", FeatureType.TOKENIZED),
+        Column("given", FeatureType.TOKENIZED, vocab_file=str(tmp_path / "given.vocab")),
+    ]
+    config = Config(**{**config, "columns": columns, "skip_header": False})
+
+    # Vocabularies given as files are not counted
+    assert {"text": {"a": 2, "b": 2, "c": 1}} == count_values(ConvertTask(0, str(path)), config)
+
+
+def test_count_tokens_up_to_max_tokens(config, tmp_path):
+    path = tmp_path / "sample.tsv"
+    path.write_text("a b c d e f g\nb a\n")
+    config = Config(
+        **{**config, "columns": [Column("text", FeatureType.TOKENIZED, max_tokens=2)], "skip_header": False}
+    )
+    assert {"text": {"a": 2, "b": 2}} == count_values(ConvertTask(0, str(path)), config)
@@ -0,0 +1,397 @@
+import asyncio
+import json
+import os
+import shutil
+
+import pytest
+import tensorflow as tf
+
+from tfrecorder.config import Config
+from tfrecorder.datatype import FeatureType, parse_metadata
+from tfrecorder.fileio import IndexedTFRecordReader, read_tfrecord_file
+from tfrecorder.localgcs import LocalBlob
+from tfrecorder.worker import Worker
+
+
+def read_records(shards, compression_type):
+    return [
+        tf.train.Example.FromString(record)
+        for shard in sorted(shards)
+        for record in tf.data.TFRecordDataset(shard.path, compression_type=compression_type).as_numpy_iterator()
+    ]
+
+
+def sample_config(config, tmp_path, **kwargs):
+    return Config(
+        **{
+            **config,
+            "from_path": "./tests/data/sample_tsv*.tsv",
+            "to_path": str(tmp_path) + "/",
+            "skip_header": True,
+            "batch_size": 1,
+            "max_pool_size": 2,
+            "columns": parse_metadata("./tests/data/sample_metadata.json")["columns"],
+            **kwargs,
+        }
+    )
+
+
+def test_convert(config, tmp_path):
+    config = sample_config(config, tmp_path)
+    shards = asyncio.run(Worker(config).convert())
+
+    # The first row of both files is skipped as a header
+    assert 3 == len(shards)
+    assert all(shard.num_records == 1 for shard in shards)
+    examples = read_records(shards, config.compression_type)
+    assert ["RECV", "SEND", "RECV"] == [
+        example.features.feature["message_type"].bytes_list.value[0].decode() for example in examples
+    ]
+    assert [1, 1, 1] == [example.features.feature["concat_count"].int64_list.value[0] for example in examples]
+
+
+def test_convert_and_upload(config, tmp_path):
+    config = sample_config(
+        config,
+        tmp_path / "outputs",
+        only_convert=False,
+        only_upload=False,
+        delete_after_upload=True,
+        upload_queue_size=1,
+        local_bucket_dir=str(tmp_path / "gcs"),
+    )
+    asyncio.run(Worker(config).run())
+
+    expected = [
+        "sample_dataset.0000-0000.tfrecord",
+        "sample_dataset.0001-0000.tfrecord",
+        "sample_dataset.0001-0001.tfrecord",
+    ]
+    assert expected == sorted(os.listdir(tmp_path / "gcs" / "sample_dataset.tfrecord"))
+    assert ["sample_dataset.manifest.json"] == os.listdir(tmp_path / "outputs")
+
+
+@pytest.mark.parametrize("options", [{}, {"compression_type": "", "record_index": True}])
+def test_convert_and_upload_diskless(options, config, tmp_path):
+    config = sample_config(
+        config,
+        tmp_path / "outputs",
+        only_convert=False,
+        only_upload=False,
+        delete_after_upload=False,
+        local_bucket_dir=str(tmp_path / "gcs"),
+        **options,
+    )
+    asyncio.run(Worker(config).run())
+    worker = Worker(
+        config._replace(
+            to_path=str(tmp_path / "diskless") + "/", local_bucket_dir=str(tmp_path / "gcs-diskless"), diskless=True
+        )
+    )
+    asyncio.run(worker.run())
+
+    # Same shards as written on disk and uploaded, without any of them on disk
+    bucket = tmp_path / "gcs-diskless" / "sample_dataset.tfrecord"
+    assert sorted(os.listdir(tmp_path / "outputs")) == sorted(os.listdir(bucket)) + ["sample_dataset.manifest.json"]
+    for name in os.listdir(bucket):
+        assert (tmp_path / "outputs" / name).read_bytes() == (bucket / name).read_bytes()
+    assert ["sample_dataset.manifest.json"] == os.listdir(tmp_path / "diskless")
+    assert 3 == worker.metrics.counters["files_uploaded"]
+
+    # Shards of the manifest are in the bucket, so nothing is converted again
+    assert [] == asyncio.run(Worker(worker.config).convert())
+
+
+@pytest.mark.parametrize("diskless", [False, True], ids=["Upload", "Diskless"])
+def test_convert_and_upload_removes_stale_blobs(diskless, config, tmp_path):
+    inputs = tmp_path / "inputs"
+    inputs.mkdir()
+    for filename in ("sample_tsv.tsv", "sample_tsv_with_header.tsv"):
+        shutil.copy(os.path.join("./tests/data", filename), inputs / filename)
+    config = sample_config(
+        config,
+        tmp_path / "outputs",
+        from_path=str(inputs) + "/*.tsv",
+        only_convert=False,
+        only_upload=False,
+        local_bucket_dir=str(tmp_path / "gcs"),
+        diskless=diskless,
+    )
+    asyncio.run(Worker(config).run())
+    bucket = tmp_path / "gcs" / "sample_dataset.tfrecord"
+    assert 3 == len(os.listdir(bucket))
+
+    # One row less, and removed
+    with open(inputs / "sample_tsv_with_header.tsv", "r+") as f:
+        f.truncate(len(f.readline()) + len(f.readline()))
+    os.remove(inputs / "sample_tsv.tsv")
+    asyncio.run(Worker(config).run())
+    assert ["sample_dataset.0001-0000.tfrecord"] == os.listdir(bucket)
+
+
+@pytest.mark.parametrize(
+    "first, second, expected",
+    [
+        pytest.param(
+            {"num_shards": 4},
+            {"num_shards": 2},
+            ["sample_dataset.0000-of-0002.tfrecord", "sample_dataset.0001-of-0002.tfrecord"],
+            id="Fixed",
+        ),
+        pytest.param(
+            {"shuffle_buckets": 2},
+            {"shuffle_buckets": 1},
+            [f"sample_dataset.shuffled.0000-{idx:04d}.tfrecord" for idx in range(3)],
+            id="Shuffled",
+        ),
+    ],
+)
+def test_convert_and_upload_replaces_blobs(first, second, expected, config, tmp_path):
+    config = sample_config(
+        config, tmp_path / "outputs", only_convert=False, only_upload=False, local_bucket_dir=str(tmp_path / "gcs")
+    )
+    asyncio.run(Worker(config._replace(**first)).run())
+    # Shards of the first run are only left in the bucket, as they are deleted after upload
+    assert 0 == asyncio.run(Worker(config._replace(**second)).run())
+    assert expected == sorted(os.listdir(tmp_path / "gcs" / "sample_dataset.tfrecord"))
+
+
+def test_upload(config, tmp_path):
+    config = sample_config(
+        config, tmp_path / "outputs", only_convert=True, only_upload=False, local_bucket_dir=str(tmp_path / "gcs")
+    )
+    asyncio.run(Worker(config).run())
+    asyncio.run(Worker(config._replace(only_convert=False, only_upload=True, delete_after_upload=False)).run())
+
+    expected = [
+        "sample_dataset.0000-0000.tfrecord",
+        "sample_dataset.0001-0000.tfrecord",
+        "sample_dataset.0001-0001.tfrecord",
+    ]
+    assert expected == sorted(os.listdir(tmp_path / "gcs" / "sample_dataset.tfrecord"))
+    assert expected + ["sample_dataset.manifest.json"] == sorted(os.listdir(tmp_path / "outputs"))
+
+
+@pytest.mark.parametrize("only_convert", [False, True], ids=["Convert & Upload", "Upload"])
+def test_upload_failed(only_convert, config, tmp_path, monkeypatch):
+    config = sample_config(
+        config,
+        tmp_path / "outputs",
+        only_convert=False,
+        only_upload=False,
+        delete_after_upload=False,
+        local_bucket_dir=str(tmp_path / "gcs"),
+    )
+    if only_convert:
+        asyncio.run(Worker(config._replace(only_convert=True)).run())
+        config = config._replace(only_upload=True)
+    upload_from_filename = LocalBlob.upload_from_filename
+
+    def failing_upload_from_filename(blob, filename):
+        if filename.endswith("0001-0000.tfrecord"):
+            raise PermissionError(filename)
+        upload_from_filename(blob, filename)
+
+    monkeypatch.setattr(LocalBlob, "upload_from_filename", failing_upload_from_filename)
+    worker = Worker(config)
+    assert 1 == asyncio.run(worker.run())
+    assert 1 == worker.metrics.counters["upload_failures"]
+    assert 2 == worker.metrics.counters["files_uploaded"]
+
+
+def test_convert_num_shards(config, tmp_path):
+    config = sample_config(config, tmp_path, skip_header=False, max_error=-1, num_shards=2)
+    shards = asyncio.run(Worker(config).convert())
+
+    expected = ["sample_dataset.0000-of-0002.tfrecord", "sample_dataset.0001-of-0002.tfrecord"]
+    assert expected == sorted(os.path.basename(shard.path) for shard in shards)
+    assert expected == sorted(os.listdir(tmp_path))
+    assert [2, 2] == [shard.num_records for shard in sorted(shards)]
+
+
+@pytest.mark.parametrize("options", [{"num_shards": 2}, {"shuffle_buckets": 2}], ids=["Fixed", "Shuffled"])
+def test_convert_failed(options, config, tmp_path):
+    # Header of sample_tsv_with_header.tsv reaches the limit
+    config = sample_config(
+        config, tmp_path, only_convert=True, only_upload=False, skip_header=False, max_error=1, **options
+    )
+    worker = Worker(config)
+    assert 1 == asyncio.run(worker.run())
+    assert 1 == worker.metrics.counters["files_failed"]
+    assert [] == os.listdir(tmp_path)
+
+
+def test_convert_shuffled(config, tmp_path):
+    config = sample_config(config, tmp_path / "first", skip_header=False, batch_size=3, shuffle_buckets=2, seed=3)
+    shards = asyncio.run(Worker(config).convert())
+
+    assert sorted(os.path.basename(shard.path) for shard in shards) == sorted(os.listdir(tmp_path / "first"))
+    examples = read_records(shards, config.compression_type)
+    unshuffled = read_records(
+        asyncio.run(Worker(config._replace(to_path=str(tmp_path / "plain") + "/", shuffle_buckets=0)).convert()),
+        config.compression_type,
+    )
+    assert sorted(example.SerializeToString() for example in unshuffled) == sorted(
+        example.SerializeToString() for example in examples
+    )
+
+    # Same seed shuffles the same input in the same order
+    again = asyncio.run(Worker(config._replace(to_path=str(tmp_path / "second") + "/")).convert())
+    assert examples == read_records(again, config.compression_type)
+
+
+def test_convert_record_index(config, tmp_path):
+    config = sample_config(
+        config,
+        tmp_path / "outputs",
+        only_convert=False,
+        only_upload=False,
+        delete_after_upload=True,
+        compression_type="",
+        record_index=True,
+        local_bucket_dir=str(tmp_path / "gcs"),
+    )
+    asyncio.run(Worker(config).run())
+
+    bucket = tmp_path / "gcs" / "sample_dataset.tfrecord"
+    shards = sorted(name for name in os.listdir(bucket) if name.endswith(".tfrecord"))
+    assert 3 == len(shards)
+    assert sorted(shards + [name + ".index" for name in shards]) == sorted(os.listdir(bucket))
+    for name in shards:
+        with IndexedTFRecordReader(str(bucket / name)) as reader:
+            assert list(read_tfrecord_file(str(bucket / name), compression_type="")) == [reader[0]]
+
+
+def test_verify(config, tmp_path):
+    config = sample_config(config, tmp_path, only_convert=True, only_upload=False)
+    shards = asyncio.run(Worker(config).convert())
+
+    worker = Worker(config._replace(command="verify"))
+    assert 0 == asyncio.run(worker.run())
+    assert 3 == worker.metrics.counters["records_verified"]
+    assert len(shards) == worker.metrics.counters["shards_verified"]
+    assert 0 == worker.metrics.counters["verify_errors"]
+
+    # Verify against the wrong columns
+    worker = Worker(config._replace(command="verify", columns=config.columns[1:]))
+    assert 1 == asyncio.run(worker.run())
+    assert 3 == worker.metrics.counters["verify_errors"]
+
+
+def test_convert_categorical(config, tmp_path):
+    config = sample_config(config, tmp_path, columnar=True)
+    columns = [
+        column._replace(feature_type=FeatureType.CATEGORICAL) if column.name == "message_type" else column
+        for column in config.columns
+    ]
+    config = config._replace(columns=columns)
+    shards = asyncio.run(Worker(config).convert())
+
+    with open(tmp_path / "sample_dataset.message_type.vocab") as f:
+        assert ["RECV\n", "SEND\n"] == f.readlines()
+    examples = read_records(shards, config.compression_type)
+    assert [0, 1, 0] == [example.features.feature["message_type"].int64_list.value[0] for example in examples]
+    assert 0 == asyncio.run(Worker(config._replace(command="verify")).run())
+
+    # Same vocabulary on the next run, so nothing is converted again
+    assert [] == asyncio.run(Worker(config).convert())
+
+
+def test_convert_tokenized(config, tmp_path):
+    config = sample_config(config, tmp_path)
+    columns = [
+        column._replace(feature_type=FeatureType.TOKENIZED, tokenizer="regex", lowercase=True, length_feature=True)
+        if column.name == "utterance"
+        else column
+        for column in config.columns
+    ]
+    config = config._replace(columns=columns)
+    shards = asyncio.run(Worker(config).convert())
+
+    with open(tmp_path / "sample_dataset.utterance.vocab") as f:
+        vocabulary = [line[:-1] for line in f]
+    examples = read_records(shards, config.compression_type)
+    tokens = [
+        [vocabulary[idx] for idx in example.features.feature["utterance"].int64_list.value] for example in examples
+    ]
+    assert ["good", "to", "see", "you", "!"] == tokens[0]
+    assert [len(ids) for ids in tokens] == [
+        example.features.feature["utterance_length"].int64_list.value[0] for example in examples
+    ]
+    assert 0 == asyncio.run(Worker(config._replace(command="verify")).run())
+
+
+def test_convert_split_bytes(config, tmp_path):
+    config = sample_config(config, tmp_path, split_bytes=40)
+    shards = asyncio.run(Worker(config).convert())
+
+    # Same records as test_convert, written by the tasks of each byte range
+    assert 3 == len(shards)
+    assert all(os.path.basename(shard.path).count("-") == 2 for shard in shards)
+    examples = read_records(shards, config.compression_type)
+    assert ["RECV", "SEND", "RECV"] == [
+        example.features.feature["message_type"].bytes_list.value[0].decode() for example in examples
+    ]
+
+
+def test_convert_metrics(config, tmp_path):
+    config = sample_config(
+        config,
+        tmp_path / "outputs",
+        only_convert=True,
+        only_upload=False,
+        metrics_path=str(tmp_path / "metrics.json"),
+        prometheus_path=str(tmp_path / "metrics.prom"),
+        profile=str(tmp_path / "convert.prof"),
+    )
+    asyncio.run(Worker(config).run())
+
+    with open(tmp_path / "metrics.json") as f:
+        metrics = json.load(f)
+    # The first row of both files is skipped as a header
+    assert 3 == metrics["counters"]["rows_parsed"]
+    assert 0 == metrics["counters"]["rows_rejected"]
+    assert 3 == metrics["counters"]["examples_serialized"]
+    assert {"read", "encode", "write", "total"} <= set(metrics["timers"])
+    assert "tfrecorder_examples_serialized_total 3" in (tmp_path / "metrics.prom").read_text().splitlines()
+    assert os.path.exists(tmp_path / "convert.prof")
+
+
+@pytest.mark.parametrize("options", [{"num_shards": 2}, {"shuffle_buckets": 2}], ids=["Fixed", "Shuffled"])
+def test_convert_metrics_staging(options, config, tmp_path):
+    config = sample_config(config, tmp_path, **options)
+    worker = Worker(config)
+    shards = asyncio.run(worker.convert())
+
+    # Staging files are not counted as the output
+    assert len(shards) == worker.metrics.counters["shards_written"]
+    assert sum(os.path.getsize(shard.path) for shard in shards) == worker.metrics.counters["bytes_written"]
+    assert 0 < worker.metrics.counters["staging_bytes"]
+
+
+def test_convert_stats(config, tmp_path):
+    config = sample_config(config, tmp_path, stats=True, split_bytes=40)
+    asyncio.run(Worker(config).convert())
+
+    with open(tmp_path / "sample_dataset.stats.json") as f:
+        stats = json.load(f)
+    assert 3 == stats["num_rows"]
+    assert 2 == stats["columns"]["message_type"]["distinct"]
+    assert {"min": 1, "max": 1, "mean": 1} == {
+        key: stats["columns"]["concat_count"][key] for key in ("min", "max", "mean")
+    }
+    assert {"16-31": 3} == stats["columns"]["utterance"]["length_histogram"]
+
+    # Nothing is converted again, and the statistics of every file are restored from the manifest
+    os.remove(tmp_path / "sample_dataset.stats.json")
+    assert [] == asyncio.run(Worker(config).convert())
+    with open(tmp_path / "sample_dataset.stats.json") as f:
+        assert stats == json.load(f)
+
+
+def test_convert_stats_num_shards(config, tmp_path):
+    config = sample_config(config, tmp_path, stats=True, num_shards=2)
+    asyncio.run(Worker(config).convert())
+
+    with open(tmp_path / "sample_dataset.stats.json") as f:
+        assert 3 == json.load(f)["num_rows"]
@@ -1,6 +1,7 @@
 import enum
 import logging
-from typing import List, NamedTuple
+import os
+from typing import List, NamedTuple, Optional
 
 from .datatype import Column
 
@@ -9,11 +10,15 @@ class ExecutionMode(enum.Enum):
     CONVERT_AND_UPLOAD = 0
     UPLOAD = 1
     CONVERT = 2
+    VERIFY = 3
+    MERGE_MANIFESTS = 4
 
 
 class Config(NamedTuple):
     #: Metadata file path
     metadata_path: str
+    #: Command to run instead of converting or uploading, 'verify' or 'merge-manifests'
+    command: Optional[str]
 
     """Configuration From Argument"""
     #: Do only convert
@@ -22,21 +27,80 @@ class Config(NamedTuple):
     only_upload: bool
     #: Delete file after upload, if execution mode is CONVERT_AND_UPLOAD
     delete_after_upload: bool
+    #: Start without asking for confirmation
+    yes: bool
 
     #: Batch size for writing and uploading TFRecord file
     batch_size: int
+    #: Convert - Roll over to the next shard when it reaches this size after compression, instead of batch_size
+    target_shard_bytes: int
+    #: Convert - Write the whole dataset into this number of shards of equal record count, instead of batch_size
+    num_shards: int
+    #: Convert - Shuffle the records of the whole dataset through this number of on-disk buckets, 0 not to shuffle
+    shuffle_buckets: int
+    #: Convert - Seed of the shuffle, which makes the output reproducible
+    seed: int
+    #: Convert - Number of nodes the input files are partitioned across by the hash of their paths
+    num_partitions: int
+    #: Convert - Partition of the input files this node converts, from 0 to num_partitions - 1
+    partition_index: int
     #: Max pool size for multiprocessing
     max_pool_size: int
-    #: Chunksize to distribute for multiprocessing
+    #: Chunksize to distribute for multiprocessing, if task_bytes is not set
     chunk_size: int
+    #: Convert - Bytes of input in each unit of work distributed to the pool, largest first. 0 to use chunk_size
+    task_bytes: int
+    #: Max number of converted files waiting for upload, if execution mode is CONVERT_AND_UPLOAD
+    upload_queue_size: int
+    #: Stream every shard into the bucket from the pool workers without writing it on disk,
+    #: if execution mode is CONVERT_AND_UPLOAD
+    diskless: bool
+    #: Memory of each pool worker to buffer the shard being streamed, which is also the chunk size of its upload
+    diskless_buffer_bytes: int
+    #: Convert - Convert every file again, even if it has not changed since the last run
+    full_convert: bool
     #: Convert - Compression type
     compression_type: str
-    #: Convert - Max Error to tolerate
+    #: Convert - zlib compression level from 0 to 9, -1 for the default
+    compression_level: int
+    #: Convert - Number of threads to compress each shard with
+    compression_threads: int
+    #: Convert - Write the index of record offsets next to each shard, for random access. Only without compression.
+    record_index: bool
+    #: Convert - Backend to write TFRecord files, 'native' or 'tensorflow'
+    writer_backend: str
+    #: Convert - Split files larger than this into byte ranges converted as separate tasks, 0 not to split
+    split_bytes: int
+    #: Convert - Max Error to tolerate, for each file or byte range
     max_error: int
+    #: Convert - Collect statistics of every column while converting, into the stats file next to the shards
+    stats: bool
+    #: Convert - Featurize a block of rows at once per column, with NumPy
+    columnar: bool
+    #: Convert - Number of rows in a block, if columnar is set
+    block_size: int
     #: Upload - Project ID on GCP
     gcp_project_id: str
     #: Upload - Location of the bucket
     bucket_location: str
+    #: Upload - Number of files to upload at once
+    upload_concurrency: int
+    #: Upload - Chunk size of resumable uploads in bytes, used for files larger than this
+    upload_chunk_size: int
+    #: Upload - Max number of retries on transient errors
+    upload_retries: int
+    #: Upload - Skip files which already exist in the bucket with the same checksum
+    sync: bool
+    #: Upload - Delete files in the bucket which do not exist locally, if sync is set in UPLOAD mode
+    delete_remote: bool
+    #: Upload - Directory to use as a local stand-in of Google Cloud Storage, for testing
+    local_bucket_dir: Optional[str]
+    #: Path to write the metrics of the run as JSON
+    metrics_path: Optional[str]
+    #: Path to write the metrics of the run in the Prometheus text format
+    prometheus_path: Optional[str]
+    #: Path to write the cProfile stats merged from every process, not profiled if None
+    profile: Optional[str]
 
     """Configuration From Metadata"""
     #: Dataset Name
@@ -52,17 +116,38 @@ class Config(NamedTuple):
     #: Column information
     columns: List[Column]
 
+    @property
+    def tfrecord_path(self) -> str:
+        return os.path.dirname(self.to_path)
+
+    @property
+    def shard_name(self) -> str:
+        """Name of the shards and the manifest of this node, which has the partition if the input is partitioned."""
+        if self.num_partitions > 1:
+            return f"{self.name}.p{self.partition_index:04d}"
+        return self.name
+
     @property
     def exec_mode(self) -> str:
+        if self.command == "verify":
+            return ExecutionMode.VERIFY
+        if self.command == "merge-manifests":
+            return ExecutionMode.MERGE_MANIFESTS
         return ExecutionMode(((2 if self.only_convert else 0) + (1 if self.only_upload else 0)) % 3)
 
     def print(self):
-        exec_mode = ("Convert & Upload", "Upload", "Convert")
+        exec_mode = ("Convert & Upload", "Upload", "Convert", "Verify", "Merge Manifests")
 
         logging.info("Configuration:")
         logging.info(f" * Execution Mode: {exec_mode[self.exec_mode.value]}")
-        logging.info(f" * Dataset Path: {self.dataset_path}")
+        logging.info(f" * Dataset Path: {self.from_path}")
         logging.info(f" * TFRecord Path: {self.tfrecord_path}")
-        logging.info(f" * File Mode: {self.mode}")
+        logging.info(f" * File Type: {self.file_type}")
         logging.info(f" * Compression Type: {self.compression_type}")
-        logging.info(f" * Multiprocessing: Max {self.max_pool_size} cores (chunksize {self.chunksize})")
+        if self.num_partitions > 1:
+            logging.info(f" * Partition: {self.partition_index} of {self.num_partitions}")
+        if self.diskless:
+            logging.info(
+                f" * Diskless: Streamed into the bucket, {self.diskless_buffer_bytes / 2**20:g} MiB per worker"
+            )
+        logging.info(f" * Multiprocessing: Max {self.max_pool_size} cores (chunksize {self.chunk_size})")
@@ -1,28 +1,344 @@
 """Utility class for converting each feature into tf.train.Features."""
 import logging
-from typing import List, Tuple, Union
+import os
+import time
+from queue import Queue
+from typing import TYPE_CHECKING, BinaryIO, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
 
-import tensorflow as tf
+import numpy as np
 
 from .config import Config
 from .datatype import FeatureType
-from .fileio import read_file
+from .encoder import ColumnBuffer, ExampleEncoder
+from .fileio import BucketWriter, ShardInfo, ShardWriter, file_digest, read_file
+from .metrics import Metrics, profiled
+from .stats import DatasetStats
+from .tokenizer import length_column
+from .utils import ErrorCounter, batch_iter
+from .vocab import load_vocabularies
+
+if TYPE_CHECKING:
+    import tensorflow as tf
+
+
+class ConvertTask(NamedTuple):
+    #: ID of the task, used for the shard filenames
+    task_id: int
+    #: Path of the file to convert
+    path: str
+    #: Index of the byte range, if the file is split into multiple tasks
+    part: Optional[int] = None
+    #: Offset of the byte range to convert
+    start: int = 0
+    #: End offset of the byte range to convert, None for the end of the file
+    stop: Optional[int] = None
+
+
+class TaskResult(NamedTuple):
+    #: ID of the task, used for the shard filenames
+    task_id: int
+    #: Path of the converted file
+    path: str
+    #: Manifests of the written shards
+    shards: List[ShardInfo]
+    #: SHA-256 of the converted byte range, to be combined by :func:`<tfrecorder.fileio.combine_digests>`.
+    #: None if no manifest is kept, with `num_shards` or `shuffle_buckets`
+    sha256: Optional[str]
+    #: Summary of :class:`<tfrecorder.metrics.Metrics>` of the task
+    metrics: Optional[Dict[str, Dict[str, float]]] = None
+    #: Statistics of the columns of the converted rows, if `stats` is set
+    stats: Optional[DatasetStats] = None
+    #: Index of the byte range, if the file is split into multiple tasks
+    part: Optional[int] = None
+    #: Error which stopped the conversion, such as reaching `max_error`. The shards are truncated then.
+    error: Optional[str] = None
 
 
 class Converter:
-    def __init__(self, config: Config):
+    def __init__(
+        self,
+        config: Config,
+        vocabularies: Optional[Dict[str, Dict[str, int]]] = None,
+        open_stream: Optional[Callable[[str], BinaryIO]] = None,
+    ):
         self.config: Config = config
+        #: IDs by value of every CATEGORICAL and TOKENIZED column, by name. Loaded from `tfrecord_path` if not given.
+        self.vocabularies: Dict[str, Dict[str, int]] = (
+            vocabularies if vocabularies is not None else load_vocabularies(config)
+        )
+        self.encoder: ExampleEncoder = ExampleEncoder(config.columns, self.vocabularies)
+        #: Opens the stream to write each shard into by its file name, instead of the file, e.g. a blob of the bucket
+        self.open_stream: Optional[Callable[[str], BinaryIO]] = open_stream
 
-    def convert_one_file(self, inp: Tuple[str, Config]) -> Tuple[List[tf.train.Example], int]:
-        file_path, config = inp
+    def convert_one_file(
+        self,
+        file_path: str,
+        start: int = 0,
+        stop: Optional[int] = None,
+        metrics: Optional[Metrics] = None,
+        stats: Optional[DatasetStats] = None,
+    ) -> Iterator[bytes]:
+        """
+        Lazily convert every row of the given file, or of its byte range, into serialized tf.train.Example.
+        Rows which cannot be converted are skipped, and count towards `max_error` with the parsing errors.
+        Time to read and encode the rows is added to `metrics`, with the number of parsed and rejected rows.
+        Converted rows are added to `stats` in blocks of `block_size`, if given.
+        """
+        config = self.config
+        metrics = metrics if metrics is not None else Metrics()
+        errors = ErrorCounter(config.max_error)
+        rows = metrics.timed(
+            read_file(
+                file_path, config.file_type, skip_header=config.skip_header, errors=errors, start=start, stop=stop
+            ),
+            "read",
+            counter="rows_parsed",
+        )
         try:
-            parsed = read_file(file_path, config.file_type, skip_header=config.skip_header, max_error=config.max_error)
+            if config.columnar:
+                for block in batch_iter(rows, config.block_size):
+                    with metrics.timer("encode"):
+                        records = self.convert_block(block, errors, stats=stats, metrics=metrics)
+                    yield from records
+                return
+
+            elapsed = 0.0
+            converted = []
+            try:
+                for line in rows:
+                    started = time.perf_counter()
+                    try:
+                        record = self.encoder.encode(line)
+                    except ValueError as e:
+                        logging.error(f"Error has occurred while converting file {file_path}:")
+                        logging.error(e)
+                        errors.add()
+                        continue
+                    finally:
+                        elapsed += time.perf_counter() - started
+                    if stats is not None:
+                        converted.append(line)
+                        if len(converted) >= config.block_size:
+                            self._add_stats(stats, converted, metrics)
+                            converted = []
+                    yield record
+                if stats is not None:
+                    self._add_stats(stats, converted, metrics)
+            finally:
+                metrics.time("encode", elapsed)
+        finally:
+            metrics.count("rows_rejected", errors.count)
+
+    def convert_block(
+        self,
+        rows: List[List[str]],
+        errors: ErrorCounter,
+        stats: Optional[DatasetStats] = None,
+        metrics: Optional[Metrics] = None,
+    ) -> List[bytes]:
+        """
+        Convert a block of rows into serialized tf.train.Example at once, via typed column buffers.
+        Converted rows are added to `stats`, if given.
+        """
+        if any(len(row) != len(self.config.columns) for row in rows):
+            valid_rows = [row for row in rows if len(row) == len(self.config.columns)]
+            self._reject(len(rows) - len(valid_rows), errors)
+            rows = valid_rows
+
+        buffers, valid = self.featurize_columns(rows)
+        if not valid.all():
+            self._reject(int(np.count_nonzero(~valid)), errors)
+            buffers = [
+                buffer[valid] if isinstance(buffer, np.ndarray) else [v for v, ok in zip(buffer, valid) if ok]
+                for buffer in buffers
+            ]
+            rows = [row for row, ok in zip(rows, valid) if ok]
+        if stats is not None:
+            self._add_stats(stats, rows, metrics if metrics is not None else Metrics(), buffers)
+        return self.encoder.encode_columns(buffers)
+
+    @staticmethod
+    def _add_stats(
+        stats: DatasetStats, rows: List[List[str]], metrics: Metrics, buffers: Optional[List[ColumnBuffer]] = None
+    ):
+        # Timed on its own, to see what collecting the statistics costs. Part of `encode` with `columnar` too.
+        started = time.perf_counter()
+        stats.add_rows(rows, buffers)
+        metrics.time("stats", time.perf_counter() - started)
+
+    def featurize_columns(self, rows: List[List[str]]) -> Tuple[List[ColumnBuffer], np.ndarray]:
+        """
+        Transpose the rows into columns, and featurize each column at once with NumPy.
+
+        :param rows: Rows which have the same length with the columns
+        :return: Typed buffer of each column, and mask of the rows converted without error
+        """
+        values_by_column = list(zip(*rows)) if rows else [()] * len(self.config.columns)
+        valid = np.ones(len(rows), dtype=bool)
+        buffers = []
+        for values, column in zip(values_by_column, self.config.columns):
+            if column.feature_type == FeatureType.CATEGORICAL:
+                vocabulary = self.vocabularies[column.name]
+                oov = len(vocabulary)
+                ids = np.fromiter((vocabulary.get(value, oov) for value in values), dtype=np.int64, count=len(values))
+                buffers.append(ids)
+                continue
+            if column.feature_type == FeatureType.TOKENIZED:
+                buffers.append([self.encoder.tokenizers[column.name].token_ids(value) for value in values])
+                continue
+            buffer, column_valid = self.featurize_column(values, column.feature_type)
+            buffers.append(buffer)
+            valid &= column_valid
+        return buffers, valid
+
+    @staticmethod
+    def featurize_column(values: Tuple[str, ...], feature_type: FeatureType) -> Tuple[ColumnBuffer, np.ndarray]:
+        """
+        Featurize every value of one column into typed buffer.
+
+        :param values: Values of the column
+        :param feature_type: :class:`<tfrecorder.converter.FeatureType>`
+        :return: Typed buffer, and mask of the values converted without error
+        """
+        valid = np.ones(len(values), dtype=bool)
+        if feature_type in (FeatureType.STRING, FeatureType.BYTES):
+            return [value.encode() for value in values], valid
+
+        array = np.array(values, dtype=str)
+        if feature_type == FeatureType.BOOL:
+            # Only supports `0`, `1`, `True`, `true`, `False`, `false`
+            return np.isin(np.char.lower(np.char.strip(array)), ("1", "true")).astype(np.int64), valid
+
+        if feature_type == FeatureType.FLOAT:
+            dtype, parse = np.float64, float
+        elif feature_type == FeatureType.INT:
+            dtype, parse = np.int64, int
+        else:
+            raise ValueError(f"Got unexpected feature type: {feature_type}")
+
+        try:
+            parsed = array.astype(dtype)
+        except (ValueError, OverflowError):
+            # Some values are invalid, so find them one by one
+            parsed = np.zeros(len(values), dtype=dtype)
+            for idx, value in enumerate(values):
+                try:
+                    parsed[idx] = parse(value)
+                except (ValueError, OverflowError):
+                    valid[idx] = False
+        if feature_type == FeatureType.FLOAT:
+            with np.errstate(over="ignore"):
+                parsed = parsed.astype(np.float32)
+        return parsed, valid
+
+    @staticmethod
+    def _reject(count: int, errors: ErrorCounter):
+        logging.error(f"{count} rows are skipped since they cannot be converted")
+        errors.add(count)
+
+    def convert_to_shards(self, task: Tuple, shard_queue: Optional[Queue] = None) -> TaskResult:
+        """
+        Convert one file, or its byte range, and write its records straight into shard files under `tfrecord_path`.
+
+        :param task: :class:`ConvertTask`, or pair of task ID, which makes the shard filenames unique, and the file path
+        :param shard_queue: Queue to put the manifest of each shard into as soon as it is written.
+            Blocks the conversion while the queue is full.
+        :return: Manifests of the written shards, with the digest of the file and the metrics of the task
+        """
+        task_id, file_path, part, start, stop = ConvertTask(*task)
+        config = self.config
+        metrics = Metrics()
+        stats = DatasetStats(config.columns) if config.stats else None
+        with profiled(config.profile, f"convert-{task_id:04d}-{part or 0:04d}"), ShardWriter(
+            config.tfrecord_path,
+            config.shard_name,
+            task_id,
+            0 if config.target_shard_bytes else config.batch_size,
+            compression_type=config.compression_type,
+            on_shard=shard_queue.put if shard_queue is not None else None,
+            backend=config.writer_backend,
+            target_bytes=config.target_shard_bytes,
+            part=part,
+            compression_level=config.compression_level,
+            compression_threads=config.compression_threads,
+            index=config.record_index,
+            open_stream=self.open_stream,
+        ) as writer:
+            error = self._write_records(writer, file_path, start, stop, metrics, stats)
+        if self.open_stream is not None:
+            metrics.count("files_uploaded", len(writer.shards))
+            metrics.count("bytes_uploaded", sum(shard.num_bytes for shard in writer.shards))
+        return self._task_result(task_id, file_path, part, start, stop, writer.shards, metrics, stats, error)
+
+    def convert_to_buckets(self, task: Tuple) -> TaskResult:
+        """
+        Convert one file, or its byte range, and scatter its records into `shuffle_buckets` bucket files
+        under `tfrecord_path`, as the first pass of the global shuffle.
+
+        :param task: :class:`ConvertTask`, or pair of task ID and the file path
+        :return: Manifests of the bucket files, with the digest of the file and the metrics of the task
+        """
+        task_id, file_path, part, start, stop = ConvertTask(*task)
+        config = self.config
+        metrics = Metrics()
+        stats = DatasetStats(config.columns) if config.stats else None
+        with profiled(config.profile, f"scatter-{task_id:04d}-{part or 0:04d}"), BucketWriter(
+            config.tfrecord_path, task_id, config.shuffle_buckets, config.seed, part=part
+        ) as writer:
+            error = self._write_records(writer, file_path, start, stop, metrics, stats)
+        return self._task_result(task_id, file_path, part, start, stop, writer.shards, metrics, stats, error)
+
+    def _write_records(
+        self,
+        writer: Union[ShardWriter, BucketWriter],
+        file_path: str,
+        start: int,
+        stop: Optional[int],
+        metrics: Metrics,
+        stats: Optional[DatasetStats] = None,
+    ) -> Optional[str]:
+        """
+        Write every record converted from the byte range of the file, and close the writer.
+
+        :return: Error which stopped the conversion, or None if every record is written
+        """
+        elapsed = 0.0
+        error = None
+        try:
+            for record in self.convert_one_file(file_path, start=start, stop=stop, metrics=metrics, stats=stats):
+                started = time.perf_counter()
+                writer.write(record)
+                elapsed += time.perf_counter() - started
         except ValueError as e:
-            logging.error(e)
+            error = str(e)
+        # Closing the last shard flushes the compressor
+        with metrics.timer("write"):
+            writer.close()
+        metrics.time("write", elapsed)
+        return error
 
-        return [self.build_example(line, config) for line in parsed], len(parsed)
+    def _task_result(
+        self,
+        task_id: int,
+        file_path: str,
+        part: Optional[int],
+        start: int,
+        stop: Optional[int],
+        shards: List[ShardInfo],
+        metrics: Metrics,
+        stats: Optional[DatasetStats] = None,
+        error: Optional[str] = None,
+    ) -> TaskResult:
+        metrics.count("bytes_read", (stop if stop is not None else os.path.getsize(file_path)) - start)
+        metrics.count("examples_serialized", sum(shard.num_records for shard in shards))
+        metrics.count("shards_written", len(shards))
+        metrics.count("bytes_written", sum(shard.num_bytes for shard in shards))
+        # Every task hashes its own range, so no task reads the whole of a large file again
+        keeps_manifest = not (self.config.num_shards or self.config.shuffle_buckets)
+        sha256 = file_digest(file_path, start=start, stop=stop) if keeps_manifest and error is None else None
+        return TaskResult(task_id, file_path, shards, sha256, metrics.summary(), stats, part, error)
 
-    def build_example(self, data_list: List[str]) -> tf.train.Example:
+    def build_example(self, data_list: List[str]) -> "tf.train.Example":
         """
         Build tf.train.Example object by given data list and metadata.
 
@@ -33,14 +349,23 @@ class Converter:
         if len(data_list) != len(self.config.columns):
             raise ValueError("Length of data list should be equal with length of metadata list.")
 
-        feature = {
-            column.name: self.featurize(data, column.feature_type)
-            for data, column in zip(data_list, self.config.columns)
-        }
+        import tensorflow as tf
+
+        feature = {}
+        for data, column in zip(data_list, self.config.columns):
+            if column.feature_type == FeatureType.CATEGORICAL:
+                feature[column.name] = self._int64_feature(self.category_id(data, column.name))
+            elif column.feature_type == FeatureType.TOKENIZED:
+                ids = self.encoder.tokenizers[column.name].token_ids(data)
+                feature[column.name] = tf.train.Feature(int64_list=tf.train.Int64List(value=ids))
+                if column.length_feature:
+                    feature[length_column(column).name] = self._int64_feature(len(ids))
+            else:
+                feature[column.name] = self.featurize(data, column.feature_type)
 
         return tf.train.Example(features=tf.train.Features(feature=feature))
 
-    def featurize(self, value: str, feature_type: FeatureType) -> tf.train.Feature:
+    def featurize(self, value: str, feature_type: FeatureType) -> "tf.train.Feature":
         """
         Featurize one Tensor into tf.train.Feature.
 
@@ -57,24 +382,35 @@ class Converter:
         if feature_type == FeatureType.BOOL:
             # Only supports `0`, `1`, `True`, `true`, `False`, `false`
             value = value.strip().lower()
-            return self._int64_feature(value in ("1", "true"))
+            return self._int64_feature(int(value in ("1", "true")))
         raise ValueError(f"Got unexpected feature type: {feature_type}")
 
+    def category_id(self, value: str, column_name: str) -> int:
+        """ID of the value in the vocabulary of the CATEGORICAL column, or the size of it if the value is not in."""
+        vocabulary = self.vocabularies[column_name]
+        return vocabulary.get(value, len(vocabulary))
+
     @staticmethod
-    def _bytes_feature(value: Union[str, bytes]) -> tf.train.Feature:
+    def _bytes_feature(value: Union[str, bytes]) -> "tf.train.Feature":
         """Returns a bytes_list from a string / byte."""
-        if isinstance(value, type(tf.constant(0))):
+        import tensorflow as tf
+
+        if tf.is_tensor(value):
             value = value.numpy()  # BytesList won't unpack a string from an EagerTensor.
         if isinstance(value, str):
             value = value.encode()  # Transition from string to bytes
         return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
 
     @staticmethod
-    def _float_feature(value: Union[float, int]) -> tf.train.Feature:
+    def _float_feature(value: Union[float, int]) -> "tf.train.Feature":
         """Returns a float_list from a float / double."""
+        import tensorflow as tf
+
         return tf.train.Feature(float_list=tf.train.FloatList(value=[value]))
 
     @staticmethod
-    def _int64_feature(value: Union[int, bool]) -> tf.train.Feature:
+    def _int64_feature(value: Union[int, bool]) -> "tf.train.Feature":
         """Returns an int64_list from a bool / enum / int / uint."""
+        import tensorflow as tf
+
         return tf.train.Feature(int64_list=tf.train.Int64List(value=[value]))
@@ -1,6 +1,7 @@
 import enum
 import json
-from typing import Dict, List, NamedTuple, Union
+import re
+from typing import Dict, List, NamedTuple, Optional, Union
 
 
 class FeatureType(enum.Enum):
@@ -9,11 +10,54 @@ class FeatureType(enum.Enum):
     BOOL = "bool"
     INT = "int"
     BYTES = "bytes"
+    #: String encoded as int64 ID in the vocabulary built over the whole dataset
+    CATEGORICAL = "categorical"
+    #: String split into tokens, encoded as variable-length int64 IDs of the tokens in the vocabulary
+    TOKENIZED = "tokenized"
+
+
+#: Tokenizers of TOKENIZED columns
+TOKENIZERS = ("whitespace", "regex", "wordpiece")
 
 
 class Column(NamedTuple):
     name: str
     feature_type: FeatureType
+    #: CATEGORICAL, TOKENIZED - Min number of occurrences of a value to be in the vocabulary
+    min_count: int = 1
+    #: CATEGORICAL, TOKENIZED - Max size of the vocabulary, keeping the most frequent values. 0 for no limit
+    max_vocab_size: int = 0
+    #: TOKENIZED - 'whitespace', 'regex' to split by `pattern`, or 'wordpiece' to split words into `vocab_file`
+    tokenizer: str = "whitespace"
+    #: TOKENIZED - Regular expression which matches each token, or each word for 'wordpiece'. None for the default
+    pattern: Optional[str] = None
+    #: TOKENIZED - Local vocabulary file of one token per line, instead of building it over the dataset
+    vocab_file: Optional[str] = None
+    #: TOKENIZED - Lowercase the value before splitting it
+    lowercase: bool = False
+    #: TOKENIZED - Keep only the first tokens of each value up to this number. 0 for no limit
+    max_tokens: int = 0
+    #: TOKENIZED - Write the number of tokens as an INT feature `<name>_length` too
+    length_feature: bool = False
+
+
+def parse_column(obj: Dict[str, Union[str, int]]) -> Column:
+    """Build the column from its metadata, which has the name, the feature type and its options if any."""
+    options = {key: value for key, value in obj.items() if key not in ("name", "feature_type")}
+    unknown = set(options) - set(Column._fields)
+    if unknown:
+        raise ValueError(f"Unknown options of column `{obj['name']}`: {', '.join(sorted(unknown))}")
+    column = Column(obj["name"], FeatureType(obj["feature_type"]), **options)
+    if column.tokenizer not in TOKENIZERS:
+        raise ValueError(f"Tokenizer of column `{column.name}` should be one of: {', '.join(TOKENIZERS)}")
+    if column.tokenizer == "wordpiece" and column.vocab_file is None:
+        raise ValueError(f"Column `{column.name}` should have `vocab_file` to use the wordpiece tokenizer")
+    if column.pattern is not None:
+        try:
+            re.compile(column.pattern)
+        except re.error as e:
+            raise ValueError(f"Invalid pattern of column `{column.name}`: {e}")
+    return column
 
 
 def parse_metadata(file_path: str) -> Dict[str, Union[str, List[Column]]]:
@@ -22,7 +66,7 @@ def parse_metadata(file_path: str) -> Dict[str, Union[str, List[Column]]]:
         obj = json.load(f)
 
     # Reform "columns" with actual objects
-    obj["columns"] = [Column(column["name"], FeatureType(column["feature_type"])) for column in obj["columns"]]
+    obj["columns"] = [parse_column(column) for column in obj["columns"]]
     # Extract keys from "convert"
     for key, value in obj["convert"].items():
         obj[key] = value
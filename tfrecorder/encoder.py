@@ -0,0 +1,285 @@
+"""Encoder which writes the wire format of tf.train.Example directly, without building protobuf objects."""
+import math
+import struct
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from .datatype import Column, FeatureType
+from .tokenizer import Tokenizer, length_column
+
+#: Typed values of one column: encoded bytes for STRING/BYTES, float32 array for FLOAT,
+#: int64 array for INT/BOOL/CATEGORICAL, and tuples of token IDs for TOKENIZED
+ColumnBuffer = Union[Sequence[bytes], np.ndarray, Sequence[Tuple[int, ...]]]
+
+_FLOAT = struct.Struct("<f")
+_INT64_MIN = -(1 << 63)
+_INT64_MAX = (1 << 63) - 1
+_UINT64_MASK = (1 << 64) - 1
+
+# Tags of the length-delimited fields, `(field_number << 3) | 2`
+_TAG_1 = b"\x0a"  # Example.features, Features.feature, map key, {Bytes,Float,Int64}List.value
+_TAG_2 = b"\x12"  # map value, Feature.float_list
+_TAG_3 = b"\x1a"  # Feature.int64_list
+
+
+def encode_varint(value: int) -> bytes:
+    """Encode non-negative integer as a protobuf base 128 varint."""
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def encode_float(value: float) -> bytes:
+    """Encode float as a little-endian float32, saturating to infinity as protobuf does."""
+    try:
+        return _FLOAT.pack(value)
+    except OverflowError:
+        return _FLOAT.pack(math.copysign(math.inf, value))
+
+
+def encode_int64(value: int) -> bytes:
+    """Encode int64 as a varint, using two's complement for negative values."""
+    if not _INT64_MIN <= value <= _INT64_MAX:
+        raise ValueError(f"Value out of range: {value}")
+    return encode_varint(value & _UINT64_MASK)
+
+
+def encode_varints(values: np.ndarray) -> List[bytes]:
+    """Encode int64 array into varints at once, using two's complement for negative values."""
+    unsigned = values.astype(np.uint64)
+    shifts = np.arange(0, 70, 7, dtype=np.uint64)
+    groups = (unsigned[:, None] >> shifts) & np.uint64(0x7F)
+    nonzero = groups != 0
+    sizes = np.where(nonzero.any(axis=1), 10 - np.argmax(nonzero[:, ::-1], axis=1), 1)
+    # Every byte but the last one has the continuation bit
+    groups |= np.where(np.arange(10) < (sizes - 1)[:, None], 0x80, 0).astype(np.uint64)
+    data = groups.astype(np.uint8).tobytes()
+    return [data[start : start + size] for start, size in zip(range(0, len(data), 10), sizes.tolist())]
+
+
+def _length_delimited(tag: bytes, payload: bytes) -> bytes:
+    return tag + encode_varint(len(payload)) + payload
+
+
+def _float_prefix(key: bytes) -> bytes:
+    """Everything of the map entry before the value, for a FLOAT column."""
+    # Packed FloatList of a single value always has the same size, so the whole prefix is constant
+    float_list = _TAG_1 + b"\x04"
+    feature = _TAG_2 + encode_varint(len(float_list) + 4) + float_list
+    entry = key + _TAG_2 + encode_varint(len(feature) + 4) + feature
+    return _TAG_1 + encode_varint(len(entry) + 4) + entry
+
+
+def _int_prefixes(key: bytes) -> List[bytes]:
+    """Everything of the map entry before the value, for an INT column, for each varint size from 0 to 10 bytes."""
+    prefixes = []
+    for size in range(11):
+        int64_list = _TAG_1 + encode_varint(size)
+        feature = _TAG_3 + encode_varint(len(int64_list) + size) + int64_list
+        entry = key + _TAG_2 + encode_varint(len(feature) + size) + feature
+        prefixes.append(_TAG_1 + encode_varint(len(entry) + size) + entry)
+    return prefixes
+
+
+def _int64_list_entry(key: bytes, values: Sequence[int]) -> bytes:
+    """Map entry of a TOKENIZED column, which has any number of non-negative values."""
+    packed = b"".join([encode_varint(value) for value in values])
+    # Packed field without any value is not written at all
+    int64_list = _length_delimited(_TAG_1, packed) if packed else b""
+    feature = _length_delimited(_TAG_3, int64_list)
+    return _length_delimited(_TAG_1, key + _length_delimited(_TAG_2, feature))
+
+
+def _bytes_entry(key: bytes, value: bytes) -> bytes:
+    """Map entry of a STRING/BYTES column."""
+    # BytesList holding a single value
+    bytes_list = _TAG_1 + encode_varint(len(value)) + value
+    feature = _TAG_1 + encode_varint(len(bytes_list)) + bytes_list
+    entry = key + _TAG_2 + encode_varint(len(feature)) + feature
+    return _TAG_1 + encode_varint(len(entry)) + entry
+
+
+class ExampleEncoder:
+    """
+    Serialize rows into tf.train.Example wire bytes, byte-for-byte identical to
+    `Converter.build_example(row).SerializeToString(deterministic=True)`.
+    Map entries are sorted by the bytes of the key as the C++ implementation of protobuf does, while upb sorts
+    a key after the keys it is a prefix of, e.g. `text` after `text_length`. Such examples parse the same.
+
+    Everything that only depends on the columns (tags and map keys) is built once here,
+    so encoding a row only has to encode each value and its lengths.
+
+    :param columns: Columns of the rows
+    :param vocabularies: IDs by value of every CATEGORICAL column, and by token of every TOKENIZED column, by name.
+        Values out of the vocabulary are encoded as the size of the vocabulary.
+    """
+
+    def __init__(self, columns: List[Column], vocabularies: Optional[Dict[str, Dict[str, int]]] = None):
+        self.columns: List[Column] = columns
+        self.vocabularies: Dict[str, Dict[str, int]] = vocabularies if vocabularies is not None else {}
+        #: Tokenizer of every TOKENIZED column, by name
+        self.tokenizers: Dict[str, Tokenizer] = {
+            column.name: Tokenizer(column, self.vocabularies.get(column.name))
+            for column in columns
+            if column.feature_type == FeatureType.TOKENIZED
+        }
+        # Column of each feature with the index of the column it is encoded from,
+        # as the length of a TOKENIZED column is encoded from the same value
+        features: List[Tuple[Column, int]] = []
+        for idx, column in enumerate(columns):
+            features.append((column, idx))
+            if column.feature_type == FeatureType.TOKENIZED and column.length_feature:
+                features.append((length_column(column), idx))
+        # Deterministic serialization writes map entries sorted by key
+        self._features: List[Tuple[Column, int]] = sorted(features, key=lambda feature: feature[0].name.encode())
+        self._order: List[int] = [idx for _, idx in self._features]
+        self._encoders: List[Callable[[str], bytes]] = [
+            self._compile_length(feature, self.tokenizers[columns[idx].name])
+            if feature.name != columns[idx].name
+            else self._compile(feature, self.vocabularies.get(feature.name), self.tokenizers.get(feature.name))
+            for feature, idx in self._features
+        ]
+
+    def encode(self, data_list: List[str]) -> bytes:
+        """
+        Encode one row into serialized tf.train.Example.
+
+        :param data_list: List of the values in the row, in the order of the columns
+        :return: Serialized tf.train.Example
+        """
+        if len(data_list) != len(self.columns):
+            raise ValueError("Length of data list should be equal with length of metadata list.")
+        features = b"".join([encode(data_list[idx]) for encode, idx in zip(self._encoders, self._order)])
+        return _TAG_1 + encode_varint(len(features)) + features
+
+    def encode_columns(self, buffers: List[ColumnBuffer]) -> List[bytes]:
+        """
+        Encode a block of rows given as typed column buffers, e.g. from `Converter.featurize_columns`.
+
+        :param buffers: Buffers of each column, in the order of the columns
+        :return: Serialized tf.train.Example of each row
+        """
+        if len(buffers) != len(self.columns):
+            raise ValueError("Length of column buffers should be equal with length of metadata list.")
+        entries = [
+            self._encode_column(feature, buffers[idx])
+            if feature.name == self.columns[idx].name
+            else self._encode_column(feature, np.array([len(ids) for ids in buffers[idx]], dtype=np.int64))
+            for feature, idx in self._features
+        ]
+        return [_TAG_1 + encode_varint(len(features)) + features for features in map(b"".join, zip(*entries))]
+
+    def __reduce__(self):
+        # Compiled closures cannot be pickled, so compile again when sent to the pool workers
+        return ExampleEncoder, (self.columns, self.vocabularies)
+
+    @staticmethod
+    def _encode_column(column: Column, buffer: ColumnBuffer) -> List[bytes]:
+        """Encode every value of the column buffer into `Features.feature` map entries."""
+        key = _length_delimited(_TAG_1, column.name.encode())
+        feature_type = column.feature_type
+
+        if feature_type in (FeatureType.STRING, FeatureType.BYTES):
+            return [_bytes_entry(key, value) for value in buffer]
+        if feature_type == FeatureType.FLOAT:
+            prefix = _float_prefix(key)
+            packed = buffer.astype("<f4").tobytes()
+            return [prefix + packed[start : start + 4] for start in range(0, len(packed), 4)]
+        if feature_type in (FeatureType.INT, FeatureType.CATEGORICAL):
+            prefixes = _int_prefixes(key)
+            return [prefixes[len(varint)] + varint for varint in encode_varints(buffer)]
+        if feature_type == FeatureType.BOOL:
+            prefix = _int_prefixes(key)[1]
+            true_entry, false_entry = prefix + b"\x01", prefix + b"\x00"
+            return [true_entry if value else false_entry for value in buffer.tolist()]
+        if feature_type == FeatureType.TOKENIZED:
+            return [_int64_list_entry(key, ids) for ids in buffer]
+        raise ValueError(f"Got unexpected feature type: {feature_type}")
+
+    @staticmethod
+    def _compile_length(column: Column, tokenizer: Tokenizer) -> Callable[[str], bytes]:
+        """Build the function which encodes the number of tokens of one value into the map entry of `column`."""
+        int_prefixes = _int_prefixes(_length_delimited(_TAG_1, column.name.encode()))
+
+        def encode_length(value: str) -> bytes:
+            # Tokens of the value are cached, so the value is tokenized once for both features
+            varint = encode_varint(len(tokenizer.token_ids(value)))
+            return int_prefixes[len(varint)] + varint
+
+        return encode_length
+
+    @staticmethod
+    def _compile(
+        column: Column, vocabulary: Optional[Dict[str, int]] = None, tokenizer: Optional[Tokenizer] = None
+    ) -> Callable[[str], bytes]:
+        """Build the function which encodes one value of the column into a `Features.feature` map entry."""
+        key = _length_delimited(_TAG_1, column.name.encode())
+        feature_type = column.feature_type
+
+        if feature_type in (FeatureType.STRING, FeatureType.BYTES):
+
+            def encode_bytes(value: str) -> bytes:
+                return _bytes_entry(key, value.encode())
+
+            return encode_bytes
+
+        if feature_type == FeatureType.FLOAT:
+            float_prefix = _float_prefix(key)
+
+            def encode_float_value(value: str) -> bytes:
+                return float_prefix + encode_float(float(value))
+
+            return encode_float_value
+
+        if feature_type == FeatureType.CATEGORICAL:
+            if vocabulary is None:
+                raise ValueError(f"Vocabulary of `{column.name}` is not given.")
+            categorical_prefixes = _int_prefixes(key)
+
+            def int_entry(value: int) -> bytes:
+                varint = encode_varint(value)
+                return categorical_prefixes[len(varint)] + varint
+
+            # Every entry is built once, so encoding a value is a single lookup
+            entries = {value: int_entry(idx) for value, idx in vocabulary.items()}
+            oov_entry = int_entry(len(vocabulary))
+
+            def encode_categorical_value(value: str) -> bytes:
+                return entries.get(value, oov_entry)
+
+            return encode_categorical_value
+
+        if feature_type == FeatureType.TOKENIZED:
+            if vocabulary is None or tokenizer is None:
+                raise ValueError(f"Vocabulary of `{column.name}` is not given.")
+
+            def encode_tokens(value: str) -> bytes:
+                return _int64_list_entry(key, tokenizer.token_ids(value))
+
+            return encode_tokens
+
+        if feature_type in (FeatureType.INT, FeatureType.BOOL):
+            int_prefixes = _int_prefixes(key)
+
+            if feature_type == FeatureType.INT:
+
+                def encode_int_value(value: str) -> bytes:
+                    varint = encode_int64(int(value))
+                    return int_prefixes[len(varint)] + varint
+
+                return encode_int_value
+
+            true_entry = int_prefixes[1] + b"\x01"
+            false_entry = int_prefixes[1] + b"\x00"
+
+            def encode_bool_value(value: str) -> bytes:
+                # Only supports `0`, `1`, `True`, `true`, `False`, `false`
+                return true_entry if value.strip().lower() in ("1", "true") else false_entry
+
+            return encode_bool_value
+
+        raise ValueError(f"Got unexpected feature type: {feature_type}")
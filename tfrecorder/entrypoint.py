@@ -3,9 +3,12 @@ import asyncio
 import logging
 import multiprocessing
 import os
+import sys
+from typing import List, Optional
 
-from .config import Config
+from .config import Config, ExecutionMode
 from .datatype import parse_metadata
+from .fileio import WRITER_BACKENDS
 from .worker import Worker
 
 # Logging configuration
@@ -13,10 +16,19 @@ logging.basicConfig(format="[%(asctime)s] %(message)s", datefmt="%Y/%m/%d %H:%M:
 # Disable logs from TensorFlow
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
 
+#: Commands which can be given before METADATA_PATH, instead of converting or uploading
+COMMANDS = ("verify", "merge-manifests")
+
 # Argparse Configuration
 parser = argparse.ArgumentParser(
-    description="Automatically convert CSV or TSV files to TFRecord, and upload them to Google Cloud Storage.",
+    usage="%(prog)s [verify | merge-manifests] METADATA_PATH [options]",
+    description=(
+        "Automatically convert CSV or TSV files to TFRecord, and upload them to Google Cloud Storage. "
+        + "With `verify`, check every converted file under to_path against the columns instead. "
+        + "With `merge-manifests`, merge the manifests of every --num-partitions into the manifest of the dataset."
+    ),
 )
+parser.set_defaults(command=None)
 parser.add_argument("metadata_path", metavar="METADATA_PATH", type=str, help="Path of JSON file which have metadata")
 parser.add_argument(
     "-c",
@@ -26,9 +38,93 @@ parser.add_argument(
     default="GZIP",
     help="TFRecord compression type. Use GZIP by default.",
 )
+parser.add_argument(
+    "--compression-level",
+    dest="compression_level",
+    type=int,
+    default=-1,
+    help="zlib compression level from 0 (fastest) to 9 (smallest). Use the zlib default (-1) by default.",
+)
+parser.add_argument(
+    "--compression-threads",
+    dest="compression_threads",
+    type=int,
+    default=1,
+    help=(
+        "Number of threads to compress each file with, in blocks as pigz does. "
+        + "Only with the native writer backend. Use 1 by default."
+    ),
+)
+parser.add_argument(
+    "--record-index",
+    dest="record_index",
+    nargs="?",
+    type=bool,
+    const=True,
+    default=False,
+    help=(
+        "Write the byte offset and length of every record into FILE.tfrecord.index next to each file, "
+        + "for random access. Only without compression (-c '')."
+    ),
+)
+parser.add_argument(
+    "--full-convert",
+    dest="full_convert",
+    nargs="?",
+    type=bool,
+    const=True,
+    default=False,
+    help="Convert every file again. By default, only files new or changed since the last run are converted.",
+)
+parser.add_argument(
+    "--writer-backend",
+    dest="writer_backend",
+    type=str,
+    choices=WRITER_BACKENDS,
+    default="native",
+    help="Backend to write TFRecord files. 'native' does not need TensorFlow. Use native by default.",
+)
+parser.add_argument(
+    "--split-bytes",
+    dest="split_bytes",
+    type=int,
+    default=0,
+    help=(
+        "Split files larger than this size in bytes into ranges of lines, converted in parallel. "
+        + "Should not be used if quoted fields contain newlines. "
+        + "Not set (0) by default, which converts each file in a single process."
+    ),
+)
 parser.add_argument(
     "--max-error", type=int, default=-1, help="Max error records while parsing. Not set (-1) by default."
 )
+parser.add_argument(
+    "--stats",
+    nargs="?",
+    type=bool,
+    const=True,
+    default=False,
+    help=(
+        "Collect statistics of every column while converting, and write them into NAME.stats.json next to the files: "
+        + "counts, empty values, min/max/mean of numbers, ratio of true, and length histogram "
+        + "and approximate number of distinct values of strings."
+    ),
+)
+parser.add_argument(
+    "--columnar",
+    nargs="?",
+    type=bool,
+    const=True,
+    default=False,
+    help="Featurize a block of rows at once per column with NumPy. Faster on numeric columns.",
+)
+parser.add_argument(
+    "--block-size",
+    dest="block_size",
+    type=int,
+    default=1024,
+    help="Number of rows featurized at once with --columnar. Use 1024 by default.",
+)
 parser.add_argument(
     "--only-convert",
     dest="only_convert",
@@ -47,6 +143,24 @@ parser.add_argument(
     default=False,
     help="Only upload the files to GCS, not convert (will read TFRECORD_PATH only)",
 )
+parser.add_argument(
+    "--delete-after-upload",
+    dest="delete_after_upload",
+    nargs="?",
+    type=bool,
+    const=True,
+    default=False,
+    help="Delete each file after it is uploaded, while converting and uploading simultaneously.",
+)
+parser.add_argument(
+    "-y",
+    "--yes",
+    nargs="?",
+    type=bool,
+    const=True,
+    default=False,
+    help="Start without asking for confirmation, e.g. in batch schedulers.",
+)
 parser.add_argument(
     "--batch-size",
     dest="batch_size",
@@ -54,6 +168,61 @@ parser.add_argument(
     default=1000,
     help="Size of the examples one file should have. Use 1000 by default.",
 )
+parser.add_argument(
+    "--target-shard-bytes",
+    dest="target_shard_bytes",
+    type=int,
+    default=0,
+    help=(
+        "Roll over to the next file when it reaches this size in bytes after compression, "
+        + "instead of --batch-size. Only with the native writer backend. Not set (0) by default."
+    ),
+)
+parser.add_argument(
+    "--num-shards",
+    dest="num_shards",
+    type=int,
+    default=0,
+    help=(
+        "Write the whole dataset into this number of files with equal number of examples, "
+        + "instead of --batch-size. Converts every file again on each run. Not set (0) by default."
+    ),
+)
+parser.add_argument(
+    "--shuffle-buckets",
+    dest="shuffle_buckets",
+    type=int,
+    default=0,
+    help=(
+        "Shuffle the records of the whole dataset, by scattering them into this number of buckets on disk "
+        + "and shuffling each bucket in memory. Each bucket should fit in the memory of a process. "
+        + "Converts every file again on each run. Not set (0) by default."
+    ),
+)
+parser.add_argument(
+    "--seed",
+    type=int,
+    default=0,
+    help="Seed of --shuffle-buckets. The same seed shuffles the same input in the same order. Use 0 by default.",
+)
+parser.add_argument(
+    "--num-partitions",
+    dest="num_partitions",
+    type=int,
+    default=1,
+    help=(
+        "Number of nodes to convert the input files on, with the same from_path and to_path. "
+        + "Each file is assigned to a partition by the hash of its path, and each node converts its own partition "
+        + "into files and a manifest named after it. Not partitioned (1) by default."
+    ),
+)
+parser.add_argument(
+    "--partition-index",
+    dest="partition_index",
+    type=int,
+    default=0,
+    help="Partition to convert on this node, from 0 to --num-partitions - 1. Use 0 by default.",
+)
 parser.add_argument(
     "--max-pool-size",
     dest="max_pool_size",
@@ -62,7 +231,55 @@ parser.add_argument(
     help="Max pool size for multiprocessing. Use all cores by default.",
 )
 parser.add_argument(
-    "--chunk-size", dest="chunk_size", type=int, default=10, help="Chunksize for multiprocessing. Use 10 by default."
+    "--chunk-size",
+    dest="chunk_size",
+    type=int,
+    default=10,
+    help="Number of files in each unit of work for multiprocessing, if --task-bytes is 0. Use 10 by default.",
+)
+parser.add_argument(
+    "--task-bytes",
+    dest="task_bytes",
+    type=int,
+    default=64 * 2**20,
+    help=(
+        "Bytes of input in each unit of work for multiprocessing. Files are converted largest first, "
+        + "and small files are grouped up to this size, so no worker is left with the largest files at the end. "
+        + "Combine with --split-bytes to split large files too. "
+        + "Set 0 to group every --chunk-size files in order instead. Use 64 MiB by default."
+    ),
+)
+parser.add_argument(
+    "--upload-queue-size",
+    dest="upload_queue_size",
+    type=int,
+    default=16,
+    help=(
+        "Max number of converted files waiting for upload while converting and uploading simultaneously. "
+        + "Conversion pauses while the queue is full. Use 16 by default."
+    ),
+)
+parser.add_argument(
+    "--diskless",
+    nargs="?",
+    type=bool,
+    const=True,
+    default=False,
+    help=(
+        "Stream every shard into the bucket as it is written, as a chunked resumable upload, "
+        + "instead of writing it on disk and reading it back to upload. Only when converting and uploading."
+    ),
+)
+parser.add_argument(
+    "--diskless-buffer-bytes",
+    dest="diskless_buffer_bytes",
+    type=int,
+    default=16 * 2**20,
+    help=(
+        "Memory of each worker to buffer the shard being streamed with --diskless, in bytes. "
+        + "Sent as a chunk of the upload once full, so it should be a multiple of 262144 (256 KiB). "
+        + "Use 16 MiB by default."
+    ),
 )
 parser.add_argument(
     "--gcp-project-id",
@@ -81,28 +298,151 @@ parser.add_argument(
     default=None,
     help="Location of the bucket when upload. Use None by default, which will be treated as US-CENTRAL1 by Google.",
 )
+parser.add_argument(
+    "--upload-concurrency",
+    dest="upload_concurrency",
+    type=int,
+    default=16,
+    help="Number of files to upload at once, with threads. Use 16 by default.",
+)
+parser.add_argument(
+    "--upload-chunk-size",
+    dest="upload_chunk_size",
+    type=int,
+    default=8 * 2**20,
+    help=(
+        "Chunk size of resumable uploads in bytes, used for files larger than this. "
+        + "Should be a multiple of 262144 (256 KiB). Use 8 MiB by default."
+    ),
+)
+parser.add_argument(
+    "--upload-retries",
+    dest="upload_retries",
+    type=int,
+    default=5,
+    help="Max number of retries with exponential backoff on transient upload errors. Use 5 by default.",
+)
+parser.add_argument(
+    "--sync",
+    nargs="?",
+    type=bool,
+    const=True,
+    default=False,
+    help="Skip files which already exist in the bucket with the same size and checksum (CRC32C or MD5).",
+)
+parser.add_argument(
+    "--delete-remote",
+    dest="delete_remote",
+    nargs="?",
+    type=bool,
+    const=True,
+    default=False,
+    help="Delete files in the bucket which do not exist locally. Only with --sync and --only-upload.",
+)
+parser.add_argument(
+    "--local-bucket-dir",
+    dest="local_bucket_dir",
+    type=str,
+    default=None,
+    help="Upload into buckets made as directories under this path instead of Google Cloud Storage, for testing.",
+)
+parser.add_argument(
+    "--metrics-path",
+    dest="metrics_path",
+    type=str,
+    default=None,
+    help="Path to write the counters and the time spent in each stage as JSON.",
+)
+parser.add_argument(
+    "--prometheus-path",
+    dest="prometheus_path",
+    type=str,
+    default=None,
+    help="Path to write the metrics in the Prometheus text format, e.g. for the textfile collector.",
+)
+parser.add_argument(
+    "--profile",
+    nargs="?",
+    type=str,
+    const="tfrecorder.prof",
+    default=None,
+    help="Profile every conversion task with cProfile, and write the merged stats. Into tfrecorder.prof by default.",
+)
 
 
-def parse_arguments() -> Config:
-    """Parse command line arguments."""
+def parse_arguments(argv: Optional[List[str]] = None) -> Config:
+    """Parse command line arguments, which may start with one of :data:`COMMANDS`."""
+    argv = sys.argv[1:] if argv is None else argv
+    command = argv[0] if argv and argv[0] in COMMANDS else None
     # Merge two configuration source
-    args = vars(parser.parse_args())
+    args = vars(parser.parse_args(argv[1:] if command else argv))
+    args["command"] = command
     metadata = parse_metadata(args["metadata_path"])
     args.update(metadata)
 
     # Validation
-    if args["from_path"][-1] != "/":
+    if not command and args["from_path"][-1] != "/":
         raise ValueError("Given from_path is not a directory.", "Did you put '/' at the end of the path?")
     if args["file_type"] not in ("csv", "tsv"):
         raise ValueError("`file_type` can only have 'csv' or 'tsv'.")
+    for column in args["columns"]:
+        if column.vocab_file is not None and not os.path.exists(column.vocab_file):
+            raise ValueError(f"Vocabulary file of column `{column.name}` is not found in {column.vocab_file}")
     if args["only_convert"] and args["only_upload"]:
         raise ValueError("You cannot assign both option: --only-convert, --only-upload")
-    if not args["only_convert"]:
+    if not command and not args["only_convert"] and not args["local_bucket_dir"]:
         if "GOOGLE_APPLICATION_CREDENTIALS" not in os.environ:
             raise ValueError(
                 "You should provide the environment variable GOOGLE_APPLICATION_CREDENTIALS.",
                 "See https://cloud.google.com/docs/authentication/getting-started for detail.",
             )
+    if args["target_shard_bytes"] < 0 or args["num_shards"] < 0:
+        raise ValueError("--target-shard-bytes and --num-shards should not be negative.")
+    if args["split_bytes"] < 0:
+        raise ValueError("--split-bytes should not be negative.")
+    if args["task_bytes"] < 0:
+        raise ValueError("--task-bytes should not be negative.")
+    if args["chunk_size"] < 1:
+        raise ValueError("--chunk-size should be a positive integer.")
+    if args["num_partitions"] < 1:
+        raise ValueError("--num-partitions should be a positive integer.")
+    if not 0 <= args["partition_index"] < args["num_partitions"]:
+        raise ValueError("--partition-index should be between 0 and --num-partitions - 1.")
+    if args["shuffle_buckets"] < 0:
+        raise ValueError("--shuffle-buckets should not be negative.")
+    if args["shuffle_buckets"] and args["num_shards"]:
+        raise ValueError("You cannot assign both option: --shuffle-buckets, --num-shards")
+    if args["target_shard_bytes"] and args["num_shards"]:
+        raise ValueError("You cannot assign both option: --target-shard-bytes, --num-shards")
+    if args["target_shard_bytes"] and args["writer_backend"] != "native":
+        raise ValueError("--target-shard-bytes can only be used with the native writer backend.")
+    if not -1 <= args["compression_level"] <= 9:
+        raise ValueError("--compression-level should be between -1 and 9.")
+    if args["compression_threads"] < 1:
+        raise ValueError("--compression-threads should be a positive integer.")
+    if args["compression_threads"] > 1 and args["writer_backend"] != "native":
+        raise ValueError("--compression-threads can only be used with the native writer backend.")
+    if args["record_index"] and args["compression_type"]:
+        raise ValueError("--record-index can only be used without compression.")
+    if args["block_size"] < 1:
+        raise ValueError("--block-size should be a positive integer.")
+    if args["delete_remote"] and not (args["sync"] and args["only_upload"]):
+        raise ValueError("--delete-remote can only be used with --sync and --only-upload.")
+    if args["upload_concurrency"] < 1:
+        raise ValueError("--upload-concurrency should be a positive integer.")
+    if args["upload_chunk_size"] <= 0 or args["upload_chunk_size"] % (256 * 2**10) != 0:
+        raise ValueError("--upload-chunk-size should be a positive multiple of 262144 (256 KiB).")
+    if args["upload_queue_size"] < 1:
+        raise ValueError("--upload-queue-size should be a positive integer.")
+    if args["diskless"]:
+        if command or args["only_convert"] or args["only_upload"]:
+            raise ValueError("--diskless can only be used when converting and uploading.")
+        if args["writer_backend"] != "native":
+            raise ValueError("--diskless can only be used with the native writer backend.")
+        if args["num_shards"] or args["shuffle_buckets"]:
+            raise ValueError("--diskless cannot be used with --num-shards or --shuffle-buckets, which stage on disk.")
+    if args["diskless_buffer_bytes"] <= 0 or args["diskless_buffer_bytes"] % (256 * 2**10) != 0:
+        raise ValueError("--diskless-buffer-bytes should be a positive multiple of 262144 (256 KiB).")
     if args["compression_type"] not in ("GZIP", "ZLIB", ""):
         raise ValueError(
             f"Invalid compression type `{args['compression_type']}`",
@@ -121,10 +461,12 @@ def main():
         return 1
 
     config.print()
-    confirm = input("[?] Do you want to proceed? (Type 'Y' to start) > ")
-    if confirm != "Y":
-        logging.info("Abort.")
-        return 1
+    # Commands neither convert nor upload anything, so they do not have to be confirmed
+    if not config.yes and config.exec_mode not in (ExecutionMode.VERIFY, ExecutionMode.MERGE_MANIFESTS):
+        confirm = input("[?] Do you want to proceed? (Type 'Y' to start) > ")
+        if confirm != "Y":
+            logging.info("Abort.")
+            return 1
 
     worker = Worker(config)
-    asyncio.run(worker)
+    return asyncio.run(worker.run())
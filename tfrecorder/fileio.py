@@ -1,8 +1,62 @@
+import base64
+import bz2
+import csv
 import glob
+import gzip
+import hashlib
+import io
 import logging
-from typing import List
+import lzma
+import mmap
+import os
+import random
+import re
+import struct
+from typing import TYPE_CHECKING, BinaryIO, Callable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
 
-import tensorflow as tf
+import numpy as np
+
+from . import tfrecord
+from .utils import ErrorCounter
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - depends on the environment
+    zstandard = None
+
+if TYPE_CHECKING:
+    import tensorflow as tf
+
+#: Backends which can write TFRecord files. "native" does not need TensorFlow.
+WRITER_BACKENDS = ("native", "tensorflow")
+#: Size of the chunks to read input files in, in bytes
+READ_CHUNK_SIZE = 1 << 20
+#: Max number of characters of a CSV field. The default of :mod:`csv` is 131072, too small for long documents
+MAX_FIELD_CHARS = 2**31 - 1
+#: Bytes of records each task holds in memory before appending them into the bucket files, while shuffling
+BUCKET_BUFFER_BYTES = 16 << 20
+#: Suffix of the index of record offsets, written next to each uncompressed shard
+INDEX_SUFFIX = ".index"
+
+#: Compression of input files by their extension
+_INPUT_COMPRESSION_EXTENSIONS = {".gz": "gzip", ".bz2": "bz2", ".xz": "xz", ".zst": "zstd"}
+#: Compression of input files by their leading bytes, for files without the extension
+_INPUT_COMPRESSION_MAGICS = [
+    ("gzip", re.compile(rb"\x1f\x8b")),
+    # Stream header followed by the magic of the first block, which plain text is unlikely to have
+    ("bz2", re.compile(rb"BZh[1-9]1AY&SY")),
+    ("xz", re.compile(rb"\xfd7zXZ\x00")),
+    ("zstd", re.compile(rb"\x28\xb5\x2f\xfd")),
+]
+
+
+class ShardInfo(NamedTuple):
+    #: Path of the written TFRecord file
+    path: str
+    #: Number of records in the file
+    num_records: int
+    #: Size of the file in bytes
+    num_bytes: int
 
 
 def get_filenames(glob_string: str) -> List[str]:
@@ -10,46 +64,645 @@ def get_filenames(glob_string: str) -> List[str]:
     return glob.glob(glob_string, recursive=True)
 
 
-def read_file(path: str, file_type: str, skip_header: bool = False, max_error: int = -1) -> List[List[str]]:
+def shard_filename(directory: str, name: str, task_id: int, idx: int, part: Optional[int] = None) -> str:
+    """Build the path of the `idx`-th shard written by the task `task_id`, from the `part`-th range if it is split."""
+    if part is not None:
+        return os.path.join(directory, f"{name}.{task_id:04d}-{part:04d}-{idx:04d}.tfrecord")
+    return os.path.join(directory, f"{name}.{task_id:04d}-{idx:04d}.tfrecord")
+
+
+def fixed_shard_filename(directory: str, name: str, idx: int, num_shards: int) -> str:
+    """Build the path of the `idx`-th shard, when the dataset is written into fixed number of shards."""
+    return os.path.join(directory, f"{name}.{idx:04d}-of-{num_shards:04d}.tfrecord")
+
+
+def shard_pattern(directory: str, name: str, task_id: int) -> str:
+    """Glob pattern which matches every shard written by the task `task_id`."""
+    return os.path.join(directory, f"{name}.{task_id:04d}-*.tfrecord")
+
+
+def partition_of(path: str, num_partitions: int) -> int:
+    """
+    Partition the input file belongs to, by SHA-256 of its path. Unlike `hash()`, the digest is the same
+    in every process and on every node, so nodes globbing the same from_path agree on the assignment.
+    """
+    digest = hashlib.sha256(path.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % num_partitions
+
+
+def index_filename(path: str) -> str:
+    """Build the path of the index of the records of the TFRecord file."""
+    return path + INDEX_SUFFIX
+
+
+def remove_shard(path: str):
+    """Remove the shard, and its index if it has one."""
+    os.remove(path)
+    if os.path.exists(index_filename(path)):
+        os.remove(index_filename(path))
+
+
+def bucket_filename(directory: str, bucket: int, task_id: int, part: Optional[int] = None) -> str:
+    """Build the path of the file which the task `task_id` scatters the records of the `bucket` into."""
+    return os.path.join(directory, f"bucket-{bucket:04d}.{task_id:04d}-{part or 0:04d}.tfrecord")
+
+
+def bucket_pattern(directory: str, bucket: int) -> str:
+    """Glob pattern which matches every file of the `bucket`, written by any task."""
+    return os.path.join(directory, f"bucket-{bucket:04d}.*.tfrecord")
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20, start: int = 0, stop: Optional[int] = None) -> str:
+    """SHA-256 of the file content, or of its byte range from `start` to `stop`, in hex."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = stop - start if stop is not None else None
+        while remaining is None or remaining > 0:
+            chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return digest.hexdigest()
+
+
+def combine_digests(digests: Sequence[str]) -> str:
+    """
+    Digest of a file from the SHA-256 of each of its byte ranges in order, so every range is hashed by its own task.
+    The SHA-256 of the range itself if there is only one, which is the SHA-256 of the whole file.
+    """
+    if len(digests) == 1:
+        return digests[0]
+    return hashlib.sha256(",".join(digests).encode()).hexdigest()
+
+
+def split_file_digest(path: str, split_bytes: int) -> str:
+    """Digest of the file split into byte ranges as :func:`split_file` does, see :func:`combine_digests`."""
+    return combine_digests([file_digest(path, start=start, stop=stop) for start, stop in split_file(path, split_bytes)])
+
+
+def file_crc32c(path: str, chunk_size: int = 1 << 20) -> str:
+    """Base64 encoded big-endian CRC32C of the file, comparable with `Blob.crc32c`."""
+    crc = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            crc = tfrecord.crc32c(chunk, crc)
+    return base64.b64encode(struct.pack(">I", crc)).decode()
+
+
+def file_md5(path: str, chunk_size: int = 1 << 20) -> str:
+    """Base64 encoded MD5 of the file, comparable with `Blob.md5_hash`."""
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return base64.b64encode(digest.digest()).decode()
+
+
+def input_compression(path: str) -> Optional[str]:
+    """
+    Detect compression of the input file by its extension, or by its leading bytes.
+
+    :return: "gzip", "bz2", "xz", "zstd", or None if the file is not compressed
     """
-    Read the file by given file_type and path.
+    compression = _INPUT_COMPRESSION_EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    if compression is not None:
+        return compression
+    with open(path, "rb") as f:
+        head = f.read(10)
+    return next((compression for compression, magic in _INPUT_COMPRESSION_MAGICS if magic.match(head)), None)
+
+
+def open_input(path: str) -> BinaryIO:
+    """
+    Open the input file as a binary stream, which decompresses the content on the fly if the file is compressed.
+    Concatenated GZIP members and Zstandard frames are read one after another.
+    """
+    compression = input_compression(path)
+    if compression is None:
+        return open(path, "rb", buffering=0)
+    if compression == "gzip":
+        return gzip.open(path, "rb")
+    if compression == "bz2":
+        return bz2.open(path, "rb")
+    if compression == "xz":
+        return lzma.open(path, "rb")
+    if zstandard is None:
+        raise ValueError(f"Package `zstandard` should be installed to read {path}")
+    return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True, closefd=True)
+
+
+def split_file(path: str, split_bytes: int) -> List[Tuple[int, int]]:
+    """
+    Split the file into byte ranges of about `split_bytes`, each of them starting at the beginning of a line.
+    Compressed files are never split, since a range of them cannot be decompressed on its own.
+
+    :param path: File path
+    :param split_bytes: Target size of each range. The file is not split if it is 0.
+    :return: `(start, stop)` of each range, which cover the whole file
+    """
+    size = os.path.getsize(path)
+    if not split_bytes or size <= split_bytes or input_compression(path) is not None:
+        return [(0, size)]
+
+    bounds = [0]
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for offset in range(split_bytes, size, split_bytes):
+            if offset <= bounds[-1]:
+                # The previous range already went past here, because of a long line
+                continue
+            # Next line starts after the first newline at or after the last byte of the previous range
+            newline = mm.find(b"\n", offset - 1)
+            if newline == -1 or newline + 1 >= size:
+                break
+            bounds.append(newline + 1)
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+class _RangeReader(io.RawIOBase):
+    """Raw stream of the byte range of a binary file, ending at `stop`."""
+
+    def __init__(self, f: BinaryIO, start: int = 0, stop: Optional[int] = None):
+        if start:
+            f.seek(start)
+        self._file: BinaryIO = f
+        self._remaining: Optional[int] = stop - start if stop is not None else None
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        view = memoryview(buffer)
+        if self._remaining is not None:
+            view = view[: self._remaining]
+        size = self._file.readinto(view) or 0
+        if self._remaining is not None:
+            self._remaining -= size
+        return size
+
+
+def read_file(
+    path: str,
+    file_type: str,
+    skip_header: bool = False,
+    max_error: int = -1,
+    errors: Optional[ErrorCounter] = None,
+    start: int = 0,
+    stop: Optional[int] = None,
+) -> Iterator[List[str]]:
+    """
+    Read the file by given file_type and path, yielding one parsed row at a time.
+    The file is read in chunks of `READ_CHUNK_SIZE`. CSV is parsed by :mod:`csv`, so quoted CSV fields
+    may contain delimiters and newlines as RFC 4180 describes. TSV fields are not quoted, and lines only end
+    at LF, with the CR of CRLF removed, so a bare CR stays in the field.
+    Compressed files are decompressed while reading, see :func:`open_input`.
 
     :param path: File path.
     :param file_type: File parsing file_type. e.g. csv, tsv
-    :param skip_header: Whether skip the header or not
+    :param skip_header: Whether skip the header or not. Only applies to the range starting at the beginning.
     :param max_error: Max error count to tolerate
+    :param errors: Counter to share the error budget with the caller. Overrides `max_error` if given.
+    :param start: Offset of the first line to read, which should be at the beginning of a line.
+        Only 0 is supported for compressed files.
+    :param stop: Offset to stop reading at, which should be at the beginning of a line. Reads to the end if None.
     """
     file_type = file_type.lower()
     if file_type not in ("csv", "tsv"):
         raise ValueError(f"File type should be 'csv' or 'tsv', not {file_type}")
-    with open(path, "r") as f:
-        raw = f.read().split("\n")
-        if skip_header:
-            raw = raw[1:]
-        if raw[-1] == "":
-            raw = raw[:-1]
-
-    delimiter = "," if file_type == "csv" else "\t"
-
-    result = []
-    error_count = 0
-    for line in raw:
-        try:
-            result.append(line.split(delimiter))
-        except Exception as e:
-            logging.error(f"Error has occurred while parsing file {path}:")
-            logging.error(e)
-            error_count += 1
-            if max_error != -1 and error_count >= max_error:
-                raise ValueError("Max error count reached, Stop to parse")
-    return result
 
+    errors = errors if errors is not None else ErrorCounter(max_error)
+    with open_input(path) as f:
+        buffered = io.BufferedReader(_RangeReader(f, start, stop), buffer_size=READ_CHUNK_SIZE)
+        if file_type == "tsv":
+            lines = io.TextIOWrapper(buffered, encoding="utf-8", newline="\n")
+            if skip_header and start == 0:
+                next(lines, None)
+            for line in lines:
+                line = line[:-1] if line.endswith("\n") else line
+                line = line[:-1] if line.endswith("\r") else line
+                # Blank lines have no fields
+                if line:
+                    yield line.split("\t")
+            return
 
-def save_tfrecord_file(examples: List[tf.train.Example], filename: str, compression_type: str = "GZIP"):
-    """Save given examples to TFRecord file."""
+        csv.field_size_limit(MAX_FIELD_CHARS)
+        reader = csv.reader(
+            io.TextIOWrapper(buffered, encoding="utf-8", newline=""),
+            delimiter=",",
+            quoting=csv.QUOTE_MINIMAL,
+            strict=True,
+        )
+        if skip_header and start == 0:
+            next(reader, None)
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                logging.error(f"Error has occurred while parsing file {path} at line {reader.line_num}:")
+                logging.error(e)
+                errors.add()
+                continue
+            # Blank lines have no fields
+            if row:
+                yield row
+
+
+def open_tfrecord_writer(
+    filename: str,
+    compression_type: str = "GZIP",
+    backend: str = "native",
+    compression_level: int = -1,
+    compression_threads: int = 1,
+    fileobj: Optional[BinaryIO] = None,
+):
+    """
+    Open TFRecord writer of given backend. Every backend has `write(record)` and `close()`.
+
+    :param filename: Path of the file to write
+    :param compression_type: "GZIP", "ZLIB" or "" (no compression)
+    :param backend: One of :data:`WRITER_BACKENDS`
+    :param compression_level: zlib compression level, -1 for the default
+    :param compression_threads: Number of threads to compress with. Only the native backend supports more than 1.
+    :param fileobj: Stream to write into instead of the file. Only the native backend supports it.
+    """
     if compression_type not in ("GZIP", "ZLIB", ""):
         raise ValueError(f"Invalid compression type `{compression_type}` is present.")
-    options = tf.io.TFRecordOptions(compression_type=compression_type)
-    with tf.io.TFRecordWriter(filename, options) as writer:
+    if backend == "native":
+        return tfrecord.TFRecordWriter(
+            filename,
+            compression_type=compression_type,
+            compression_level=compression_level,
+            compression_threads=compression_threads,
+            fileobj=fileobj,
+        )
+    if fileobj is not None:
+        raise ValueError("Only the native writer backend can write into a stream.")
+    if backend == "tensorflow":
+        import tensorflow as tf
+
+        options = tf.io.TFRecordOptions(
+            compression_type=compression_type, compression_level=None if compression_level == -1 else compression_level
+        )
+        return tf.io.TFRecordWriter(filename, options)
+    raise ValueError(f"Invalid writer backend `{backend}` is present.")
+
+
+def save_tfrecord_file(
+    examples: List["tf.train.Example"], filename: str, compression_type: str = "GZIP", backend: str = "native"
+):
+    """Save given examples to TFRecord file."""
+    writer = open_tfrecord_writer(filename, compression_type=compression_type, backend=backend)
+    try:
         for example in examples:
             writer.write(example.SerializeToString())
+    finally:
+        writer.close()
+
+
+def read_tfrecord_file(filename: str, compression_type: str = "GZIP") -> Iterator[bytes]:
+    """Lazily read serialized records from TFRecord file, without TensorFlow."""
+    return tfrecord.read_tfrecord(filename, compression_type=compression_type)
+
+
+def write_record_index(path: str, lengths: Sequence[int], fileobj: Optional[BinaryIO] = None):
+    """
+    Write the index of the uncompressed TFRecord file at `path`, given the length of each record in it.
+    The index is a flat array of little-endian uint64, the offset of each framed record followed by its length.
+    It is written into `fileobj` instead of the file next to `path`, if given, which is closed afterwards.
+    """
+    lengths = np.asarray(lengths, dtype="<u8").reshape(-1)
+    index = np.empty((len(lengths), 2), dtype="<u8")
+    index[:, 1] = lengths
+    ends = np.cumsum(lengths + np.uint64(tfrecord.FRAME_OVERHEAD), dtype="<u8")
+    index[:, 0] = ends - index[:, 1] - np.uint64(tfrecord.FRAME_OVERHEAD)
+    with fileobj if fileobj is not None else open(index_filename(path), "wb") as f:
+        f.write(index.tobytes())
+
+
+class IndexedTFRecordReader:
+    """
+    Random access to the records of an uncompressed TFRecord file, through the index written next to it.
+    Records are read with `os.pread`, so one reader can be shared by threads reading different parts of the file.
+
+    :param path: Path of the TFRecord file, which has the index at :func:`index_filename`
+    :param verify: Whether check CRC of each record or not
+    """
+
+    def __init__(self, path: str, verify: bool = True):
+        self.path: str = path
+        self.verify: bool = verify
+        with open(index_filename(path), "rb") as f:
+            self._index: np.ndarray = np.frombuffer(f.read(), dtype="<u8").reshape(-1, 2)
+        self._fd: Optional[int] = os.open(path, os.O_RDONLY)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __getitem__(self, idx: int) -> bytes:
+        offset, length = (int(value) for value in self._index[idx])
+        try:
+            return tfrecord.unframe_record(os.pread(self._fd, length + tfrecord.FRAME_OVERHEAD, offset), self.verify)
+        except ValueError as e:
+            raise ValueError(f"{e} at byte {offset} of {self.path}")
+
+    def read_range(self, start: int, stop: int, chunk_bytes: int = READ_CHUNK_SIZE) -> Iterator[bytes]:
+        """
+        Read the records from `start` to before `stop`, seeking straight to the first one.
+        Consecutive records are read at once up to `chunk_bytes`, or one by one if they are larger,
+        so the memory does not grow with the range.
+        """
+        start, stop, _ = slice(start, stop).indices(len(self))
+        if start >= stop:
+            return
+        index = self._index[start:stop]
+        ends = index[:, 0] + index[:, 1] + np.uint64(tfrecord.FRAME_OVERHEAD)
+        first = 0
+        while first < len(index):
+            base = int(index[first, 0])
+            last = max(first + 1, int(np.searchsorted(ends, np.uint64(base + chunk_bytes), side="right")))
+            data = os.pread(self._fd, int(ends[last - 1]) - base, base)
+            for offset, length in index[first:last].tolist():
+                frame = data[offset - base : offset - base + length + tfrecord.FRAME_OVERHEAD]
+                try:
+                    yield tfrecord.unframe_record(frame, self.verify)
+                except ValueError as e:
+                    raise ValueError(f"{e} at byte {offset} of {self.path}")
+            first = last
+
+    def partition(self, partition: int, num_partitions: int) -> Iterator[bytes]:
+        """Read the `partition`-th of `num_partitions` contiguous parts, which differ in size by at most one record."""
+        if not 0 <= partition < num_partitions:
+            raise ValueError(f"Partition {partition} is out of {num_partitions} partitions.")
+        total = len(self)
+        return self.read_range(total * partition // num_partitions, total * (partition + 1) // num_partitions)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self) -> "IndexedTFRecordReader":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ShardSpan(NamedTuple):
+    #: Path of the TFRecord file
+    path: str
+    #: Index of the first record in the file
+    start: int
+    #: Index after the last record in the file
+    stop: int
+
+
+def plan_fixed_shards(shards: List[ShardInfo], num_shards: int) -> List[List[ShardSpan]]:
+    """
+    Split records of the shards, in the given order, into `num_shards` contiguous parts
+    which differ in size by at most one record.
+
+    :return: Spans of the given shards which make up each part
+    """
+    total = sum(shard.num_records for shard in shards)
+    bounds = [total * idx // num_shards for idx in range(num_shards + 1)]
+    plans = []
+    for start, stop in zip(bounds, bounds[1:]):
+        spans, offset = [], 0
+        for shard in shards:
+            overlap_start, overlap_stop = max(start, offset), min(stop, offset + shard.num_records)
+            if overlap_start < overlap_stop:
+                spans.append(ShardSpan(shard.path, overlap_start - offset, overlap_stop - offset))
+            offset += shard.num_records
+        plans.append(spans)
+    return plans
+
+
+def merge_shard_spans(
+    spans: List[ShardSpan],
+    filename: str,
+    compression_type: str = "GZIP",
+    backend: str = "native",
+    compression_level: int = -1,
+    compression_threads: int = 1,
+    index: bool = False,
+) -> ShardInfo:
+    """
+    Write records of the spans, read from uncompressed TFRecord files, into one TFRecord file.
+    Each file should have the index next to it, so every span is read from its first record,
+    not from the beginning of the file. See :func:`write_record_index`.
+    If `index` is set, the index of the records is written next to the output, which should be uncompressed.
+    """
+    writer = open_tfrecord_writer(
+        filename,
+        compression_type=compression_type,
+        backend=backend,
+        compression_level=compression_level,
+        compression_threads=compression_threads,
+    )
+    lengths = []
+    try:
+        for span in spans:
+            with IndexedTFRecordReader(span.path) as reader:
+                for record in reader.read_range(span.start, span.stop):
+                    writer.write(record)
+                    lengths.append(len(record))
+    finally:
+        writer.close()
+    if index:
+        write_record_index(filename, lengths)
+    num_records = len(lengths)
+    return ShardInfo(filename, num_records, os.path.getsize(filename))
+
+
+class ShardWriter:
+    """
+    Write serialized records into a series of TFRecord files, rolling over to the next file
+    every `batch_size` records, or when the file reaches `target_bytes` after compression if it is set.
+    Everything goes into a single file if neither of them is set.
+    Files are opened lazily, so no empty shard is left behind.
+    `on_shard` is called with the manifest of every shard as soon as it is closed.
+    If `index` is set, the index of the records is written next to each shard, which should be uncompressed.
+
+    With `open_stream`, nothing is written on disk. Each shard, and its index, is written into the stream it opens
+    by the file name, such as a chunked resumable upload into the bucket, which is finished once the shard is closed.
+    If the writer exits with an error, the stream of the shard being written is terminated instead,
+    so no partial shard is left behind.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        name: str,
+        task_id: int,
+        batch_size: int,
+        compression_type: str = "GZIP",
+        on_shard: Optional[Callable[[ShardInfo], None]] = None,
+        backend: str = "native",
+        target_bytes: int = 0,
+        part: Optional[int] = None,
+        compression_level: int = -1,
+        compression_threads: int = 1,
+        index: bool = False,
+        open_stream: Optional[Callable[[str], BinaryIO]] = None,
+    ):
+        if compression_type not in ("GZIP", "ZLIB", ""):
+            raise ValueError(f"Invalid compression type `{compression_type}` is present.")
+        if index and compression_type:
+            raise ValueError("Only uncompressed shards can be indexed.")
+        if backend not in WRITER_BACKENDS:
+            raise ValueError(f"Invalid writer backend `{backend}` is present.")
+        if target_bytes and backend != "native":
+            raise ValueError("Only the native writer backend can write shards of target size.")
+        if open_stream is not None and backend != "native":
+            raise ValueError("Only the native writer backend can write shards into streams.")
+        self.directory: str = directory
+        self.name: str = name
+        self.task_id: int = task_id
+        self.batch_size: int = batch_size
+        self.compression_type: str = compression_type
+        self.compression_level: int = compression_level
+        self.compression_threads: int = compression_threads
+        self.on_shard: Optional[Callable[[ShardInfo], None]] = on_shard
+        self.backend: str = backend
+        self.target_bytes: int = target_bytes
+        self.part: Optional[int] = part
+        self.index: bool = index
+        self.open_stream: Optional[Callable[[str], BinaryIO]] = open_stream
+        #: Manifests of the shards closed so far
+        self.shards: List[ShardInfo] = []
+
+        self._writer = None
+        self._stream: Optional[BinaryIO] = None
+        self._path: str = ""
+        self._num_records: int = 0
+        self._lengths: List[int] = []
+
+    def write(self, record: bytes):
+        if self._writer is None:
+            self._open()
+        self._writer.write(record)
+        self._num_records += 1
+        if self.index:
+            self._lengths.append(len(record))
+        if self.target_bytes:
+            if self._writer.num_bytes >= self.target_bytes:
+                self._close()
+        elif self.batch_size and self._num_records >= self.batch_size:
+            self._close()
+
+    def close(self):
+        if self._writer is not None:
+            self._close()
+
+    def _open(self):
+        self._path = shard_filename(self.directory, self.name, self.task_id, len(self.shards), part=self.part)
+        if self.open_stream is not None:
+            self._stream = self.open_stream(os.path.basename(self._path))
+        self._writer = open_tfrecord_writer(
+            self._path,
+            compression_type=self.compression_type,
+            backend=self.backend,
+            compression_level=self.compression_level,
+            compression_threads=self.compression_threads,
+            fileobj=self._stream,
+        )
+        self._num_records = 0
+        self._lengths = []
+
+    def _close(self):
+        writer, self._writer = self._writer, None
+        # Closes the stream too, which finishes its upload
+        writer.close()
+        if self._stream is not None:
+            self._stream = None
+            num_bytes = writer.num_bytes
+        else:
+            num_bytes = os.path.getsize(self._path)
+        if self.index:
+            stream = self.open_stream(os.path.basename(index_filename(self._path))) if self.open_stream else None
+            write_record_index(self._path, self._lengths, stream)
+        shard = ShardInfo(self._path, self._num_records, num_bytes)
+        self.shards.append(shard)
+        if self.on_shard is not None:
+            self.on_shard(shard)
+
+    def __enter__(self) -> "ShardWriter":
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is not None and self._stream is not None:
+            self._stream.terminate()
+            self._writer = self._stream = None
+            return
+        self.close()
+
+
+class BucketWriter:
+    """
+    Scatter serialized records into `num_buckets` uncompressed TFRecord files by random key,
+    as the first pass of an external shuffle. Keys are drawn from a generator seeded with `seed`, the task
+    and the byte range, so the same input always lands in the same buckets, whichever worker converts it.
+    Records are buffered up to `buffer_bytes`, then appended into the files of the buckets,
+    so only one file is open at a time however many buckets there are.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        task_id: int,
+        num_buckets: int,
+        seed: int,
+        part: Optional[int] = None,
+        buffer_bytes: int = BUCKET_BUFFER_BYTES,
+    ):
+        if num_buckets < 1:
+            raise ValueError("Number of buckets should be a positive integer.")
+        self.directory: str = directory
+        self.task_id: int = task_id
+        self.num_buckets: int = num_buckets
+        self.part: Optional[int] = part
+        self.buffer_bytes: int = buffer_bytes
+        #: Manifests of the bucket files, filled once closed
+        self.shards: List[ShardInfo] = []
+
+        self._random = random.Random(f"{seed}:{task_id}:{part or 0}")
+        self._buffers: List[List[bytes]] = [[] for _ in range(num_buckets)]
+        self._buffered_bytes: int = 0
+        self._num_records: List[int] = [0] * num_buckets
+
+    def write(self, record: bytes):
+        bucket = self._random.randrange(self.num_buckets)
+        frame = tfrecord.frame_record(record)
+        self._buffers[bucket].append(frame)
+        self._buffered_bytes += len(frame)
+        self._num_records[bucket] += 1
+        if self._buffered_bytes >= self.buffer_bytes:
+            self._flush()
+
+    def close(self):
+        self._flush()
+        self.shards = []
+        for bucket, num_records in enumerate(self._num_records):
+            if num_records:
+                path = bucket_filename(self.directory, bucket, self.task_id, self.part)
+                self.shards.append(ShardInfo(path, num_records, os.path.getsize(path)))
+
+    def _flush(self):
+        for bucket, frames in enumerate(self._buffers):
+            if frames:
+                with open(bucket_filename(self.directory, bucket, self.task_id, self.part), "ab") as f:
+                    f.write(b"".join(frames))
+                frames.clear()
+        self._buffered_bytes = 0
+
+    def __enter__(self) -> "BucketWriter":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,170 @@
+"""
+Filesystem-backed stand-in of the Google Cloud Storage client, covering what :mod:`tfrecorder.upload` uses.
+Every bucket is a directory under the root directory, and every blob is a file in it.
+Used by `--local-bucket-dir` and by the tests, so uploads can be tried without network.
+"""
+import os
+import shutil
+import threading
+from typing import BinaryIO, Iterator, Optional
+
+from google.api_core import exceptions as api_exceptions
+
+from .fileio import file_crc32c, file_md5
+
+_DEFAULT_CHUNK_SIZE = 1 << 20
+
+
+class LocalBlobWriter:
+    """
+    Stream into a blob as `google.cloud.storage.fileio.BlobWriter` does. Writes are buffered in memory,
+    and every full chunk is sent as a request of the resumable upload, i.e. appended into a temporary file.
+    The blob is only visible once closed, and `terminate` cancels the upload.
+    """
+
+    def __init__(self, blob: "LocalBlob", chunk_size: int):
+        self.blob: "LocalBlob" = blob
+        self.chunk_size: int = chunk_size
+        #: Number of chunks sent so far
+        self.num_chunks: int = 0
+        #: Largest number of bytes buffered in memory at once
+        self.max_buffered: int = 0
+
+        self._temp_path = f"{blob.path}.{os.getpid()}.{threading.get_ident()}.uploading"
+        self._file: Optional[BinaryIO] = open(self._temp_path, "wb")
+        self._buffer = bytearray()
+
+    @property
+    def closed(self) -> bool:
+        return self._file is None
+
+    def write(self, data: bytes) -> int:
+        if self._file is None:
+            raise ValueError("I/O operation on closed blob writer.")
+        self._buffer += data
+        self.max_buffered = max(self.max_buffered, len(self._buffer))
+        while len(self._buffer) >= self.chunk_size:
+            self._send(self.chunk_size)
+        return len(data)
+
+    def close(self):
+        if self._file is None:
+            return
+        # The last chunk finishes the upload, whatever its size
+        self._send(len(self._buffer))
+        self._file.close()
+        self._file = None
+        os.replace(self._temp_path, self.blob.path)
+
+    def terminate(self):
+        """Cancel the upload, so nothing is left in the bucket."""
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        self._buffer = bytearray()
+        os.remove(self._temp_path)
+
+    def _send(self, size: int):
+        self._file.write(self._buffer[:size])
+        del self._buffer[:size]
+        self.num_chunks += 1
+
+    def __enter__(self) -> "LocalBlobWriter":
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is not None:
+            self.terminate()
+        else:
+            self.close()
+
+
+class LocalBlob:
+    def __init__(self, bucket: "LocalBucket", name: str, chunk_size: Optional[int] = None):
+        self.bucket: "LocalBucket" = bucket
+        self.name: str = name
+        self.chunk_size: Optional[int] = chunk_size
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.bucket.path, self.name)
+
+    @property
+    def size(self) -> Optional[int]:
+        return os.path.getsize(self.path) if self.exists() else None
+
+    @property
+    def crc32c(self) -> Optional[str]:
+        """Base64 encoded big-endian CRC32C of the content, as GCS reports it."""
+        return file_crc32c(self.path) if self.exists() else None
+
+    @property
+    def md5_hash(self) -> Optional[str]:
+        """Base64 encoded MD5 of the content, as GCS reports it."""
+        return file_md5(self.path) if self.exists() else None
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.path)
+
+    def upload_from_filename(self, filename: str):
+        """Copy the file chunk by chunk, and make it visible only when every chunk is written."""
+        chunk_size = self.chunk_size or _DEFAULT_CHUNK_SIZE
+        temp_path = f"{self.path}.{threading.get_ident()}.uploading"
+        with open(filename, "rb") as src, open(temp_path, "wb") as dst:
+            for chunk in iter(lambda: src.read(chunk_size), b""):
+                dst.write(chunk)
+        os.replace(temp_path, self.path)
+
+    def open(self, mode: str = "rb", chunk_size: Optional[int] = None) -> LocalBlobWriter:
+        """Open the blob to stream into. Only writing in binary is supported."""
+        if mode != "wb":
+            raise NotImplementedError(f"Mode `{mode}` is not supported by the local stand-in.")
+        return LocalBlobWriter(self, chunk_size or self.chunk_size or _DEFAULT_CHUNK_SIZE)
+
+    def download_as_bytes(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def delete(self):
+        if not os.path.isfile(self.path):
+            raise api_exceptions.NotFound(f"{self.name} is not found in {self.bucket.name}")
+        os.remove(self.path)
+
+
+class LocalBucket:
+    def __init__(self, client: "LocalClient", name: str):
+        self.client: "LocalClient" = client
+        self.name: str = name
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.client.root, self.name)
+
+    def blob(self, blob_name: str, chunk_size: Optional[int] = None) -> LocalBlob:
+        return LocalBlob(self, blob_name, chunk_size=chunk_size)
+
+    def list_blobs(self) -> Iterator[LocalBlob]:
+        for name in sorted(os.listdir(self.path)):
+            if not name.endswith(".uploading"):
+                yield LocalBlob(self, name)
+
+    def delete(self):
+        shutil.rmtree(self.path)
+
+
+class LocalClient:
+    def __init__(self, root: str):
+        self.root: str = root
+
+    def lookup_bucket(self, bucket_name: str) -> Optional[LocalBucket]:
+        bucket = LocalBucket(self, bucket_name)
+        return bucket if os.path.isdir(bucket.path) else None
+
+    def create_bucket(self, bucket_name: str, location: Optional[str] = None) -> LocalBucket:
+        bucket = LocalBucket(self, bucket_name)
+        os.makedirs(bucket.path)
+        return bucket
+
+    def list_blobs(self, bucket: LocalBucket) -> Iterator[LocalBlob]:
+        return bucket.list_blobs()
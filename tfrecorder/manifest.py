@@ -0,0 +1,261 @@
+"""
+Manifest of converted input files, which lets the next run convert only new or changed files.
+
+When the input is partitioned across nodes, each node keeps the manifest of its own partition,
+and `merge-manifests` combines them into the manifest of the whole dataset once every node is done.
+"""
+import json
+import logging
+import os
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from .config import Config
+from .datatype import Column, FeatureType
+from .fileio import ShardInfo, get_filenames, shard_pattern, split_file_digest
+from .stats import DatasetStats
+from .vocab import vocabulary_columns, vocabulary_digest
+
+MANIFEST_VERSION = 1
+
+
+class InputFile(NamedTuple):
+    #: ID used for the names of the shards converted from this file
+    file_id: int
+    #: Size of the file in bytes, when it was converted
+    size: int
+    #: Modification time of the file in nanoseconds, when it was converted
+    mtime_ns: int
+    #: SHA-256 of the content, None until the conversion is done
+    sha256: Optional[str]
+    #: Shards converted from this file
+    shards: List[ShardInfo]
+    #: State of :class:`<tfrecorder.stats.DatasetStats>` of the file, if it is converted with `stats`
+    stats: Optional[Dict[str, Any]] = None
+
+    @property
+    def complete(self) -> bool:
+        return self.sha256 is not None
+
+
+def manifest_path(config: Config) -> str:
+    return os.path.join(config.tfrecord_path, f"{config.shard_name}.manifest.json")
+
+
+def dataset_manifest_path(config: Config) -> str:
+    return os.path.join(config.tfrecord_path, f"{config.name}.dataset.json")
+
+
+def column_settings(column: Column) -> List[Any]:
+    """Name and type of the column, with the options of the tokenizer if it is TOKENIZED."""
+    if column.feature_type != FeatureType.TOKENIZED:
+        return [column.name, column.feature_type.value]
+    options = ("tokenizer", "pattern", "lowercase", "max_tokens", "length_feature")
+    return [column.name, column.feature_type.value, {option: getattr(column, option) for option in options}]
+
+
+def output_settings(config: Config) -> Dict[str, Any]:
+    """Settings which change the converted output. Everything is converted again if one of them changes."""
+    settings = {
+        "name": config.shard_name,
+        "file_type": config.file_type,
+        "skip_header": config.skip_header,
+        "columns": [column_settings(column) for column in config.columns],
+        "compression_type": config.compression_type,
+        "compression_level": config.compression_level,
+        "record_index": config.record_index,
+        "batch_size": config.batch_size,
+        "target_shard_bytes": config.target_shard_bytes,
+        "split_bytes": config.split_bytes,
+    }
+    # IDs of the values change with the vocabulary, so a new vocabulary converts every file again.
+    # Values appended to a built vocabulary keep its digest, unless shards have the ID out of the vocabulary.
+    digests = {column.name: vocabulary_digest(config, column) for column in vocabulary_columns(config)}
+    vocabularies = {name: digest for name, digest in digests.items() if digest is not None}
+    if vocabularies:
+        settings["vocabularies"] = vocabularies
+    return settings
+
+
+class Manifest:
+    """
+    Input files converted into `tfrecord_path` so far, with the shards each of them produced.
+    Stored as JSON next to the shards.
+    """
+
+    def __init__(self, path: str, settings: Dict[str, Any], inputs: Optional[Dict[str, InputFile]] = None):
+        self.path: str = path
+        self.settings: Dict[str, Any] = settings
+        self.inputs: Dict[str, InputFile] = inputs if inputs is not None else {}
+
+    @classmethod
+    def load(cls, config: Config, full: bool = False) -> "Manifest":
+        """
+        Load the manifest of the dataset, or make an empty one if it does not exist.
+        If `full` is set or the output settings have changed, every file is marked to be converted again.
+        """
+        path = manifest_path(config)
+        settings = output_settings(config)
+        if not os.path.exists(path):
+            return cls(path, settings)
+
+        with open(path, "r") as f:
+            obj = json.load(f)
+        directory = os.path.dirname(path)
+        inputs = {
+            input_path: InputFile(
+                entry["file_id"],
+                entry["size"],
+                entry["mtime_ns"],
+                entry["sha256"],
+                [ShardInfo(os.path.join(directory, shard[0]), shard[1], shard[2]) for shard in entry["shards"]],
+                entry.get("stats"),
+            )
+            for input_path, entry in obj["inputs"].items()
+        }
+        if config.stats and any(entry.complete and entry.stats is None for entry in inputs.values()):
+            logging.info("Statistics are collected from now on, convert files without statistics again")
+            inputs = {
+                input_path: entry._replace(sha256=None) if entry.stats is None else entry
+                for input_path, entry in inputs.items()
+            }
+        if full or obj["version"] != MANIFEST_VERSION or obj["settings"] != settings:
+            if not full:
+                logging.info("Output settings have changed since the last run, convert every file again")
+            inputs = {input_path: entry._replace(sha256=None) for input_path, entry in inputs.items()}
+        return cls(path, settings, inputs)
+
+    def save(self):
+        """Write the manifest atomically, so an interrupted run never leaves a broken one."""
+        obj = {
+            "version": MANIFEST_VERSION,
+            "settings": self.settings,
+            "inputs": {
+                input_path: {
+                    "file_id": entry.file_id,
+                    "size": entry.size,
+                    "mtime_ns": entry.mtime_ns,
+                    "sha256": entry.sha256,
+                    "shards": [
+                        [os.path.basename(shard.path), shard.num_records, shard.num_bytes] for shard in entry.shards
+                    ],
+                    **({"stats": entry.stats} if entry.stats is not None else {}),
+                }
+                for input_path, entry in self.inputs.items()
+            },
+        }
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(obj, f)
+        os.replace(temp_path, self.path)
+
+    def plan(self, filenames: List[str]) -> Tuple[List[Tuple[int, str]], List[str]]:
+        """
+        Decide which files should be converted, and mark them as pending.
+
+        :param filenames: Every input file of this run
+        :return: Tasks of `(file_id, path)` to convert, and paths of the stale shards to remove
+        """
+        directory = os.path.dirname(self.path)
+        name = self.settings["name"]
+        tasks, stale = [], []
+
+        current = set(filenames)
+        for input_path in [input_path for input_path in self.inputs if input_path not in current]:
+            stale.extend(self._shard_paths(self.inputs.pop(input_path), directory, name))
+
+        next_id = max((entry.file_id for entry in self.inputs.values()), default=-1) + 1
+        for input_path in filenames:
+            stat = os.stat(input_path)
+            entry = self.inputs.get(input_path)
+            if entry is not None and entry.complete:
+                if (entry.size, entry.mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+                    continue
+                if entry.size == stat.st_size and entry.sha256 == split_file_digest(
+                    input_path, self.settings["split_bytes"]
+                ):
+                    # Only touched, the content is the same
+                    self.inputs[input_path] = entry._replace(mtime_ns=stat.st_mtime_ns)
+                    continue
+
+            if entry is not None:
+                file_id = entry.file_id
+                stale.extend(self._shard_paths(entry, directory, name))
+            else:
+                file_id, next_id = next_id, next_id + 1
+            self.inputs[input_path] = InputFile(file_id, stat.st_size, stat.st_mtime_ns, None, [])
+            tasks.append((file_id, input_path))
+        return tasks, stale
+
+    def complete(self, input_path: str, shards: List[ShardInfo], sha256: str, stats: Optional[Dict[str, Any]] = None):
+        """Record that the file is converted into the shards, with the state of its statistics if collected."""
+        self.inputs[input_path] = self.inputs[input_path]._replace(sha256=sha256, shards=shards, stats=stats)
+
+    def stats(self, columns: List[Column]) -> Optional[DatasetStats]:
+        """Statistics of every input file merged, or None if a file has been converted without statistics."""
+        if any(entry.stats is None for entry in self.inputs.values()):
+            return None
+        stats = DatasetStats(columns)
+        for entry in self.inputs.values():
+            stats.merge(DatasetStats.from_state(columns, entry.stats))
+        return stats
+
+    @staticmethod
+    def _shard_paths(entry: InputFile, directory: str, name: str) -> List[str]:
+        if entry.complete:
+            return [shard.path for shard in entry.shards]
+        # Shards of an interrupted conversion were never recorded
+        return get_filenames(shard_pattern(directory, name, entry.file_id))
+
+
+def merge_manifests(config: Config) -> Dict[str, Any]:
+    """
+    Combine the manifests of every partition into the manifest of the whole dataset, and write it atomically.
+    Shards and input files are sorted by path, so the same outputs always give the same manifest.
+
+    :return: Manifest of the dataset
+    :raises ValueError: If a partition is missing, not complete, or converted with other settings
+    """
+    inputs, shards, stats = {}, [], DatasetStats(config.columns)
+    for index in range(config.num_partitions):
+        partition_config = config._replace(partition_index=index)
+        if not os.path.exists(manifest_path(partition_config)):
+            raise ValueError(f"Manifest of partition {index} is not found in {manifest_path(partition_config)}")
+        # Entries converted with other settings are loaded as not complete
+        manifest = Manifest.load(partition_config)
+        for input_path, entry in manifest.inputs.items():
+            if not entry.complete:
+                raise ValueError(f"{input_path} of partition {index} is not converted with the current settings")
+            if input_path in inputs:
+                raise ValueError(
+                    f"{input_path} is converted by partitions {inputs[input_path]['partition']} and {index}"
+                )
+            inputs[input_path] = {
+                "partition": index,
+                "sha256": entry.sha256,
+                "shards": sorted(os.path.basename(shard.path) for shard in entry.shards),
+            }
+            shards.extend(entry.shards)
+        partition_stats = manifest.stats(config.columns)
+        stats = stats.merge(partition_stats) if stats is not None and partition_stats is not None else None
+
+    settings = output_settings(config)
+    del settings["name"]
+    obj = {
+        "version": MANIFEST_VERSION,
+        "name": config.name,
+        "num_partitions": config.num_partitions,
+        "settings": settings,
+        "num_records": sum(shard.num_records for shard in shards),
+        "num_bytes": sum(shard.num_bytes for shard in shards),
+        "shards": sorted([os.path.basename(shard.path), shard.num_records, shard.num_bytes] for shard in shards),
+        "inputs": {input_path: inputs[input_path] for input_path in sorted(inputs)},
+    }
+    # Only if every partition is converted with statistics
+    if stats is not None:
+        obj["stats"] = stats.summary()
+    path = dataset_manifest_path(config)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(obj, f, indent=2)
+    os.replace(temp_path, path)
+    return obj
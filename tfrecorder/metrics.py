@@ -0,0 +1,149 @@
+"""Counters and stage timers of a run, aggregated across the pool workers, and profiling of the workers."""
+import collections
+import contextlib
+import cProfile
+import glob
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from typing import Dict, Iterable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+#: Prefix of the metric names in the Prometheus text format
+PROMETHEUS_PREFIX = "tfrecorder"
+
+
+class Metrics:
+    """
+    Counters, seconds spent in each stage, and max observed values, e.g. queue depths.
+    Safe to update from multiple threads. Each pool task fills its own instance, and sends its :meth:`summary`
+    back to the parent process, which merges it with :meth:`merge`.
+    """
+
+    def __init__(self):
+        self.counters: Dict[str, float] = collections.Counter()
+        self.timers: Dict[str, float] = collections.Counter()
+        self.maxima: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def count(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] += value
+
+    def time(self, stage: str, seconds: float):
+        with self._lock:
+            self.timers[stage] += seconds
+
+    def observe(self, name: str, value: float):
+        """Keep the max of the observed values."""
+        with self._lock:
+            self.maxima[name] = max(self.maxima.get(name, value), value)
+
+    @contextlib.contextmanager
+    def timer(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.time(stage, time.perf_counter() - started)
+
+    def timed(self, iterable: Iterable[T], stage: str, counter: Optional[str] = None) -> Iterator[T]:
+        """Iterate over the iterable, adding the time spent to produce the items to the stage, and counting them."""
+        iterator = iter(iterable)
+        elapsed, count = 0.0, 0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - started
+                count += 1
+                yield item
+        finally:
+            self.time(stage, elapsed)
+            if counter is not None:
+                self.count(counter, count)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {"counters": dict(self.counters), "timers": dict(self.timers), "maxima": dict(self.maxima)}
+
+    def merge(self, summary: Dict[str, Dict[str, float]]):
+        """Add the summary of other metrics, e.g. from a pool worker."""
+        for name, value in summary["counters"].items():
+            self.count(name, value)
+        for stage, seconds in summary["timers"].items():
+            self.time(stage, seconds)
+        for name, value in summary["maxima"].items():
+            self.observe(name, value)
+
+    def write_json(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2, sort_keys=True)
+
+    def write_prometheus(self, path: str):
+        """Write the metrics in the Prometheus text format, e.g. for the textfile collector of node_exporter."""
+        summary = self.summary()
+        lines = []
+        for name, value in sorted(summary["counters"].items()):
+            lines += [f"# TYPE {PROMETHEUS_PREFIX}_{name}_total counter", f"{PROMETHEUS_PREFIX}_{name}_total {value}"]
+        if summary["timers"]:
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_stage_seconds_total counter")
+            for stage, seconds in sorted(summary["timers"].items()):
+                lines.append(f'{PROMETHEUS_PREFIX}_stage_seconds_total{{stage="{stage}"}} {seconds}')
+        for name, value in sorted(summary["maxima"].items()):
+            lines += [f"# TYPE {PROMETHEUS_PREFIX}_{name} gauge", f"{PROMETHEUS_PREFIX}_{name} {value}"]
+        # Write atomically, so the collector never reads a partial file
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temp_path, path)
+
+
+def profile_parts_path(profile_path: str) -> str:
+    """Directory which each process dumps its profile into, before they are merged into `profile_path`."""
+    return profile_path + ".parts"
+
+
+@contextlib.contextmanager
+def profiled(profile_path: Optional[str], name: str):
+    """Profile the block with cProfile if `profile_path` is given, and dump the stats to merge later."""
+    if profile_path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(profile_parts_path(profile_path), exist_ok=True)
+        profiler.dump_stats(os.path.join(profile_parts_path(profile_path), f"{name}.{os.getpid()}.prof"))
+
+
+def merge_profiles(profile_path: str, top: int = 30) -> Optional[str]:
+    """
+    Merge the stats dumped by :func:`profiled` into `profile_path`, readable by :mod:`pstats` or snakeviz.
+
+    :return: Report of the `top` functions by cumulative time, or None if nothing was profiled
+    """
+    parts = sorted(glob.glob(os.path.join(profile_parts_path(profile_path), "*.prof")))
+    if not parts:
+        return None
+    stats = pstats.Stats(*parts)
+    stats.dump_stats(profile_path)
+    for part in parts:
+        os.remove(part)
+    os.rmdir(profile_parts_path(profile_path))
+
+    report = io.StringIO()
+    stats.stream = report
+    stats.sort_stats("cumulative").print_stats(top)
+    return report.getvalue()
@@ -0,0 +1,44 @@
+"""Size-aware scheduling of the conversion tasks over the pool workers."""
+import os
+from typing import Callable, List, TypeVar
+
+from .convert import ConvertTask
+
+T = TypeVar("T")
+
+
+def task_size(task: ConvertTask) -> int:
+    """Bytes of the input the task reads. Compressed files count by their size on disk."""
+    stop = task.stop if task.stop is not None else os.path.getsize(task.path)
+    return stop - task.start
+
+
+def plan_task_groups(tasks: List[ConvertTask], task_bytes: int, chunk_size: int = 1) -> List[List[ConvertTask]]:
+    """
+    Group the tasks into units of work, which idle pool workers pull one at a time.
+
+    With `task_bytes`, the tasks are ordered largest first, and small tasks are packed together
+    until a group reaches `task_bytes`, so the largest tasks start first and the tail is made of small groups.
+    Otherwise, every `chunk_size` tasks make a group in the given order.
+
+    :return: Groups of the tasks, in the order to run
+    """
+    if not task_bytes:
+        return [tasks[start : start + chunk_size] for start in range(0, len(tasks), max(chunk_size, 1))]
+
+    sizes = {task: task_size(task) for task in tasks}
+    groups, group, group_bytes = [], [], 0
+    for task in sorted(tasks, key=lambda task: -sizes[task]):
+        if group and group_bytes + sizes[task] > task_bytes:
+            groups.append(group)
+            group, group_bytes = [], 0
+        group.append(task)
+        group_bytes += sizes[task]
+    if group:
+        groups.append(group)
+    return groups
+
+
+def run_group(group: List[ConvertTask], func: Callable[[ConvertTask], T]) -> List[T]:
+    """Run every task of the group in the pool worker."""
+    return [func(task) for task in group]
@@ -0,0 +1,271 @@
+"""
+Statistics of every column, collected in one pass while converting, instead of reading the output again.
+
+Every statistic can be merged, so each task collects its own, and they are merged across the pool workers,
+and across runs through the manifest, which keeps the statistics of each input file.
+Values are counted in blocks with NumPy, so collecting them costs little next to encoding the same values.
+"""
+import base64
+import json
+import math
+import os
+import zlib
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .config import Config
+from .datatype import Column, FeatureType
+
+#: Number of bits of the hash which pick the register of HyperLogLog, 4096 registers with 1.6% standard error
+HLL_PRECISION = 12
+#: Number of buckets of the length histograms. Bucket `b` counts the lengths of `b` bits, i.e. from 2^(b-1) to 2^b-1
+LENGTH_BUCKETS = 32
+
+#: Types of the columns summarized by the min, max and mean of the values
+NUMERIC_TYPES = (FeatureType.FLOAT, FeatureType.INT)
+#: Types of the columns summarized by the length histogram and the approximate number of distinct values
+TEXT_TYPES = (FeatureType.STRING, FeatureType.BYTES, FeatureType.CATEGORICAL, FeatureType.TOKENIZED)
+#: Types of the columns whose typed buffers of the converter have the parsed values
+PARSED_TYPES = NUMERIC_TYPES + (FeatureType.BOOL,)
+
+_UINT32_MASK = np.uint64(0xFFFFFFFF)
+
+
+def stats_path(config: Config) -> str:
+    return os.path.join(config.tfrecord_path, f"{config.shard_name}.stats.json")
+
+
+def bit_length(values: np.ndarray) -> np.ndarray:
+    """`int.bit_length` of every non-negative integer below 2^53 at once."""
+    return np.frexp(values.astype(np.float64))[1]
+
+
+def hash_values(values: Sequence[bytes]) -> np.ndarray:
+    """
+    32-bit hashes of the values, the same in every process, unlike `hash()`.
+    CRC32 alone is not random enough for HyperLogLog, so it is mixed by the finalizer of MurmurHash3.
+    """
+    hashes = np.fromiter(map(zlib.crc32, values), dtype=np.uint64, count=len(values))
+    hashes ^= hashes >> np.uint64(16)
+    hashes = (hashes * np.uint64(0x85EBCA6B)) & _UINT32_MASK
+    hashes ^= hashes >> np.uint64(13)
+    hashes = (hashes * np.uint64(0xC2B2AE35)) & _UINT32_MASK
+    hashes ^= hashes >> np.uint64(16)
+    return hashes
+
+
+def _bucket_label(bucket: int) -> str:
+    """Range of the lengths the bucket of the histogram counts, e.g. `4-7`."""
+    if bucket < 2:
+        return str(bucket)
+    return f"{2 ** (bucket - 1)}-{2**bucket - 1}"
+
+
+class HyperLogLog:
+    """Sketch of the number of distinct values, which takes 4 KiB whatever the number of values."""
+
+    def __init__(self, registers: Optional[np.ndarray] = None):
+        self.registers: np.ndarray = (
+            registers if registers is not None else np.zeros(1 << HLL_PRECISION, dtype=np.uint8)
+        )
+
+    def add(self, hashes: np.ndarray):
+        """Add 32-bit hashes of the values, from :func:`hash_values`."""
+        rest_bits = 32 - HLL_PRECISION
+        registers = (hashes >> np.uint64(rest_bits)).astype(np.intp)
+        # Position of the first set bit after the bits of the register, counted from 1
+        ranks = rest_bits - bit_length(hashes & np.uint64((1 << rest_bits) - 1)) + 1
+        np.maximum.at(self.registers, registers, ranks.astype(np.uint8))
+
+    def merge(self, other: "HyperLogLog"):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self) -> float:
+        num_registers = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / num_registers)
+        estimate = alpha * num_registers**2 / float(np.sum(np.ldexp(1.0, -self.registers.astype(np.int32))))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * num_registers and zeros:
+            # Linear counting is more accurate for small numbers
+            return num_registers * math.log(num_registers / zeros)
+        if estimate > 2**32 / 30:
+            # Corrects collisions of the 32-bit hashes
+            return -(2**32) * math.log(1 - estimate / 2**32)
+        return estimate
+
+    def to_state(self) -> str:
+        # Registers of a small file are mostly zero, so they compress well in the manifest
+        return base64.b64encode(zlib.compress(self.registers.tobytes())).decode()
+
+    @classmethod
+    def from_state(cls, state: str) -> "HyperLogLog":
+        return cls(np.frombuffer(zlib.decompress(base64.b64decode(state)), dtype=np.uint8).copy())
+
+
+class ColumnStats:
+    """
+    Statistics of the values of one column: the number of values and of empty ones, min, max and mean
+    of FLOAT and INT columns, number of true values of BOOL columns, and the histogram of the lengths
+    and the approximate number of distinct values of the others.
+    """
+
+    def __init__(self, feature_type: FeatureType):
+        self.feature_type: FeatureType = feature_type
+        #: Number of values
+        self.count: int = 0
+        #: Number of empty values
+        self.empty: int = 0
+        #: Number of finite values of FLOAT and INT columns, which min, max and total are of
+        self.finite: int = 0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        self.total: float = 0.0
+        #: Number of true values of BOOL columns
+        self.true: int = 0
+        #: Histogram of the lengths in characters, see :data:`LENGTH_BUCKETS`
+        self.lengths: np.ndarray = np.zeros(LENGTH_BUCKETS, dtype=np.int64)
+        #: Distinct values of text columns
+        self.distinct: HyperLogLog = HyperLogLog()
+
+    def add(self, values: Sequence[str], parsed: Optional[np.ndarray] = None):
+        """
+        Add values of the column, which are converted without error.
+
+        :param values: Values of the column
+        :param parsed: Values of FLOAT, INT and BOOL columns featurized by the converter, to not parse them again
+        """
+        if not values:
+            return
+        self.count += len(values)
+        self.empty += values.count("")
+        if self.feature_type in NUMERIC_TYPES:
+            if parsed is None:
+                parsed = np.array(values, dtype=str).astype(np.float64)
+                if self.feature_type == FeatureType.FLOAT:
+                    # Stored as float32, which the converter featurizes them into, saturating to infinity
+                    with np.errstate(over="ignore"):
+                        parsed = parsed.astype(np.float32)
+            array = parsed.astype(np.float64)
+            array = array[np.isfinite(array)]
+            if len(array):
+                self._add_range(len(array), float(array.min()), float(array.max()), float(array.sum()))
+        elif self.feature_type == FeatureType.BOOL:
+            if parsed is not None:
+                self.true += int(np.count_nonzero(parsed))
+            else:
+                # Only supports `0`, `1`, `True`, `true`, `False`, `false`, as the converter
+                self.true += sum(1 for value in values if value.strip().lower() in ("1", "true"))
+        elif self.feature_type in TEXT_TYPES:
+            lengths = np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+            self.lengths += np.bincount(bit_length(lengths), minlength=LENGTH_BUCKETS)[:LENGTH_BUCKETS]
+            self.distinct.add(hash_values([value.encode() for value in values]))
+
+    def merge(self, other: "ColumnStats"):
+        self.count += other.count
+        self.empty += other.empty
+        if other.finite:
+            self._add_range(other.finite, other.min, other.max, other.total)
+        self.true += other.true
+        self.lengths += other.lengths
+        self.distinct.merge(other.distinct)
+
+    def _add_range(self, finite: int, min_value: float, max_value: float, total: float):
+        self.finite += finite
+        self.min = min_value if self.min is None else min(self.min, min_value)
+        self.max = max_value if self.max is None else max(self.max, max_value)
+        self.total += total
+
+    def summary(self) -> Dict[str, Any]:
+        """Statistics of the column to report, by the type of the column."""
+        summary = {"type": self.feature_type.value, "count": self.count, "empty": self.empty}
+        if self.feature_type in NUMERIC_TYPES:
+            summary.update(
+                min=self.min, max=self.max, mean=self.total / self.finite if self.finite else None, finite=self.finite
+            )
+        elif self.feature_type == FeatureType.BOOL:
+            summary["true_ratio"] = self.true / self.count if self.count else None
+        elif self.feature_type in TEXT_TYPES:
+            summary["distinct"] = round(self.distinct.estimate())
+            summary["length_histogram"] = {
+                _bucket_label(bucket): int(count) for bucket, count in enumerate(self.lengths) if count
+            }
+        return summary
+
+    def to_state(self) -> Dict[str, Any]:
+        """Every statistic as JSON, to be merged later."""
+        state = {"count": self.count, "empty": self.empty}
+        if self.finite:
+            state.update(finite=self.finite, min=self.min, max=self.max, total=self.total)
+        if self.true:
+            state["true"] = self.true
+        if self.lengths.any():
+            state["lengths"] = np.trim_zeros(self.lengths, "b").tolist()
+            state["distinct"] = self.distinct.to_state()
+        return state
+
+    @classmethod
+    def from_state(cls, feature_type: FeatureType, state: Dict[str, Any]) -> "ColumnStats":
+        stats = cls(feature_type)
+        stats.count, stats.empty = state["count"], state["empty"]
+        if state.get("finite"):
+            stats._add_range(state["finite"], state["min"], state["max"], state["total"])
+        stats.true = state.get("true", 0)
+        if "lengths" in state:
+            stats.lengths[: len(state["lengths"])] = state["lengths"]
+            stats.distinct = HyperLogLog.from_state(state["distinct"])
+        return stats
+
+
+class DatasetStats:
+    """Statistics of every column of the dataset, see :class:`ColumnStats`."""
+
+    def __init__(self, columns: List[Column]):
+        self.columns: List[Column] = columns
+        #: Statistics of each column, by name
+        self.stats: Dict[str, ColumnStats] = {column.name: ColumnStats(column.feature_type) for column in columns}
+
+    @property
+    def num_rows(self) -> int:
+        return next(iter(self.stats.values())).count if self.stats else 0
+
+    def add_rows(self, rows: List[List[str]], buffers: Optional[List[Any]] = None):
+        """
+        Add the rows which are converted without error.
+
+        :param rows: Rows which have the same length with the columns
+        :param buffers: Typed buffer of each column of the rows, if the converter featurized them at once
+        """
+        if not rows:
+            return
+        for idx, (column, values) in enumerate(zip(self.columns, zip(*rows))):
+            parsed = buffers is not None and column.feature_type in PARSED_TYPES
+            self.stats[column.name].add(values, buffers[idx] if parsed else None)
+
+    def merge(self, other: "DatasetStats") -> "DatasetStats":
+        for name, stats in other.stats.items():
+            self.stats[name].merge(stats)
+        return self
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "num_rows": self.num_rows,
+            "columns": {column.name: self.stats[column.name].summary() for column in self.columns},
+        }
+
+    def to_state(self) -> Dict[str, Any]:
+        return {name: stats.to_state() for name, stats in self.stats.items()}
+
+    @classmethod
+    def from_state(cls, columns: List[Column], state: Dict[str, Any]) -> "DatasetStats":
+        dataset = cls(columns)
+        for column in columns:
+            dataset.stats[column.name] = ColumnStats.from_state(column.feature_type, state[column.name])
+        return dataset
+
+    def save(self, path: str):
+        """Write the summary of every column atomically as JSON."""
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+        os.replace(temp_path, path)
@@ -0,0 +1,289 @@
+"""
+TFRecord framing without TensorFlow.
+
+Each record is written as::
+
+    uint64 length
+    uint32 masked_crc32c(length)
+    byte   data[length]
+    uint32 masked_crc32c(data)
+
+and the whole file is optionally compressed as one GZIP or ZLIB stream, same as `tf.io.TFRecordWriter`.
+"""
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import BinaryIO, Deque, Iterator, Optional
+
+try:
+    import google_crc32c
+except ImportError:  # pragma: no cover - depends on the environment
+    google_crc32c = None
+
+COMPRESSION_TYPES = ("GZIP", "ZLIB", "")
+#: Whether CRC32C is computed by the C extension, not by Python
+FAST_CRC32C = google_crc32c is not None
+
+_LENGTH = struct.Struct("<Q")
+_CRC = struct.Struct("<I")
+_HEADER_SIZE = _LENGTH.size + _CRC.size
+#: Bytes each record takes in uncompressed TFRecord file, on top of its data
+FRAME_OVERHEAD = _HEADER_SIZE + _CRC.size
+_MASK_DELTA = 0xA282EAD8
+_READ_CHUNK_SIZE = 1 << 20
+#: Size of the blocks compressed in parallel, in bytes of the uncompressed stream
+PARALLEL_BLOCK_SIZE = 1 << 20
+# Max distance of the back references of deflate
+_WINDOW_SIZE = 1 << 15
+# Minimal GZIP header without mtime and file name, and ZLIB header of the default level
+_GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+_ZLIB_HEADER = b"\x78\x9c"
+
+# Window bits of zlib for each compression type; 16 + 15 for GZIP header and trailer
+_WBITS = {"GZIP": 31, "ZLIB": 15}
+
+
+def _make_crc32c_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x82F63B78 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+_CRC32C_TABLE = _make_crc32c_table()
+
+
+def _crc32c_python(data: bytes, crc: int = 0) -> int:
+    crc ^= 0xFFFFFFFF
+    table = _CRC32C_TABLE
+    for byte in data:
+        crc = table[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    return crc ^ 0xFFFFFFFF
+
+
+def crc32c(data: bytes, crc: int = 0) -> int:
+    """CRC32C (Castagnoli) of the data. Uses `google_crc32c` if it is installed."""
+    if google_crc32c is not None:
+        return google_crc32c.extend(crc, data)
+    return _crc32c_python(data, crc)
+
+
+def masked_crc32c(data: bytes) -> int:
+    """Masked CRC32C, as TFRecord stores it."""
+    crc = crc32c(data)
+    return (((crc >> 15) | (crc << 17)) + _MASK_DELTA) & 0xFFFFFFFF
+
+
+def frame_record(record: bytes) -> bytes:
+    """Frame the record with its length and CRCs, as it is stored in uncompressed TFRecord file."""
+    header = _LENGTH.pack(len(record))
+    return b"".join((header, _CRC.pack(masked_crc32c(header)), record, _CRC.pack(masked_crc32c(record))))
+
+
+def unframe_record(frame: bytes, verify: bool = True) -> bytes:
+    """
+    Take the data out of one framed record, as written by :func:`frame_record`.
+
+    :raises ValueError: If the frame is truncated or corrupted
+    """
+    if len(frame) < FRAME_OVERHEAD:
+        raise ValueError("Truncated record")
+    header = frame[: _LENGTH.size]
+    (length,) = _LENGTH.unpack(header)
+    if len(frame) != length + FRAME_OVERHEAD:
+        raise ValueError("Truncated record")
+    record = frame[_HEADER_SIZE : _HEADER_SIZE + length]
+    if verify:
+        if _CRC.unpack_from(frame, _LENGTH.size)[0] != masked_crc32c(header):
+            raise ValueError("Corrupted length")
+        if _CRC.unpack_from(frame, _HEADER_SIZE + length)[0] != masked_crc32c(record):
+            raise ValueError("Corrupted record")
+    return record
+
+
+def _check_compression_type(compression_type: str):
+    if compression_type not in COMPRESSION_TYPES:
+        raise ValueError(f"Invalid compression type `{compression_type}` is present.")
+
+
+def _deflate_block(data: bytes, dictionary: bytes, level: int, last: bool) -> bytes:
+    """Compress one block into raw deflate, which ends at a byte boundary unless it is the last one."""
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class ParallelCompressor:
+    """
+    Drop-in replacement of `zlib.compressobj`, which compresses blocks of the stream in a pool of threads as pigz does.
+    zlib releases the GIL while compressing, so the blocks are compressed while the caller keeps serializing.
+
+    Each block is compressed into raw deflate primed with the last 32 KiB of the previous block, and ends with
+    a sync flush, so the blocks join into one GZIP or ZLIB stream which any decompressor can read.
+
+    :param compression_type: "GZIP" or "ZLIB"
+    :param level: zlib compression level, -1 for the default
+    :param threads: Number of threads to compress with
+    :param block_size: Size of each block before compression
+    """
+
+    def __init__(self, compression_type: str, level: int = -1, threads: int = 2, block_size: int = PARALLEL_BLOCK_SIZE):
+        self._gzip: bool = compression_type == "GZIP"
+        self._level: int = level
+        self._block_size: int = block_size
+        self._executor = ThreadPoolExecutor(threads)
+        # Bound the compressed blocks waiting to be returned, so the memory does not grow with the file
+        self._max_pending: int = threads * 2
+        self._pending: Deque[Future] = deque()
+        self._buffer = bytearray()
+        self._dictionary: bytes = b""
+        self._check: int = zlib.crc32(b"") if self._gzip else zlib.adler32(b"")
+        self._size: int = 0
+        self._header: bytes = _GZIP_HEADER if self._gzip else _ZLIB_HEADER
+
+    def compress(self, data: bytes) -> bytes:
+        self._buffer += data
+        while len(self._buffer) >= self._block_size:
+            block = bytes(self._buffer[: self._block_size])
+            del self._buffer[: self._block_size]
+            self._submit(block, last=False)
+        out = [self._header]
+        self._header = b""
+        while len(self._pending) > self._max_pending:
+            out.append(self._pending.popleft().result())
+        return b"".join(out)
+
+    def flush(self) -> bytes:
+        self._submit(bytes(self._buffer), last=True)
+        self._buffer = bytearray()
+        out = [self._header] + [future.result() for future in self._pending]
+        self._pending.clear()
+        self._executor.shutdown()
+        if self._gzip:
+            out.append(struct.pack("<II", self._check & 0xFFFFFFFF, self._size & 0xFFFFFFFF))
+        else:
+            out.append(struct.pack(">I", self._check & 0xFFFFFFFF))
+        return b"".join(out)
+
+    def _submit(self, block: bytes, last: bool):
+        if self._gzip:
+            self._check = zlib.crc32(block, self._check)
+        else:
+            self._check = zlib.adler32(block, self._check)
+        self._size += len(block)
+        self._pending.append(self._executor.submit(_deflate_block, block, self._dictionary, self._level, last))
+        self._dictionary = block[-_WINDOW_SIZE:]
+
+
+class TFRecordWriter:
+    """
+    Write records into TFRecord file, readable by `tf.data.TFRecordDataset`.
+
+    :param path: Path of the file to write
+    :param compression_type: "GZIP", "ZLIB" or "" (no compression)
+    :param compression_level: zlib compression level, -1 for the default
+    :param compression_threads: Number of threads to compress with. Compresses in the caller thread if it is 1.
+    :param fileobj: Stream to write into instead of the file at `path`, e.g. a blob of the bucket.
+        Closed along with the writer.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        compression_type: str = "GZIP",
+        compression_level: int = -1,
+        compression_threads: int = 1,
+        fileobj: Optional[BinaryIO] = None,
+    ):
+        _check_compression_type(compression_type)
+        self._file: Optional[BinaryIO] = fileobj if fileobj is not None else open(path, "wb")
+        if not compression_type:
+            self._compressor = None
+        elif compression_threads > 1:
+            self._compressor = ParallelCompressor(compression_type, compression_level, compression_threads)
+        else:
+            self._compressor = zlib.compressobj(compression_level, zlib.DEFLATED, _WBITS[compression_type])
+        #: Bytes written into the file so far. Lags behind while the compressor holds data back.
+        self.num_bytes: int = 0
+
+    def write(self, record: bytes):
+        frame = frame_record(record)
+        if self._compressor is not None:
+            frame = self._compressor.compress(frame)
+        self._file.write(frame)
+        self.num_bytes += len(frame)
+
+    def close(self):
+        if self._file is None:
+            return
+        if self._compressor is not None:
+            tail = self._compressor.flush()
+            self._file.write(tail)
+            self.num_bytes += len(tail)
+        self._file.close()
+        self._file = None
+
+    def __enter__(self) -> "TFRecordWriter":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _read_chunks(f: BinaryIO, compression_type: str) -> Iterator[bytes]:
+    """Yield decompressed chunks of the file. Concatenated GZIP members are read one after another."""
+    if not compression_type:
+        yield from iter(lambda: f.read(_READ_CHUNK_SIZE), b"")
+        return
+
+    decompressor = zlib.decompressobj(_WBITS[compression_type])
+    for chunk in iter(lambda: f.read(_READ_CHUNK_SIZE), b""):
+        while chunk:
+            yield decompressor.decompress(chunk)
+            if not decompressor.eof:
+                break
+            chunk = decompressor.unused_data
+            decompressor = zlib.decompressobj(_WBITS[compression_type])
+    yield decompressor.flush()
+
+
+def read_tfrecord(path: str, compression_type: str = "GZIP", verify: bool = True) -> Iterator[bytes]:
+    """
+    Lazily read records from TFRecord file.
+
+    :param path: Path of the file to read
+    :param compression_type: "GZIP", "ZLIB" or "" (no compression)
+    :param verify: Whether check CRC of each record or not
+    :raises ValueError: If the file is truncated or corrupted
+    """
+    _check_compression_type(compression_type)
+    buffer = bytearray()
+    offset = 0
+    with open(path, "rb") as f:
+        for chunk in _read_chunks(f, compression_type):
+            buffer += chunk
+            while len(buffer) - offset >= _HEADER_SIZE:
+                header = bytes(buffer[offset : offset + _LENGTH.size])
+                if verify and _CRC.unpack_from(buffer, offset + _LENGTH.size)[0] != masked_crc32c(header):
+                    raise ValueError(f"Corrupted length at byte {offset} of {path}")
+                (length,) = _LENGTH.unpack(header)
+                end = offset + _HEADER_SIZE + length + _CRC.size
+                if len(buffer) < end:
+                    break
+                record = bytes(buffer[offset + _HEADER_SIZE : end - _CRC.size])
+                if verify and _CRC.unpack_from(buffer, end - _CRC.size)[0] != masked_crc32c(record):
+                    raise ValueError(f"Corrupted record at byte {offset} of {path}")
+                yield record
+                offset = end
+            # Drop consumed bytes once in a while, not for every record
+            if offset > _READ_CHUNK_SIZE:
+                del buffer[:offset]
+                offset = 0
+    if len(buffer) != offset:
+        raise ValueError(f"Truncated record at the end of {path}")
@@ -0,0 +1,99 @@
+"""
+Tokenizers of TOKENIZED columns, which split values into tokens and look them up in the vocabulary of the column,
+so the conversion writes the token IDs once instead of tokenizing raw strings on every training epoch.
+"""
+import functools
+import re
+from typing import Dict, List, Optional, Tuple
+
+from .datatype import Column, FeatureType
+
+#: Pattern of tokens of the 'regex' tokenizer, and of words of the 'wordpiece' tokenizer, if not given
+DEFAULT_PATTERN = r"\w+|[^\w\s]"
+#: Number of distinct values, and words of 'wordpiece', whose IDs each tokenizer keeps
+TOKEN_CACHE_SIZE = 1 << 16
+#: Token of the 'wordpiece' vocabulary which words out of the vocabulary are encoded as, if it has one
+UNKNOWN_TOKEN = "[UNK]"
+#: Prefix of 'wordpiece' tokens which continue a word
+CONTINUATION_PREFIX = "##"
+#: Words of 'wordpiece' longer than this are encoded as unknown without trying to split them
+MAX_WORD_CHARS = 100
+#: Suffix of the name of the feature which has the number of tokens of a TOKENIZED column
+LENGTH_SUFFIX = "_length"
+
+
+def length_column(column: Column) -> Column:
+    """INT column of the number of tokens of the TOKENIZED column."""
+    return Column(column.name + LENGTH_SUFFIX, FeatureType.INT)
+
+
+def feature_columns(columns: List[Column]) -> List[Column]:
+    """Columns of every feature written into the examples, with the length of each TOKENIZED column if enabled."""
+    features = []
+    for column in columns:
+        features.append(column)
+        if column.feature_type == FeatureType.TOKENIZED and column.length_feature:
+            features.append(length_column(column))
+    return features
+
+
+class Tokenizer:
+    """
+    Split the values of a TOKENIZED column into tokens, and encode them as their IDs in the vocabulary.
+    Tokens out of the vocabulary get the ID right after the last one, or the ID of :data:`UNKNOWN_TOKEN`
+    with 'wordpiece' if the vocabulary has it.
+
+    Built once in each pool worker along with the encoder. IDs of the recent distinct values are cached,
+    since values such as short utterances repeat a lot, and so are the pieces of each word with 'wordpiece'.
+
+    :param column: TOKENIZED column
+    :param vocabulary: IDs by token. Only :meth:`split` can be used if None.
+    """
+
+    def __init__(self, column: Column, vocabulary: Optional[Dict[str, int]] = None):
+        self.column: Column = column
+        self.vocabulary: Dict[str, int] = vocabulary if vocabulary is not None else {}
+        self._pattern: Optional["re.Pattern"] = (
+            re.compile(column.pattern or DEFAULT_PATTERN) if column.tokenizer != "whitespace" else None
+        )
+        self._oov: int = len(self.vocabulary)
+        if column.tokenizer == "wordpiece":
+            self._oov = self.vocabulary.get(UNKNOWN_TOKEN, self._oov)
+            self._word_ids = functools.lru_cache(maxsize=TOKEN_CACHE_SIZE)(self._wordpiece)
+        #: IDs of the tokens of the value, cached by the value
+        self.token_ids = functools.lru_cache(maxsize=TOKEN_CACHE_SIZE)(self._token_ids)
+
+    def split(self, value: str) -> List[str]:
+        """Split the value into tokens, or into words with 'wordpiece'."""
+        if self.column.lowercase:
+            value = value.lower()
+        if self._pattern is None:
+            return value.split()
+        return self._pattern.findall(value)
+
+    def _token_ids(self, value: str) -> Tuple[int, ...]:
+        if self.column.tokenizer == "wordpiece":
+            ids = [token_id for word in self.split(value) for token_id in self._word_ids(word)]
+        else:
+            ids = [self.vocabulary.get(token, self._oov) for token in self.split(value)]
+        if self.column.max_tokens:
+            ids = ids[: self.column.max_tokens]
+        return tuple(ids)
+
+    def _wordpiece(self, word: str) -> Tuple[int, ...]:
+        """Split the word into the longest pieces in the vocabulary from the start, or encode it as unknown."""
+        if len(word) > MAX_WORD_CHARS:
+            return (self._oov,)
+        ids, start = [], 0
+        while start < len(word):
+            end = len(word)
+            while end > start:
+                piece = word[start:end] if start == 0 else CONTINUATION_PREFIX + word[start:end]
+                if piece in self.vocabulary:
+                    break
+                end -= 1
+            else:
+                return (self._oov,)
+            ids.append(self.vocabulary[piece])
+            start = end
+        return tuple(ids)
@@ -1,36 +1,180 @@
+import fnmatch
 import logging
 import os
-from typing import Awaitable, Optional
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING, BinaryIO, Callable, Dict, List, Optional, TypeVar
 
-from google.cloud import storage
-from google.cloud.exceptions import NotFound
+import requests
+import tqdm
+from google.api_core import exceptions as api_exceptions
 
 from .config import Config
+from .fileio import file_crc32c, file_md5
+from .localgcs import LocalClient
+from .metrics import Metrics
+from .tfrecord import FAST_CRC32C
+
+if TYPE_CHECKING:
+    from google.cloud import storage
+
+T = TypeVar("T")
+
+#: Errors which are worth retrying
+TRANSIENT_ERRORS = (
+    api_exceptions.TooManyRequests,
+    api_exceptions.InternalServerError,
+    api_exceptions.BadGateway,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.GatewayTimeout,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    ConnectionError,
+    TimeoutError,
+)
+#: Delay before the first retry, doubled on every retry, in seconds
+RETRY_INITIAL_DELAY = 1.0
+#: Max delay between retries, in seconds
+RETRY_MAX_DELAY = 60.0
+
+
+def storage_client(config: Config):
+    """Client of Google Cloud Storage, or its local stand-in if `local_bucket_dir` is set."""
+    if config.local_bucket_dir:
+        return LocalClient(config.local_bucket_dir)
+    # Takes a while to import, and not needed for the local stand-in
+    from google.cloud import storage
+
+    return storage.Client(project=config.gcp_project_id)
 
 
 class Uploader:
-    def __init__(self, config: Config, bucket_name: Optional[str] = None):
+    """
+    Upload files to the bucket of the dataset with a pool of threads, sharing one client.
+    Files larger than `upload_chunk_size` are sent as chunked resumable uploads, and every upload
+    is retried with exponential backoff on transient errors.
+
+    With `sync`, the bucket is listed once, and files which already exist there with the same size
+    and checksum are skipped.
+    """
+
+    def __init__(
+        self, config: Config, bucket_name: Optional[str] = None, client=None, metrics: Optional[Metrics] = None
+    ):
         self.config: Config = config
         self.bucket_name: str = bucket_name if bucket_name is not None else config.name + ".tfrecord"
+        self.metrics: Metrics = metrics if metrics is not None else Metrics()
 
-        self._client = storage.Client(project=config.gcp_project_id)
+        self._client = client if client is not None else storage_client(config)
         self._bucket = self._get_bucket()
+        #: Blobs in the bucket by name, listed once if `sync` is set
+        self._remote: Dict[str, "storage.Blob"] = (
+            {blob.name: blob for blob in self._client.list_blobs(self._bucket)} if config.sync else {}
+        )
 
-    def _get_bucket(self) -> storage.Bucket:
+    def _get_bucket(self) -> "storage.Bucket":
         """Try to get bucket, and make one if not exist"""
-        try:
-            return self._client.get_bucket(self.bucket_name)
-        except NotFound:
+        bucket = self._client.lookup_bucket(self.bucket_name)
+        if bucket is None:
             logging.info(f"Bucket {self.bucket_name} not found, make one")
-            return self._client.create_bucket(self.bucket_name)
+            bucket = self._client.create_bucket(self.bucket_name, location=self.config.bucket_location)
+        return bucket
+
+    def upload_files(self, file_paths: List[str], delete_after_success: bool = False) -> int:
+        """Upload files concurrently with `upload_concurrency` threads, and return the number of uploaded files."""
+        if not file_paths:
+            return 0
+        with ThreadPoolExecutor(self.config.upload_concurrency) as executor:
+            futures = [executor.submit(self.upload_file, path, delete_after_success) for path in file_paths]
+            return sum(future.result() for future in tqdm.tqdm(as_completed(futures), total=len(futures)))
 
-    async def upload_file(self, file_path: str, delete_after_success: bool = False) -> Awaitable[int]:
-        """Upload single file to the Google Cloud Storage."""
+    def upload_file(self, file_path: str, delete_after_success: bool = False) -> int:
+        """Upload single file to the Google Cloud Storage. Blocks until the upload is done."""
         try:
-            blob = self._bucket.blob(os.path.basename(file_path))
-            blob.upload_from_filename(file_path)
+            size = os.path.getsize(file_path)
+            if self._is_synced(file_path, size):
+                logging.info(f"Skipped {file_path}, which is already in the bucket")
+                self.metrics.count("files_skipped")
+                if delete_after_success:
+                    os.remove(file_path)
+                return 1
+
+            # Chunked uploads are resumable, so a transient error does not send the whole file again
+            chunk_size = self.config.upload_chunk_size if size > self.config.upload_chunk_size else None
+            blob = self._bucket.blob(os.path.basename(file_path), chunk_size=chunk_size)
+
+            started = time.monotonic()
+            self._retry(lambda: blob.upload_from_filename(file_path), file_path)
+            elapsed = max(time.monotonic() - started, 1e-6)
+            mib = size / 2**20
+            logging.info(f"Uploaded {file_path} ({mib:.1f} MiB) in {elapsed:.2f}s, {mib / elapsed:.1f} MiB/s")
+            self.metrics.time("upload", elapsed)
+            self.metrics.count("files_uploaded")
+            self.metrics.count("bytes_uploaded", size)
+
+            if delete_after_success:
+                os.remove(file_path)
             return 1
         except Exception as e:
-            logging.error("Failed while uploading file")
+            logging.error(f"Failed while uploading file {file_path}")
             logging.error(e)
+            self.metrics.count("upload_failures")
             return 0
+
+    def open_blob(self, name: str) -> BinaryIO:
+        """
+        Open the blob to stream into, as a chunked resumable upload, which is finished once the stream is closed
+        and cancelled by `terminate()`. Only one chunk of `diskless_buffer_bytes` is held in memory.
+        Each chunk is retried by the client on transient errors, as the data sent before it cannot be read again.
+        """
+        return self._bucket.blob(name).open("wb", chunk_size=self.config.diskless_buffer_bytes)
+
+    def blob_names(self, pattern: str) -> List[str]:
+        """Names of the blobs in the bucket which match the glob pattern."""
+        return sorted(fnmatch.filter((blob.name for blob in self._client.list_blobs(self._bucket)), pattern))
+
+    def delete_blobs(self, file_paths: List[str]) -> int:
+        """Delete the blobs of the files from the bucket, skipping those not found, and return the number deleted."""
+        deleted = 0
+        for name in sorted(set(os.path.basename(path) for path in file_paths)):
+            try:
+                self._retry(self._bucket.blob(name).delete, name)
+            except api_exceptions.NotFound:
+                continue
+            logging.info(f"Deleted {name} from the bucket")
+            self._remote.pop(name, None)
+            deleted += 1
+        return deleted
+
+    def delete_stale_blobs(self, file_paths: List[str]) -> int:
+        """Delete blobs listed by `sync` which do not exist among the given local files."""
+        names = set(os.path.basename(path) for path in file_paths)
+        stale = [blob for name, blob in self._remote.items() if name not in names]
+        for blob in stale:
+            self._retry(blob.delete, blob.name)
+            logging.info(f"Deleted {blob.name} from the bucket, which does not exist locally")
+        return len(stale)
+
+    def _is_synced(self, file_path: str, size: int) -> bool:
+        """Whether the bucket already has the same file, by size and CRC32C or MD5."""
+        blob = self._remote.get(os.path.basename(file_path))
+        if blob is None or blob.size != size:
+            return False
+        # CRC32C is cheaper if it is computed in C. Composite objects only have CRC32C.
+        if blob.crc32c is not None and (FAST_CRC32C or blob.md5_hash is None):
+            return blob.crc32c == file_crc32c(file_path)
+        return blob.md5_hash is not None and blob.md5_hash == file_md5(file_path)
+
+    def _retry(self, func: Callable[[], T], file_path: str) -> T:
+        """Call the function, retrying up to `upload_retries` times with exponential backoff and jitter."""
+        for attempt in range(self.config.upload_retries + 1):
+            try:
+                return func()
+            except TRANSIENT_ERRORS as e:
+                if attempt == self.config.upload_retries:
+                    raise
+                delay = min(RETRY_MAX_DELAY, RETRY_INITIAL_DELAY * 2**attempt) * random.uniform(0.5, 1.0)
+                logging.warning(f"Retry uploading {file_path} in {delay:.1f}s: {e}")
+                self.metrics.count("upload_retries")
+                time.sleep(delay)
@@ -1,5 +1,31 @@
+import itertools
+
+
 def batch(iterable, n=1):
     """Batch iterable by n."""
     length = len(iterable)
     for ndx in range(0, length, n):
         yield iterable[ndx : min(ndx + n, length)]
+
+
+def batch_iter(iterable, n=1):
+    """Batch any iterable by n, without knowing its length. Yields lists."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, n))
+        if not chunk:
+            return
+        yield chunk
+
+
+class ErrorCounter:
+    """Count errors of one file, and stop when `max_error` is reached. -1 means no limit."""
+
+    def __init__(self, max_error: int = -1):
+        self.max_error: int = max_error
+        self.count: int = 0
+
+    def add(self, count: int = 1):
+        self.count += count
+        if self.max_error != -1 and self.count >= self.max_error:
+            raise ValueError("Max error count reached, Stop to parse")
@@ -0,0 +1,226 @@
+"""Check the converted TFRecord files against the columns of the dataset, without TensorFlow."""
+import math
+import os
+import struct
+import zlib
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from .config import Config
+from .datatype import Column, FeatureType
+from .fileio import index_filename, read_tfrecord_file
+from .tokenizer import feature_columns
+
+#: Kind of `tf.train.Feature` each feature type is written as
+FEATURE_KINDS = {
+    FeatureType.STRING: "bytes_list",
+    FeatureType.BYTES: "bytes_list",
+    FeatureType.FLOAT: "float_list",
+    FeatureType.INT: "int64_list",
+    FeatureType.BOOL: "int64_list",
+    FeatureType.CATEGORICAL: "int64_list",
+    FeatureType.TOKENIZED: "int64_list",
+}
+#: Max number of errors kept in the report of each file, on top of the count
+MAX_REPORTED_ERRORS = 10
+
+_KINDS = {1: "bytes_list", 2: "float_list", 3: "int64_list"}
+_WIRE_VARINT, _WIRE_FIXED64, _WIRE_LENGTH_DELIMITED, _WIRE_FIXED32 = 0, 1, 2, 5
+
+
+def _read_varint(data: memoryview, pos: int) -> Tuple[int, int]:
+    value, shift = 0, 0
+    while True:
+        if pos >= len(data):
+            raise ValueError("Truncated varint")
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+        if shift >= 70:
+            raise ValueError("Varint is too long")
+
+
+def _iter_fields(data: memoryview) -> Iterator[Tuple[int, int, object]]:
+    """Yield field number, wire type and value of each field of the protobuf message."""
+    pos = 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        field, wire_type = key >> 3, key & 0x7
+        if wire_type == _WIRE_VARINT:
+            value, pos = _read_varint(data, pos)
+        elif wire_type == _WIRE_LENGTH_DELIMITED:
+            length, pos = _read_varint(data, pos)
+            value, pos = data[pos : pos + length], pos + length
+        elif wire_type in (_WIRE_FIXED32, _WIRE_FIXED64):
+            size = 4 if wire_type == _WIRE_FIXED32 else 8
+            value, pos = data[pos : pos + size], pos + size
+        else:
+            raise ValueError(f"Unsupported wire type {wire_type}")
+        if pos > len(data):
+            raise ValueError("Truncated field")
+        yield field, wire_type, value
+
+
+def _to_int64(value: int) -> int:
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _decode_list(kind: str, data: memoryview) -> list:
+    values = []
+    for field, wire_type, value in _iter_fields(data):
+        if field != 1:
+            continue
+        if kind == "bytes_list":
+            values.append(bytes(value))
+        elif kind == "float_list" and wire_type == _WIRE_LENGTH_DELIMITED:
+            values.extend(struct.unpack(f"<{len(value) // 4}f", value))
+        elif kind == "float_list":
+            values.append(struct.unpack("<f", value)[0])
+        elif wire_type == _WIRE_LENGTH_DELIMITED:
+            pos = 0
+            while pos < len(value):
+                varint, pos = _read_varint(value, pos)
+                values.append(_to_int64(varint))
+        else:
+            values.append(_to_int64(value))
+    return values
+
+
+def decode_example(data: bytes) -> Dict[str, Tuple[Optional[str], list]]:
+    """
+    Decode serialized tf.train.Example.
+
+    :return: Kind of each feature, "bytes_list", "float_list", "int64_list" or None if it is empty, with its values
+    :raises ValueError: If the data is not a valid tf.train.Example
+    """
+    features = {}
+    for field, wire_type, value in _iter_fields(memoryview(data)):
+        if field != 1 or wire_type != _WIRE_LENGTH_DELIMITED:
+            continue
+        for entry_field, entry_wire_type, entry in _iter_fields(value):
+            if entry_field != 1 or entry_wire_type != _WIRE_LENGTH_DELIMITED:
+                continue
+            key, feature = "", memoryview(b"")
+            for item_field, _, item in _iter_fields(entry):
+                if item_field == 1:
+                    key = bytes(item).decode()
+                elif item_field == 2:
+                    feature = item
+            kind, values = None, []
+            for kind_field, _, payload in _iter_fields(feature):
+                if kind_field in _KINDS:
+                    kind, values = _KINDS[kind_field], _decode_list(_KINDS[kind_field], payload)
+            features[key] = (kind, values)
+    return features
+
+
+class ColumnSummary(NamedTuple):
+    """
+    Summary of the values of one column. Values of STRING and BYTES columns are summarized by their length,
+    and TOKENIZED columns by their number of tokens.
+    """
+
+    #: Number of values
+    count: int = 0
+    #: Min value, or min length
+    min: float = math.inf
+    #: Max value, or max length
+    max: float = -math.inf
+    #: Sum of the values, or of the lengths
+    total: float = 0.0
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else math.nan
+
+    def add(self, values: List[float]) -> "ColumnSummary":
+        if not values:
+            return self
+        return ColumnSummary(
+            self.count + len(values), min(self.min, min(values)), max(self.max, max(values)), self.total + sum(values)
+        )
+
+    def merge(self, other: "ColumnSummary") -> "ColumnSummary":
+        return ColumnSummary(
+            self.count + other.count, min(self.min, other.min), max(self.max, other.max), self.total + other.total
+        )
+
+
+class ShardReport(NamedTuple):
+    #: Path of the verified file
+    path: str
+    #: Number of records read from the file, including invalid ones
+    num_records: int
+    #: Size of the file in bytes
+    num_bytes: int
+    #: Number of errors found in the file
+    num_errors: int
+    #: First :data:`MAX_REPORTED_ERRORS` errors found in the file
+    errors: List[str]
+    #: Summary of each column, by name
+    columns: Dict[str, ColumnSummary]
+
+
+def check_example(features: Dict[str, Tuple[Optional[str], list]], columns: List[Column]) -> Optional[str]:
+    """
+    Check that the decoded example has exactly the features of the columns, each with one value of the kind
+    of its type, or any number of values for TOKENIZED columns.
+    """
+    columns = feature_columns(columns)
+    names = [column.name for column in columns]
+    if sorted(features) != sorted(names):
+        return f"Expected features {sorted(names)}, got {sorted(features)}"
+    for column in columns:
+        kind, values = features[column.name]
+        expected = FEATURE_KINDS[column.feature_type]
+        if column.feature_type == FeatureType.TOKENIZED:
+            if kind != expected:
+                return f"Expected {expected} of `{column.name}`, got {kind}"
+        elif kind != expected or len(values) != 1:
+            return f"Expected one value in {expected} of `{column.name}`, got {len(values)} in {kind}"
+        if column.feature_type == FeatureType.BOOL and values[0] not in (0, 1):
+            return f"Expected 0 or 1 for `{column.name}`, got {values[0]}"
+    return None
+
+
+def verify_shard(path: str, config: Config) -> ShardReport:
+    """
+    Read every record of the file, checking its framing and CRCs, and check every example against the columns.
+    Reading stops at the first framing error, since nothing after it can be trusted.
+    """
+    num_records, errors, num_errors = 0, [], 0
+    columns = {column.name: ColumnSummary() for column in config.columns}
+
+    def error(message: str):
+        nonlocal num_errors
+        num_errors += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append(message)
+
+    try:
+        for record in read_tfrecord_file(path, compression_type=config.compression_type):
+            num_records += 1
+            try:
+                features = decode_example(record)
+            except (ValueError, UnicodeDecodeError, struct.error) as e:
+                error(f"Record {num_records - 1}: {e}")
+                continue
+            message = check_example(features, config.columns)
+            if message is not None:
+                error(f"Record {num_records - 1}: {message}")
+                continue
+            for column in config.columns:
+                _, values = features[column.name]
+                if FEATURE_KINDS[column.feature_type] == "bytes_list":
+                    values = [len(value) for value in values]
+                elif column.feature_type == FeatureType.TOKENIZED:
+                    values = [len(values)]
+                columns[column.name] = columns[column.name].add(values)
+    except (ValueError, OSError, zlib.error) as e:
+        # Corrupted framing, CRC, or compressed stream
+        error(str(e))
+    if os.path.exists(index_filename(path)) and os.path.getsize(index_filename(path)) // 16 != num_records:
+        error(f"Index has {os.path.getsize(index_filename(path)) // 16} records, but the file has {num_records}")
+    return ShardReport(path, num_records, os.path.getsize(path), num_errors, errors, columns)
@@ -0,0 +1,185 @@
+"""
+Vocabularies of CATEGORICAL columns and of the tokens of TOKENIZED columns, built in a pass over the dataset
+before the conversion, unless a TOKENIZED column has its own `vocab_file`.
+
+Each vocabulary is written next to the shards as a text file of one value per line, most frequent first,
+which `tf.lookup.TextFileInitializer` can read. The ID of a value is its line number,
+and values out of the vocabulary get the ID right after the last line, as `tf.lookup.StaticVocabularyTable`
+with one OOV bucket assigns.
+
+Once built, the IDs of the values never change. The next run only counts the files which are new or changed,
+and appends their new values after the last line, so the shards converted before keep their IDs.
+`min_count` applies to the values counted by each run then, and `full_convert` builds every vocabulary again.
+"""
+import collections
+import json
+import os
+import socket
+from typing import Any, Counter, Dict, List, NamedTuple, Optional
+
+from .config import Config
+from .datatype import Column, FeatureType
+from .fileio import file_digest, read_file
+from .tokenizer import Tokenizer
+from .utils import ErrorCounter
+
+
+def vocabulary_columns(config: Config) -> List[Column]:
+    """Columns encoded as IDs in a vocabulary."""
+    return [
+        column for column in config.columns if column.feature_type in (FeatureType.CATEGORICAL, FeatureType.TOKENIZED)
+    ]
+
+
+def built_vocabulary_columns(config: Config) -> List[Column]:
+    """Columns whose vocabulary is built over the dataset, and written next to the shards."""
+    return [column for column in vocabulary_columns(config) if column.vocab_file is None]
+
+
+def vocab_path(config: Config, column: Column) -> str:
+    if column.vocab_file is not None:
+        return column.vocab_file
+    return os.path.join(config.tfrecord_path, f"{config.name}.{column.name}.vocab")
+
+
+def vocab_state_path(config: Config, column: Column) -> str:
+    return vocab_path(config, column) + ".json"
+
+
+class VocabularyState(NamedTuple):
+    #: Options of the column which the vocabulary is built with. It is built again if they change.
+    settings: Dict[str, Any]
+    #: Digest of the vocabulary when the IDs of the converted values last changed
+    generation: str
+    #: Whether every value counted so far is in the vocabulary. If not, some shards have the ID of values
+    #: out of the vocabulary, which moves as the vocabulary grows.
+    complete: bool
+    #: Size and modification time in nanoseconds of every counted file, by path
+    inputs: Dict[str, List[int]]
+
+
+def vocabulary_settings(column: Column) -> Dict[str, Any]:
+    """Options of the column which change its vocabulary."""
+    options = ["min_count", "max_vocab_size"]
+    if column.feature_type == FeatureType.TOKENIZED:
+        options += ["tokenizer", "pattern", "lowercase", "max_tokens"]
+    return {"feature_type": column.feature_type.value, **{option: getattr(column, option) for option in options}}
+
+
+def load_vocabulary_state(path: str) -> Optional[VocabularyState]:
+    """Load the state of the built vocabulary, or None if it has not been built yet."""
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return VocabularyState(**json.load(f))
+
+
+def save_vocabulary_state(path: str, state: VocabularyState):
+    """Write the state atomically, as :func:`save_vocabulary` writes the vocabulary."""
+    temp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(state._asdict(), f)
+    os.replace(temp_path, path)
+
+
+def vocabulary_digest(config: Config, column: Column) -> Optional[str]:
+    """
+    Digest which changes whenever the shards converted with the vocabulary would change,
+    but not when values are only appended to it. None if the vocabulary has not been built.
+    """
+    path = vocab_path(config, column)
+    if not os.path.exists(path):
+        return None
+    state = load_vocabulary_state(vocab_state_path(config, column)) if column.vocab_file is None else None
+    return state.generation if state is not None else file_digest(path)
+
+
+def count_values(task: tuple, config: Config) -> Dict[str, Counter[str]]:
+    """
+    Count the values of every column whose vocabulary is built, or the tokens of TOKENIZED ones,
+    in one file or in its byte range.
+
+    :param task: :class:`<tfrecorder.convert.ConvertTask>` of the file
+    :return: Counts of the values of each column, by name
+    """
+    _, path, _, start, stop = task
+    built = built_vocabulary_columns(config)
+    indices = [
+        (idx, column.name, Tokenizer(column) if column.feature_type == FeatureType.TOKENIZED else None)
+        for idx, column in enumerate(config.columns)
+        if column in built
+    ]
+    counters = {name: collections.Counter() for _, name, _ in indices}
+    errors = ErrorCounter()
+    for row in read_file(path, config.file_type, skip_header=config.skip_header, errors=errors, start=start, stop=stop):
+        # Rows which cannot be converted are skipped while converting too
+        if len(row) != len(config.columns):
+            continue
+        for idx, name, tokenizer in indices:
+            if tokenizer is not None:
+                tokens = tokenizer.split(row[idx])
+                # Tokens after `max_tokens` are dropped by the encoder, so they never take a slot of the vocabulary
+                max_tokens = tokenizer.column.max_tokens
+                counters[name].update(tokens[:max_tokens] if max_tokens else tokens)
+            else:
+                counters[name][row[idx]] += 1
+    return counters
+
+
+def build_vocabulary(
+    counts: Counter[str], min_count: int = 1, max_size: int = 0, existing: Optional[List[str]] = None
+) -> List[str]:
+    """
+    Keep values which occur at least `min_count` times, up to the `max_size` most frequent ones.
+    Ties are ordered by the value, so the same counts always give the same vocabulary.
+    Values with a line break cannot be written as a line, so they are always out of the vocabulary.
+    Values of the `existing` vocabulary keep their IDs, and new values are appended after them.
+    """
+    existing = existing if existing is not None else []
+    known = set(existing)
+    values = sorted(
+        (
+            value
+            for value, count in counts.items()
+            if count >= min_count and value not in known and "\n" not in value and "\r" not in value
+        ),
+        key=lambda value: (-counts[value], value),
+    )
+    if max_size:
+        values = values[: max(max_size - len(existing), 0)]
+    return existing + values
+
+
+def save_vocabulary(path: str, vocabulary: List[str]):
+    """
+    Write the vocabulary atomically, one value per line. The temporary file is unique,
+    since every node of a partitioned conversion writes the same vocabulary at once.
+    """
+    temp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8", newline="\n") as f:
+        f.writelines(value + "\n" for value in vocabulary)
+    os.replace(temp_path, path)
+
+
+def load_vocabulary(path: str) -> Dict[str, int]:
+    """
+    Load the vocabulary as IDs by value. The last line may not end with a line break,
+    and `vocab_file` written on Windows ends its lines with CRLF.
+    """
+    with open(path, "r", encoding="utf-8", newline="\n") as f:
+        return {line.rstrip("\r\n"): idx for idx, line in enumerate(f)}
+
+
+def load_vocabularies(config: Config) -> Dict[str, Dict[str, int]]:
+    """
+    Load the vocabulary of every column encoded as IDs, as IDs by value.
+
+    :raises ValueError: If a vocabulary has not been built
+    """
+    vocabularies = {}
+    for column in vocabulary_columns(config):
+        path = vocab_path(config, column)
+        if not os.path.exists(path):
+            raise ValueError(f"Vocabulary of `{column.name}` is not found in {path}")
+        vocabularies[column.name] = load_vocabulary(path)
+    return vocabularies
@@ -1,84 +1,741 @@
-import itertools
+import asyncio
+import collections
+import functools
 import logging
 import multiprocessing
 import os
-from typing import Awaitable
+import random
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.pool import Pool
+from queue import Queue
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
 
 import tqdm
 
 from .config import Config, ExecutionMode
-from .convert import Converter
-from .fileio import get_filenames, save_tfrecord_file
-from .upload import Uploader
-from .utils import batch
+from .convert import Converter, ConvertTask, TaskResult
+from .datatype import FeatureType
+from .fileio import (
+    INDEX_SUFFIX,
+    ShardInfo,
+    ShardSpan,
+    ShardWriter,
+    bucket_pattern,
+    combine_digests,
+    file_digest,
+    fixed_shard_filename,
+    get_filenames,
+    index_filename,
+    merge_shard_spans,
+    partition_of,
+    plan_fixed_shards,
+    read_tfrecord_file,
+    remove_shard,
+    split_file,
+)
+from .manifest import Manifest, dataset_manifest_path, manifest_path, merge_manifests
+from .metrics import Metrics, merge_profiles, profiled
+from .schedule import plan_task_groups, run_group
+from .stats import DatasetStats, stats_path
+from .tfrecord import FAST_CRC32C
+from .verify import FEATURE_KINDS, ColumnSummary, verify_shard
+from .vocab import (
+    VocabularyState,
+    build_vocabulary,
+    built_vocabulary_columns,
+    count_values,
+    load_vocabulary,
+    load_vocabulary_state,
+    save_vocabulary,
+    save_vocabulary_state,
+    vocab_path,
+    vocab_state_path,
+    vocabulary_columns,
+    vocabulary_settings,
+)
+
+if TYPE_CHECKING:
+    from .upload import Uploader
+
+T = TypeVar("T")
+
+#: Min interval to save the manifest while converting, in seconds
+MANIFEST_SAVE_INTERVAL = 5.0
+#: Counters of the tasks which only write staging files, renamed so the shards are counted only once merged
+STAGING_COUNTERS = {"shards_written": "staging_files", "bytes_written": "staging_bytes"}
+
+
+#: Converter of this pool worker, built once by :func:`_init_pool`
+_converter: Optional[Converter] = None
+#: Queue to put the manifests of the written shards into, shared by every pool worker
+_shard_queue: Optional[Queue] = None
+
+
+def _init_pool(
+    config: Config, shard_queue: Optional[Queue] = None, vocabularies: Optional[Dict[str, Dict[str, int]]] = None
+):
+    """Build the converter once in each pool worker, instead of sending it along with every task."""
+    global _converter, _shard_queue
+    open_stream = None
+    if config.diskless:
+        from .upload import Uploader
+
+        # Each worker streams its shards into the bucket with its own client
+        open_stream = Uploader(config._replace(sync=False)).open_blob
+    _converter = Converter(config, vocabularies, open_stream)
+    _shard_queue = shard_queue
+    if config.writer_backend == "tensorflow":
+        # Pay for the import once here, not in the middle of the first task
+        import tensorflow  # noqa: F401
+
+
+def _convert_task(task: ConvertTask) -> TaskResult:
+    return _converter.convert_to_shards(task, shard_queue=_shard_queue)
+
+
+def _count_task(task: ConvertTask, config: Config) -> Tuple[str, Dict[str, collections.Counter]]:
+    return task.path, count_values(task, config)
+
+
+def _scatter_task(task: ConvertTask) -> TaskResult:
+    return _converter.convert_to_buckets(task)
+
+
+def _shuffle_bucket(bucket: int, config: Config, staging_path: str) -> List[ShardInfo]:
+    """Shuffle the records of the bucket in memory, and write them into the shards of the bucket."""
+    with profiled(config.profile, f"shuffle-{bucket:04d}"):
+        # Files of the bucket are sorted by the task, so the records are shuffled from the same order on every run
+        records = [
+            record
+            for path in sorted(get_filenames(bucket_pattern(staging_path, bucket)))
+            for record in read_tfrecord_file(path, compression_type="")
+        ]
+        random.Random(f"{config.seed}:bucket:{bucket}").shuffle(records)
+        # Named apart from the shards of the input files, which a run without `shuffle_buckets` tracks
+        with ShardWriter(
+            config.tfrecord_path,
+            f"{config.shard_name}.shuffled",
+            bucket,
+            0 if config.target_shard_bytes else config.batch_size,
+            compression_type=config.compression_type,
+            backend=config.writer_backend,
+            target_bytes=config.target_shard_bytes,
+            compression_level=config.compression_level,
+            compression_threads=config.compression_threads,
+            index=config.record_index,
+        ) as writer:
+            for record in records:
+                writer.write(record)
+        return writer.shards
+
+
+def _merge_shard(task: Tuple[int, List[ShardSpan]], config: Config) -> ShardInfo:
+    idx, spans = task
+    filename = fixed_shard_filename(config.tfrecord_path, config.shard_name, idx, config.num_shards)
+    with profiled(config.profile, f"merge-{idx:04d}"):
+        return merge_shard_spans(
+            spans,
+            filename,
+            compression_type=config.compression_type,
+            backend=config.writer_backend,
+            compression_level=config.compression_level,
+            compression_threads=config.compression_threads,
+            index=config.record_index,
+        )
 
 
 class Worker:
     def __init__(self, config: Config, log: bool = True):
         self.config: Config = config
-        self.log: bool = True
+        self.log: bool = log
+        #: Metrics of the run, merged from every pool task
+        self.metrics: Metrics = Metrics()
+        #: Shards removed by the conversion, of changed, deleted or failed inputs, to delete from the bucket too
+        self.removed_shards: List[str] = []
 
-    async def run(self) -> Awaitable[None]:
-        if self.config.exec_mode == ExecutionMode.CONVERT_AND_UPLOAD:
-            pass
-        elif self.config.exec_mode == ExecutionMode.CONVERT:
-            await self.convert()
-        else:
-            await self.upload()
+    async def run(self) -> Awaitable[int]:
+        """
+        Run the configured mode, and return the exit code,
+        which is 1 if the verification, the conversion of any file or the upload of any file failed.
+        """
+        if not FAST_CRC32C:
+            logging.warning("google-crc32c is not installed, so every checksum is computed in pure Python, slowly")
+        started = time.perf_counter()
+        try:
+            if self.config.exec_mode == ExecutionMode.CONVERT_AND_UPLOAD:
+                await self.convert_and_upload()
+            elif self.config.exec_mode == ExecutionMode.CONVERT:
+                await self.convert()
+            elif self.config.exec_mode == ExecutionMode.VERIFY:
+                return 0 if await self.verify() else 1
+            elif self.config.exec_mode == ExecutionMode.MERGE_MANIFESTS:
+                return 0 if await self.merge_manifests() else 1
+            else:
+                await self.upload()
+            # Failed uploads are only logged and counted, so files are not left behind by a single failure
+            return 1 if self.metrics.counters["files_failed"] or self.metrics.counters["upload_failures"] else 0
+        finally:
+            self.metrics.time("total", time.perf_counter() - started)
+            self.report()
+
+    def report(self):
+        """Log the metrics, and write them and the merged profile into the configured paths."""
+        summary = self.metrics.summary()
+        self._log("Metrics: " + ", ".join(f"{name}={value:g}" for name, value in sorted(summary["counters"].items())))
+        self._log("Seconds: " + ", ".join(f"{stage}={value:.2f}" for stage, value in sorted(summary["timers"].items())))
+        if self.config.metrics_path:
+            self.metrics.write_json(self.config.metrics_path)
+        if self.config.prometheus_path:
+            self.metrics.write_prometheus(self.config.prometheus_path)
+        if self.config.profile:
+            report = merge_profiles(self.config.profile)
+            if report is not None:
+                self._log(f"Profile of the conversion tasks is written into {self.config.profile}\n{report}")
 
     async def convert_and_upload(self) -> Awaitable[None]:
-        # TODO: Convert and upload simultaneously; with asyncio Queue
-        await self.convert()
-        await self.upload()
+        """
+        Convert and upload simultaneously. Every shard is queued for upload as soon as it is written,
+        and conversion pauses while `upload_queue_size` shards are already waiting.
+        With `diskless`, pool workers stream every shard into the bucket as they write it instead.
+        Blobs of the shards removed by the conversion, of changed, deleted or failed inputs, are deleted at the end.
+        """
+        # Imported here, so converting alone never loads the Google Cloud client libraries
+        from .upload import Uploader
 
-    async def convert(self) -> Awaitable[None]:
-        self._log(f"Obtaining filenames from from_path...")
-        filenames = get_filenames(self.config.from_path)
+        loop = asyncio.get_event_loop()
+        num_uploaders = self.config.upload_concurrency
+        # Makes the bucket if not exist, before pool workers stream into it
+        uploader = Uploader(self.config, metrics=self.metrics)
+
+        if self.config.diskless:
+            # Every shard is already in the bucket once converted
+            shards = await self.convert()
+            results = [len(shards)]
+        else:
+            upload_queue = asyncio.Queue(maxsize=self.config.upload_queue_size)
+            with multiprocessing.Manager() as manager, ThreadPoolExecutor(num_uploaders) as executor:
+                # Pool workers put manifests into this queue, and block while it is full
+                shard_queue = manager.Queue(maxsize=self.config.upload_queue_size)
+                relay = asyncio.ensure_future(self._relay_shards(shard_queue, upload_queue, num_uploaders))
+                uploads = [
+                    asyncio.ensure_future(self._upload_from_queue(upload_queue, uploader, executor))
+                    for _ in range(num_uploaders)
+                ]
+                try:
+                    shards = await self.convert(shard_queue)
+                finally:
+                    await loop.run_in_executor(None, shard_queue.put, None)
+                    await relay
+                results = await asyncio.gather(*uploads)
+
+        # Vocabularies are needed along with the shards to read them, and kept for the next run.
+        # Statistics describe the shards, so they go along with them too.
+        paths = [vocab_path(self.config, column) for column in built_vocabulary_columns(self.config)]
+        if self.config.stats and os.path.exists(stats_path(self.config)):
+            paths.append(stats_path(self.config))
+        if paths:
+            await loop.run_in_executor(None, uploader.upload_files, paths)
+
+        self._log(f"{sum(results)} / {len(shards)} files were uploaded")
+
+        removed = list(self.removed_shards)
+        if self.config.num_shards or self.config.shuffle_buckets:
+            # Every shard of the previous run is replaced, including those only left in the bucket
+            pattern = f"{self.config.shard_name}.*.tfrecord"
+            removed += await loop.run_in_executor(None, uploader.blob_names, pattern)
+        # Shards of a changed input may be written under the same names again, which are kept
+        written = {os.path.basename(shard.path) for shard in shards}
+        removed = [path for path in removed if os.path.basename(path) not in written]
+        if removed:
+            deleted = await loop.run_in_executor(
+                None, uploader.delete_blobs, removed + [index_filename(path) for path in removed]
+            )
+            self._log(f"{deleted} stale files were deleted from the bucket")
+
+    async def convert(self, shard_queue: Optional[Queue] = None) -> Awaitable[List[ShardInfo]]:
+        return await asyncio.get_event_loop().run_in_executor(None, self._convert, shard_queue)
+
+    def _convert(self, shard_queue: Optional[Queue] = None) -> List[ShardInfo]:
+        self._log("Obtaining filenames from from_path...")
+        filenames = sorted(get_filenames(self.config.from_path))
         self._log(f"{len(filenames)} files were found")
-        pool_size = min(self.config.max_pool_size, len(filenames))
-
-        self._log(f"Start to convert with pool size {pool_size}")
-        with multiprocessing.Pool(pool_size) as pool:
-            converter = Converter(self.config)
-            argument_pack = zip(filenames, itertools.repeat(self.config))
-            results = list(
-                tqdm.tqdm(
-                    pool.imap_unordered(converter.convert_one_file, argument_pack, chunksize=self.config.chunk_size),
-                    total=len(filenames),
-                )
+        os.makedirs(self.config.tfrecord_path, exist_ok=True)
+        # Every node counts the whole dataset, so the IDs of the values are the same in every partition
+        vocabularies = self._build_vocabularies(filenames)
+        if self.config.num_partitions > 1:
+            filenames = [
+                filename
+                for filename in filenames
+                if partition_of(filename, self.config.num_partitions) == self.config.partition_index
+            ]
+            self._log(f"{len(filenames)} files are in partition {self.config.partition_index}")
+        if self.config.num_shards:
+            return self._convert_fixed_shards(filenames, shard_queue, vocabularies)
+        if self.config.shuffle_buckets:
+            return self._convert_shuffled(filenames, shard_queue, vocabularies)
+
+        manifest = Manifest.load(self.config, full=self.config.full_convert)
+        tasks, stale = manifest.plan(filenames)
+        # Shards which the manifest does not track, such as those of `num_shards` or `shuffle_buckets`,
+        # would be read along with the tracked ones
+        known = {os.path.basename(path) for path in stale} | {
+            os.path.basename(shard.path)
+            for entry in manifest.inputs.values()
+            if entry.complete
+            for shard in entry.shards
+        }
+        pattern = os.path.join(self.config.tfrecord_path, f"{self.config.shard_name}.*.tfrecord")
+        stale += [path for path in get_filenames(pattern) if os.path.basename(path) not in known]
+        for path in stale:
+            if os.path.exists(path):
+                remove_shard(path)
+        self.removed_shards.extend(stale)
+        manifest.save()
+        self._log(f"{len(tasks)} files are new or changed, {len(stale)} stale files were removed")
+        if not tasks:
+            self._save_stats(manifest.stats(self.config.columns))
+            return []
+        tasks = self._split_tasks(tasks)
+        pool_size = min(self.config.max_pool_size, len(tasks))
+
+        # Each task writes its own shards, so only the small manifests come back to this process
+        self._log(f"Start to convert {len(tasks)} tasks with pool size {pool_size}")
+        shards = []
+        num_parts = collections.Counter(task.path for task in tasks)
+        parts: Dict[str, List[TaskResult]] = collections.defaultdict(list)
+        saved_at = time.monotonic()
+        with multiprocessing.Pool(
+            pool_size, initializer=_init_pool, initargs=(self.config, shard_queue, vocabularies)
+        ) as pool:
+            for result in self._imap_tasks(pool, _convert_task, tasks):
+                self.metrics.merge(result.metrics)
+                # A file is complete once every byte range of it is converted
+                parts[result.path].append(result)
+                if len(parts[result.path]) == num_parts[result.path]:
+                    results = parts.pop(result.path)
+                    if not self._check_results(results):
+                        # Truncated shards are removed, and the file stays pending to be converted by the next run
+                        for path in [shard.path for part in results for shard in part.shards]:
+                            if os.path.exists(path):
+                                remove_shard(path)
+                            self.removed_shards.append(path)
+                        continue
+                    shards.extend(shard for part in results for shard in part.shards)
+                    stats = self._merge_stats(results)
+                    manifest.complete(
+                        result.path,
+                        sorted(shard for part in results for shard in part.shards),
+                        combine_digests([part.sha256 for part in sorted(results, key=lambda part: part.part or 0)]),
+                        stats.to_state() if stats is not None else None,
+                    )
+                # Save once in a while, so an interrupted run can resume without converting finished files again
+                if time.monotonic() - saved_at >= MANIFEST_SAVE_INTERVAL:
+                    manifest.save()
+                    saved_at = time.monotonic()
+        manifest.save()
+        # Files converted by the previous runs are counted from their statistics in the manifest
+        self._save_stats(manifest.stats(self.config.columns))
+
+        self._log(f"All {sum(shard.num_records for shard in shards)} records are converted into {len(shards)} files")
+        return shards
+
+    def _convert_fixed_shards(
+        self,
+        filenames: List[str],
+        shard_queue: Optional[Queue] = None,
+        vocabularies: Optional[Dict[str, Dict[str, int]]] = None,
+    ) -> List[ShardInfo]:
+        """
+        Convert every file into `num_shards` shards. Each file is converted into an uncompressed staging file first,
+        then contiguous spans of the staged records are merged into the final shards in parallel,
+        so the output only depends on the input, not on which worker finished first.
+        """
+        config = self.config
+        staging_path = os.path.join(config.tfrecord_path, f".{config.shard_name}.staging")
+        # Outputs of the previous run cannot be reused, as any change moves the boundaries of every shard
+        for path in get_filenames(os.path.join(config.tfrecord_path, f"{config.shard_name}.*.tfrecord")):
+            remove_shard(path)
+            self.removed_shards.append(path)
+        if os.path.exists(manifest_path(config)):
+            os.remove(manifest_path(config))
+        shutil.rmtree(staging_path, ignore_errors=True)
+        os.makedirs(staging_path)
+        if not filenames:
+            return []
+        staging_config = config._replace(
+            to_path=os.path.join(staging_path, ""),
+            compression_type="",
+            batch_size=0,
+            target_shard_bytes=0,
+            # Each final shard seeks straight to its span of the staged records through the index
+            record_index=True,
+        )
+
+        tasks = self._split_tasks(list(enumerate(filenames)))
+        self._log(f"Start to convert {len(tasks)} tasks into {config.num_shards} files")
+        staged, shards = [], []
+        pool_size = min(config.max_pool_size, max(len(tasks), config.num_shards))
+        with multiprocessing.Pool(
+            pool_size, initializer=_init_pool, initargs=(staging_config, None, vocabularies)
+        ) as pool:
+            results = []
+            for result in self._imap_tasks(pool, _convert_task, tasks):
+                staged.extend(result.shards)
+                self._merge_staging_metrics(result.metrics)
+                results.append(result)
+            if not self._check_results(results):
+                # Shards without the failed files would silently miss their records
+                self._log(f"No shards are written, as {self.metrics.counters['files_failed']:g} files failed")
+                shutil.rmtree(staging_path)
+                return []
+            self._save_stats(self._merge_stats(results))
+
+            # Staged files are named after the input and the byte range, so sorting them restores the input order
+            plans = plan_fixed_shards(sorted(staged), config.num_shards)
+            merge = functools.partial(_merge_shard, config=config)
+            with self.metrics.timer("merge"):
+                for shard in tqdm.tqdm(pool.imap_unordered(merge, enumerate(plans)), total=len(plans)):
+                    shards.append(shard)
+                    if shard_queue is not None:
+                        shard_queue.put(shard)
+        shutil.rmtree(staging_path)
+        self.metrics.count("shards_written", len(shards))
+        self.metrics.count("bytes_written", sum(shard.num_bytes for shard in shards))
+
+        self._log(f"All {sum(shard.num_records for shard in shards)} records are converted into {len(shards)} files")
+        return shards
+
+    def _convert_shuffled(
+        self,
+        filenames: List[str],
+        shard_queue: Optional[Queue] = None,
+        vocabularies: Optional[Dict[str, Dict[str, int]]] = None,
+    ) -> List[ShardInfo]:
+        """
+        Convert every file with an external global shuffle. Records of each file are scattered into
+        `shuffle_buckets` files on disk by random key first, then each bucket is shuffled in memory
+        and written into its own shards, so the memory of each process is bounded by the size of a bucket.
+        Random keys only depend on the seed and the input, so the same input is shuffled the same way on every run.
+        """
+        config = self.config
+        staging_path = os.path.join(config.tfrecord_path, f".{config.shard_name}.shuffle")
+        # Outputs of the previous run cannot be reused, as any change moves records across every shard
+        for path in get_filenames(os.path.join(config.tfrecord_path, f"{config.shard_name}.*.tfrecord")):
+            remove_shard(path)
+            self.removed_shards.append(path)
+        if os.path.exists(manifest_path(config)):
+            os.remove(manifest_path(config))
+        shutil.rmtree(staging_path, ignore_errors=True)
+        os.makedirs(staging_path)
+        if not filenames:
+            return []
+        staging_config = config._replace(to_path=os.path.join(staging_path, ""))
+
+        tasks = self._split_tasks(list(enumerate(filenames)))
+        self._log(f"Start to scatter {len(tasks)} tasks into {config.shuffle_buckets} buckets")
+        shards = []
+        pool_size = min(config.max_pool_size, max(len(tasks), config.shuffle_buckets))
+        with multiprocessing.Pool(
+            pool_size, initializer=_init_pool, initargs=(staging_config, None, vocabularies)
+        ) as pool:
+            results = []
+            for result in self._imap_tasks(pool, _scatter_task, tasks):
+                self._merge_staging_metrics(result.metrics)
+                results.append(result)
+            if not self._check_results(results):
+                # Shards without the failed files would silently miss their records
+                self._log(f"No shards are written, as {self.metrics.counters['files_failed']:g} files failed")
+                shutil.rmtree(staging_path)
+                return []
+            self._save_stats(self._merge_stats(results))
+
+            shuffle = functools.partial(_shuffle_bucket, config=config, staging_path=staging_path)
+            with self.metrics.timer("shuffle"):
+                for bucket_shards in tqdm.tqdm(
+                    pool.imap_unordered(shuffle, range(config.shuffle_buckets)), total=config.shuffle_buckets
+                ):
+                    shards.extend(bucket_shards)
+                    if shard_queue is not None:
+                        for shard in bucket_shards:
+                            shard_queue.put(shard)
+        shutil.rmtree(staging_path)
+        self.metrics.count("shards_written", len(shards))
+        self.metrics.count("bytes_written", sum(shard.num_bytes for shard in shards))
+
+        self._log(f"All {sum(shard.num_records for shard in shards)} records are converted into {len(shards)} files")
+        return shards
+
+    def _merge_staging_metrics(self, summary: Dict[str, Dict[str, float]]):
+        """Merge the metrics of a task which only writes staging files, counting them apart from the shards."""
+        counters = {STAGING_COUNTERS.get(name, name): value for name, value in summary["counters"].items()}
+        self.metrics.merge({**summary, "counters": counters})
+
+    def _check_results(self, results: List[TaskResult]) -> bool:
+        """Log and count the files whose conversion failed, and return whether every task succeeded."""
+        failed = {result.path: result.error for result in results if result.error is not None}
+        for path, error in sorted(failed.items()):
+            logging.error(f"Conversion of {path} failed: {error}")
+        if failed:
+            self.metrics.count("files_failed", len(failed))
+        return not failed
+
+    def _merge_stats(self, results: List[TaskResult]) -> Optional[DatasetStats]:
+        """Merge the statistics of the tasks, or None if they are not collected."""
+        if not self.config.stats:
+            return None
+        stats = DatasetStats(self.config.columns)
+        for result in results:
+            stats.merge(result.stats)
+        return stats
+
+    def _save_stats(self, stats: Optional[DatasetStats]):
+        """Write the summary of the statistics next to the shards, if they are collected."""
+        if not self.config.stats or stats is None:
+            return
+        path = stats_path(self.config)
+        stats.save(path)
+        self._log(f"Statistics of {stats.num_rows} rows are written into {path}")
+
+    def _build_vocabularies(self, filenames: List[str]) -> Dict[str, Dict[str, int]]:
+        """
+        Count the values of every column whose vocabulary is built over the dataset in the pool,
+        merging the counts of each task here, and write the vocabulary of each column next to the shards.
+        Only files which are new or changed since the last run are counted, and their new values are appended
+        to the vocabulary, so the IDs of the values counted before never change.
+        Vocabularies given as `vocab_file` are loaded as they are.
+
+        :return: IDs by value of every column encoded as IDs, by name
+        """
+        config = self.config
+        vocabularies = {
+            column.name: load_vocabulary(vocab_path(config, column))
+            for column in vocabulary_columns(config)
+            if column.vocab_file is not None
+        }
+        columns = built_vocabulary_columns(config)
+        if not columns:
+            return vocabularies
+
+        current = {}
+        for path in filenames:
+            stat = os.stat(path)
+            current[path] = [stat.st_size, stat.st_mtime_ns]
+        states = {}
+        for column in columns:
+            state = None if config.full_convert else load_vocabulary_state(vocab_state_path(config, column))
+            if state is not None and (
+                state.settings != vocabulary_settings(column) or not os.path.exists(vocab_path(config, column))
+            ):
+                state = None
+            states[column.name] = state
+        # Files counted by the previous runs as they are now only have values which are counted already
+        pending = {
+            name: {path for path in filenames if state is None or state.inputs.get(path) != current[path]}
+            for name, state in states.items()
+        }
+
+        tasks = self._split_tasks(list(enumerate(sorted(set().union(*pending.values())))))
+        counts = {column.name: collections.Counter() for column in columns}
+        if tasks:
+            self._log(f"Start to build vocabularies of {len(columns)} columns from {len(tasks)} tasks")
+            count = functools.partial(_count_task, config=config)
+            with multiprocessing.Pool(min(config.max_pool_size, len(tasks))) as pool, self.metrics.timer("vocabulary"):
+                for path, result in self._imap_tasks(pool, count, tasks):
+                    for name, counter in result.items():
+                        if path in pending[name]:
+                            counts[name].update(counter)
+
+        for column in columns:
+            state, path = states[column.name], vocab_path(config, column)
+            existing = list(load_vocabulary(path)) if state is not None else []
+            vocabulary = build_vocabulary(counts[column.name], column.min_count, column.max_vocab_size, existing)
+            if state is None or len(vocabulary) > len(existing):
+                save_vocabulary(path, vocabulary)
+            kept = set(vocabulary)
+            complete = all(value in kept for value in counts[column.name])
+            if state is None or (len(vocabulary) > len(existing) and not state.complete):
+                # Values out of the vocabulary were converted as the ID which a new value has now
+                generation = file_digest(path)
+            else:
+                generation = state.generation
+            save_vocabulary_state(
+                vocab_state_path(config, column),
+                VocabularyState(
+                    vocabulary_settings(column),
+                    generation,
+                    complete and (state is None or state.complete),
+                    current,
+                ),
+            )
+            self._log(
+                f"Vocabulary of {column.name} has {len(vocabulary)} values, "
+                + f"{len(vocabulary) - len(existing)} of {len(counts[column.name])} counted values are new"
+            )
+            vocabularies[column.name] = {value: idx for idx, value in enumerate(vocabulary)}
+        return vocabularies
+
+    def _imap_tasks(self, pool: Pool, func: Callable[[ConvertTask], T], tasks: List[ConvertTask]) -> Iterator[T]:
+        """
+        Run the tasks in the pool in groups planned by `task_bytes`, largest first, or by `chunk_size`.
+        Each idle worker pulls the next group as soon as it finishes one. Results are yielded as groups complete.
+        """
+        groups = plan_task_groups(tasks, self.config.task_bytes, self.config.chunk_size)
+        with tqdm.tqdm(total=len(tasks)) as progress:
+            for results in pool.imap_unordered(functools.partial(run_group, func=func), groups):
+                progress.update(len(results))
+                yield from results
+
+    def _split_tasks(self, tasks: List[Tuple[int, str]]) -> List[ConvertTask]:
+        """Split the task of each file larger than `split_bytes` into tasks of its byte ranges."""
+        split_tasks = []
+        for task_id, path in tasks:
+            ranges = split_file(path, self.config.split_bytes)
+            if len(ranges) == 1:
+                split_tasks.append(ConvertTask(task_id, path))
+                continue
+            split_tasks.extend(
+                ConvertTask(task_id, path, part, start, stop) for part, (start, stop) in enumerate(ranges)
             )
-        examples = [example for result in results for example in result[0]]
-        self._log(f"All {sum([item[1] for item in results])} records are converted")
-        self._log(f"Finished to convert. Saving files...")
+        return split_tasks
 
-        tfrecord_path = os.path.dirname(self.config.to_path)
-        os.makedirs(tfrecord_path, exist_ok=True)
-        for idx, example_batch in enumerate(batch(examples, self.config.batch_size)):
-            filename = tfrecord_path + f"/{self.config.name}.{idx:04d}.tfrecord"
-            save_tfrecord_file(example_batch, filename, compression_type=self.config.compression_type)
+    async def _relay_shards(
+        self, shard_queue: Queue, upload_queue: asyncio.Queue, num_uploaders: int
+    ) -> Awaitable[None]:
+        """Move manifests from the pool workers into the upload queue, until `None` arrives."""
+        loop = asyncio.get_event_loop()
+        while True:
+            shard = await loop.run_in_executor(None, shard_queue.get)
+            if shard is None:
+                break
+            self.metrics.observe("shard_queue_depth_max", await loop.run_in_executor(None, shard_queue.qsize))
+            await upload_queue.put(shard)
+            self.metrics.observe("upload_queue_depth_max", upload_queue.qsize())
+        for _ in range(num_uploaders):
+            await upload_queue.put(None)
 
-        self._log(f"Finished to save.")
+    async def _upload_from_queue(
+        self, upload_queue: asyncio.Queue, uploader: "Uploader", executor: ThreadPoolExecutor
+    ) -> Awaitable[int]:
+        """Upload shards from the queue until `None` arrives, and return the number of uploaded files."""
+        loop = asyncio.get_event_loop()
+        uploaded = 0
+        while True:
+            shard = await upload_queue.get()
+            if shard is None:
+                return uploaded
+            uploaded += await loop.run_in_executor(
+                executor, uploader.upload_file, shard.path, self.config.delete_after_upload
+            )
+            if self.config.record_index:
+                await loop.run_in_executor(
+                    executor, uploader.upload_file, index_filename(shard.path), self.config.delete_after_upload
+                )
 
     async def upload(self) -> Awaitable[None]:
-        self._log(f"Obtaining filenames from to_path...")
-        filenames = get_filenames(self.config.to_path)
+        from .upload import Uploader
+
+        self._log("Obtaining filenames from to_path...")
+        filenames = sorted(
+            get_filenames(os.path.join(self.config.tfrecord_path, "*.tfrecord"))
+            + get_filenames(os.path.join(self.config.tfrecord_path, "*.tfrecord" + INDEX_SUFFIX))
+            + get_filenames(os.path.join(self.config.tfrecord_path, f"{self.config.name}.*.vocab"))
+            + get_filenames(os.path.join(self.config.tfrecord_path, f"{self.config.name}*.stats.json"))
+        )
         self._log(f"{len(filenames)} files were found")
-        pool_size = min(self.config.max_pool_size, len(filenames))
-
-        self._log(f"Start to upload with pool size {pool_size}")
-        with multiprocessing.Pool(pool_size) as pool:
-            uploader = Uploader(self.config)
-            results = list(
-                tqdm.tqdm(
-                    pool.imap_unordered(
-                        lambda filename: uploader.upload_file(filename), filenames, chunksize=self.config.chunk_size
-                    ),
-                    total=len(filenames),
-                )
+
+        self._log(f"Start to upload with {self.config.upload_concurrency} threads")
+        uploader = Uploader(self.config, metrics=self.metrics)
+        uploaded = await asyncio.get_event_loop().run_in_executor(
+            None, uploader.upload_files, filenames, self.config.delete_after_upload
+        )
+        self._log(f"{uploaded} / {len(filenames)} files were uploaded")
+
+        if self.config.delete_remote:
+            deleted = uploader.delete_stale_blobs(filenames)
+            self._log(f"{deleted} files which do not exist locally were deleted from the bucket")
+
+    async def verify(self) -> Awaitable[bool]:
+        return await asyncio.get_event_loop().run_in_executor(None, self._verify)
+
+    def _verify(self) -> bool:
+        """
+        Check every file of the dataset under `tfrecord_path` in the pool: framing and CRC of every record,
+        and every example against the columns. Log the record counts, sizes and the summary of each column.
+
+        :return: Whether every file is valid
+        """
+        config = self.config
+        self._log("Obtaining filenames from to_path...")
+        filenames = sorted(get_filenames(os.path.join(config.tfrecord_path, f"{config.name}.*.tfrecord")))
+        self._log(f"{len(filenames)} files were found")
+        if not filenames:
+            logging.error(f"No file of {config.name} to verify in {config.tfrecord_path}")
+            return False
+
+        columns = {column.name: ColumnSummary() for column in config.columns}
+        invalid = 0
+        verify = functools.partial(verify_shard, config=config)
+        pool_size = min(config.max_pool_size, len(filenames))
+        with multiprocessing.Pool(pool_size) as pool, self.metrics.timer("verify"):
+            for report in tqdm.tqdm(
+                pool.imap_unordered(verify, filenames, chunksize=config.chunk_size), total=len(filenames)
+            ):
+                self.metrics.count("shards_verified")
+                self.metrics.count("records_verified", report.num_records)
+                self.metrics.count("bytes_verified", report.num_bytes)
+                self.metrics.count("verify_errors", report.num_errors)
+                for name, summary in report.columns.items():
+                    columns[name] = columns[name].merge(summary)
+                if report.num_errors:
+                    invalid += 1
+                    logging.error(f"{report.num_errors} errors in {report.path}")
+                    for error in report.errors:
+                        logging.error(f"  {error}")
+
+        summary = self.metrics.summary()["counters"]
+        self._log(
+            f"{summary['records_verified']:g} records in {len(filenames)} files, "
+            + f"{summary['bytes_verified'] / 2**20:.1f} MiB in total"
+        )
+        for column in config.columns:
+            stats = columns[column.name]
+            if column.feature_type == FeatureType.TOKENIZED:
+                measure = "tokens"
+            else:
+                measure = "length" if FEATURE_KINDS[column.feature_type] == "bytes_list" else "value"
+            self._log(
+                f" * {column.name} ({column.feature_type.value}): {stats.count} values, "
+                + f"{measure} min {stats.min:g}, max {stats.max:g}, mean {stats.mean:g}"
             )
+        if invalid:
+            logging.error(f"{invalid} / {len(filenames)} files are invalid")
+        else:
+            self._log(f"All {len(filenames)} files are valid")
+        return not invalid
+
+    async def merge_manifests(self) -> Awaitable[bool]:
+        return await asyncio.get_event_loop().run_in_executor(None, self._merge_manifests)
+
+    def _merge_manifests(self) -> bool:
+        """
+        Merge the manifests of every partition into the manifest of the whole dataset.
 
-        self._log(f"{sum(results)} / {len(filenames)} files were uploaded")
+        :return: Whether every partition is converted completely with the same settings
+        """
+        config = self.config
+        try:
+            dataset = merge_manifests(config)
+        except ValueError as e:
+            logging.error(str(e))
+            return False
+        self._log(
+            f"{dataset['num_records']} records in {len(dataset['shards'])} files from {len(dataset['inputs'])} inputs "
+            + f"of {config.num_partitions} partitions are written into {dataset_manifest_path(config)}"
+        )
+        return True
 
-    def _log(self, *args, **kwargs):
+    def _log(self, msg: str, *args, **kwargs):
         if self.log:
-            logging.info(args, kwargs)
+            logging.info(msg, *args, **kwargs)